@@ -0,0 +1,70 @@
+"""
+Import-time budget check for `import coronagraph`.
+
+Imports the package in fresh interpreters, takes the fastest of several runs,
+and fails (exit status 1) if it exceeds the budget or if importing the
+package pulled in matplotlib or numba, which should only be imported when
+plotting or JIT-compiled functions are used.
+
+Usage
+-----
+    python benchmarks/check_import_time.py [--budget 1.0] [--repeat 5]
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run in a fresh interpreter: time the import and list heavy modules loaded
+SNIPPET = """
+import sys, json
+from timeit import default_timer as timer
+sys.path.insert(0, %r)
+t0 = timer()
+import coronagraph
+dt = timer() - t0
+heavy = sorted(m for m in ("matplotlib", "numba") if m in sys.modules)
+print(json.dumps({"time": dt, "heavy": heavy}))
+""" % ROOT
+
+def measure(repeat=5):
+    """
+    Return the fastest import time (s) over repeat fresh interpreters and
+    the heavy modules loaded by the import.
+    """
+    times = []
+    heavy = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, "-c", SNIPPET])
+        result = json.loads(out.decode("ascii").strip().split("\n")[-1])
+        times.append(result["time"])
+        heavy = result["heavy"]
+    return min(times), heavy
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--budget", type=float, default=1.0,
+                        help="maximum import time (s)")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of fresh interpreters to time")
+    args = parser.parse_args(argv)
+
+    dt, heavy = measure(args.repeat)
+    print("import coronagraph: %.3f s (budget %.3f s)" % (dt, args.budget))
+    ok = True
+    if dt > args.budget:
+        print("FAIL: import time over budget")
+        ok = False
+    if heavy:
+        print("FAIL: import loaded " + ", ".join(heavy))
+        ok = False
+    if ok:
+        print("OK")
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""
+Consistency check for `coronagraph.sweep`.
+
+Runs a small grid of telescopes, planets and stars through sweep(), serially
+and on a pool of worker processes, and fails (exit status 1) if any output
+differs from Instrument.evaluate() on the same target. One of the spectra
+has no stellar flux (starflux=None), so the blackbody fallback is covered.
+
+Usage
+-----
+    python benchmarks/check_sweep.py [--workers 2]
+"""
+from __future__ import print_function
+import os
+import sys
+import argparse
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import coronagraph as cg
+from coronagraph.noise_routines import Fstar
+
+PLANETDIR = os.path.join(ROOT, "coronagraph", "planets")
+
+# Output attributes compared
+FIELDS = ["lam", "dlam", "A", "Cratio", "cp", "csp", "cz", "cez", "cD",
+          "cR", "cth", "DtSNR"]
+
+class HiresSpectrum(object):
+    """
+    Minimal spectrum with wl, spec and starflux attributes.
+    """
+    def __init__(self, wl, spec, starflux=None):
+        self.wl = wl
+        self.spec = spec
+        self.starflux = starflux
+
+def inputs():
+    """
+    Grid axes: two telescopes, two planets (one spectrum without stellar
+    flux) and two stars.
+    """
+    m = np.loadtxt(os.path.join(PLANETDIR, "ArcheanEarth_geo_albedo.txt"))
+    lamhr = np.linspace(0.3, 2.6, 20000)
+    Ahr = np.interp(lamhr, m[:,0], m[:,1])
+    spectra = [HiresSpectrum(lamhr, Ahr, Fstar(lamhr, 5780., 1., 1., AU=True)),
+               HiresSpectrum(lamhr, Ahr)]
+    telescopes = [cg.Telescope(), cg.Telescope(D=16.)]
+    planets = [cg.Planet(), cg.Planet(d=5.)]
+    stars = [cg.Star(), cg.Star(Teff=5000., Rs=0.8)]
+    return telescopes, planets, stars, spectra
+
+def compare(outputs, telescopes, planets, stars, spectra):
+    """
+    Return the number of grid points whose output differs from
+    Instrument.evaluate().
+    """
+    nbad = 0
+    i = 0
+    for telescope in telescopes:
+        inst = cg.Instrument(telescope, SILENT=True)
+        for planet, spectrum in zip(planets, spectra):
+            for star in stars:
+                ref = inst.evaluate(planet, star, spectrum)
+                out = outputs[i]
+                i += 1
+                for field in FIELDS:
+                    a = np.asarray(getattr(ref, field))
+                    b = np.asarray(getattr(out, field))
+                    if (a.shape != b.shape) or not np.allclose(a, b, equal_nan=True):
+                        print("FAIL: %s differs (telescope %g m, planet at %g pc, "
+                              "starflux %s)" % (field, telescope.diameter,
+                                                planet.distance,
+                                                "None" if spectrum.starflux is None
+                                                else "given"))
+                        nbad += 1
+                        break
+    return nbad
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--workers", type=int, default=2,
+                        help="number of worker processes for the pooled run")
+    args = parser.parse_args(argv)
+
+    telescopes, planets, stars, spectra = inputs()
+    nbad = 0
+    for max_workers in (1, args.workers):
+        outputs = cg.sweep(telescopes, planets, stars, spectra,
+                           max_workers=max_workers)
+        n = compare(outputs, telescopes, planets, stars, spectra)
+        print("sweep(max_workers=%i): %i of %i grid points differ"
+              % (max_workers, n, len(outputs)))
+        nbad += n
+    if nbad == 0:
+        print("OK")
+    return 0 if nbad == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+"""
+Standalone benchmark runner for the coronagraph hot paths.
+
+Times each benchmark at several hi-res spectrum sizes and writes the results,
+with machine metadata, to a JSON file so that runs from different releases or
+machines can be compared.
+
+Usage
+-----
+    python benchmarks/run_benchmarks.py [--sizes 1e3,1e4,1e5,1e6,1e7]
+        [--repeat 5] [--only name1,name2] [--output results.json]
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import socket
+import platform
+import argparse
+import datetime
+import subprocess
+import contextlib
+import multiprocessing
+from timeit import default_timer as timer
+import numpy as np
+
+# Benchmark the package in this repository
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import coronagraph as cg
+from coronagraph import noise_routines
+from coronagraph.noise_routines import Fstar, construct_lam, f_airy_int
+
+PLANETDIR = os.path.join(ROOT, "coronagraph", "planets")
+
+# Planet, star and telescope parameters shared by the count rate engines
+alpha, Phi, Rp, Teff, Rs, r, d, Nez = 90., 1./np.pi, 1.0, 5780., 1.0, 1.0, 10., 1.
+lammin, lammax, Res = 0.4, 2.5, 70.
+
+################################
+# INPUTS
+################################
+
+def hires_inputs(N):
+    """
+    Archean Earth albedo and solar spectrum resampled onto N hi-res points
+    between 0.3 and 2.6 um.
+    """
+    m = np.loadtxt(os.path.join(PLANETDIR, "ArcheanEarth_geo_albedo.txt"))
+    lamhr = np.linspace(0.3, 2.6, int(N))
+    Ahr = np.interp(lamhr, m[:,0], m[:,1])
+    solhr = Fstar(lamhr, Teff, Rs, r, AU=True)
+    return lamhr, Ahr, solhr
+
+################################
+# BENCHMARKS
+################################
+# Each setup function takes the number of hi-res points (None for benchmarks
+# that do not depend on it) and returns the function to time.
+
+def setup_degrade_spec(N):
+    lamhr, Ahr, solhr = hires_inputs(N)
+    lam, dlam = construct_lam(lammin, lammax, Res)
+    return lambda: cg.degrade_spec(Ahr, lamhr, lam, dlam=dlam)
+
+def setup_downbin_spec(N):
+    lamhr, Ahr, solhr = hires_inputs(N)
+    lam, dlam = construct_lam(lammin, lammax, Res)
+    return lambda: cg.downbin_spec(Ahr, lamhr, lam, dlam=dlam)
+
+def setup_convolve_spec(N):
+    lamhr, Ahr, solhr = hires_inputs(N)
+    wheel = cg.filters.johnson_cousins()
+    return lambda: cg.convolve_spec(Ahr, lamhr, wheel)
+
+def setup_construct_lam(N):
+    def func():
+        # Time the grid computation, not a hit in its in-memory cache
+        noise_routines._lam_cache.clear()
+        construct_lam(lammin, lammax, Res)
+    return func
+
+def setup_f_airy_int(N):
+    X = np.linspace(0.1, 10., 1000)
+    def func():
+        # Time a new process's first call, which loads the table from disk
+        noise_routines._airy_cache.clear()
+        f_airy_int(X)
+    return func
+
+def setup_airy_table(N):
+    # Computing the f_airy_int table itself (first use on a machine)
+    return lambda: noise_routines._airy_table("square", 0., 0.01, 10.)
+
+def setup_count_rates(N):
+    lamhr, Ahr, solhr = hires_inputs(N)
+    return lambda: cg.count_rates(Ahr, lamhr, solhr, alpha, Phi, Rp, Teff, Rs,
+                                  r, d, Nez, lammin=lammin, lammax=lammax, Res=Res)
+
+def setup_count_rates_new(N):
+    lamhr, Ahr, solhr = hires_inputs(N)
+    return lambda: cg.count_rates_new(Ahr, lamhr, solhr, alpha, Phi, Rp, Teff,
+                                      Rs, r, d, Nez, lammin=lammin,
+                                      lammax=lammax, Res=Res)
+
+def setup_make_noise(N):
+    lamhr, Ahr, solhr = hires_inputs(N)
+    telescope = cg.Telescope(lammin=lammin, lammax=lammax, R=Res)
+    planet = cg.Planet(alpha=alpha, Rp=Rp, a=r, d=d, Nez=Nez)
+    star = cg.Star(Teff=Teff, Rs=Rs)
+    return lambda: cg.make_noise(Ahr, lamhr, solhr, telescope, planet, star,
+                                 COMPUTE_LAM=True)
+
+def setup_generate_observation(N):
+    lamhr, Ahr, solhr = hires_inputs(N)
+    telescope = cg.Telescope(lammin=lammin, lammax=lammax, R=Res)
+    planet = cg.Planet(alpha=alpha, Rp=Rp, a=r, d=d, Nez=Nez)
+    star = cg.Star(Teff=Teff, Rs=Rs)
+    def func():
+        # Bypass the memoized count rates so every call does the full work
+        cg.result_cache.clear()
+        cg.generate_observation(lamhr, Ahr, solhr, 10., telescope, planet,
+                                star, plot=False)
+    return func
+
+# name : (setup, sized)
+BENCHMARKS = [
+    ("degrade_spec", setup_degrade_spec, True),
+    ("downbin_spec", setup_downbin_spec, True),
+    ("convolve_spec", setup_convolve_spec, True),
+    ("construct_lam", setup_construct_lam, False),
+    ("f_airy_int", setup_f_airy_int, False),
+    ("airy_table", setup_airy_table, False),
+    ("count_rates", setup_count_rates, True),
+    ("count_rates_new", setup_count_rates_new, True),
+    ("make_noise", setup_make_noise, True),
+    ("generate_observation", setup_generate_observation, True),
+]
+
+################################
+# RUNNER
+################################
+
+def time_function(func, repeat):
+    """
+    Call func repeat times (silencing its printed warnings) and return the
+    wall-clock time of each call in seconds.
+    """
+    times = []
+    for i in range(repeat):
+        with quiet():
+            t0 = timer()
+            func()
+            times.append(timer() - t0)
+    return times
+
+@contextlib.contextmanager
+def quiet():
+    """
+    Send anything printed to stdout to os.devnull.
+    """
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+def machine_metadata():
+    """
+    Describe the machine and software versions the benchmarks ran with.
+    """
+    meta = {
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "hostname": socket.gethostname(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": multiprocessing.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+    }
+    for mod in ("scipy", "numba", "matplotlib"):
+        try:
+            meta[mod] = __import__(mod).__version__
+        except ImportError:
+            meta[mod] = None
+    try:
+        meta["git_commit"] = subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT,
+            stderr=subprocess.STDOUT).decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        meta["git_commit"] = None
+    return meta
+
+def run(sizes, repeat=5, only=None):
+    """
+    Run the benchmarks and return the results as a list of dicts.
+    """
+    results = []
+    for name, setup, sized in BENCHMARKS:
+        if only and name not in only:
+            continue
+        for N in (sizes if sized else [None]):
+            try:
+                func = setup(N)
+                times = time_function(func, repeat)
+            except Exception as e:
+                # Record failures (e.g. out of memory at large N) and move on
+                results.append({"name": name, "N": N, "error": repr(e)})
+                print("%-24s N=%-10s failed: %r" % (name, N, e))
+                continue
+            result = {
+                "name": name,
+                "N": N,
+                "repeat": repeat,
+                "first": times[0],
+                "min": min(times),
+                "median": float(np.median(times)),
+                "times": times,
+            }
+            results.append(result)
+            print("%-24s N=%-10s min %10.4g s   first %10.4g s" %
+                  (name, N, result["min"], result["first"]))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--sizes", default="1e3,1e4,1e5,1e6,1e7",
+                        help="comma separated numbers of hi-res points")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="number of timed calls per benchmark")
+    parser.add_argument("--only", default=None,
+                        help="comma separated benchmark names to run")
+    parser.add_argument("--output", default=None,
+                        help="JSON output file (default: benchmarks/results/<timestamp>.json)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(float(s)) for s in args.sizes.split(",")]
+    only = args.only.split(",") if args.only else None
+
+    meta = machine_metadata()
+    results = run(sizes, repeat=args.repeat, only=only)
+
+    output = args.output
+    if output is None:
+        outdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        output = os.path.join(outdir, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(output, "w") as f:
+        json.dump({"metadata": meta, "results": results}, f, indent=2)
+    print("Saved: " + output)
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,8 @@
 import numpy as np
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib import gridspec
-from matplotlib import rc
-rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
-mpl.rcParams['font.size'] = 20.0
-
-import readsmart
 from .make_noise import make_noise
 from .teleplanstar import Telescope, Planet, Star
+from .smart import read_rad
+from .utils import import_pyplot
 
 class Observe(object):
     """
@@ -28,7 +22,7 @@ class Observe(object):
     @classmethod
     def load_from_smart(cls, radpath, name=None):
         # Read-in .rad file
-        wlhr, wno, solar_spec, TOA_flux, rad_streams = readsmart.rad(radfile,getdata=True)
+        wlhr, wno, solar_spec, TOA_flux, rad_streams = read_rad(radpath)
 
         # Calculate Hi-res reflectivity spectrum
         Ahr = (TOA_flux / solar_spec) #* np.pi / planet.Phi
@@ -275,6 +269,7 @@ def planetzoo_observation(name='earth', telescope=Telescope(), planet=Planet(),
         if tmin < Amin: Amin = tmin
         if tmax > Amax: Amax = tmax
         plot_tag = 'observed_'+tag+'.pdf'
+        mpl, plt, gridspec = import_pyplot()
         fig = plt.figure(figsize=(15,10))
         gs = gridspec.GridSpec(1, 1)
         ax0 = plt.subplot(gs[0])
@@ -397,6 +392,7 @@ def generate_observation(wlhr, Ahr, solhr, itime, telescope, planet, star,
         if tmin < Amin: Amin = tmin
         if tmax > Amax: Amax = tmax
         plot_tag = 'observed_'+tag+'.pdf'
+        mpl, plt, gridspec = import_pyplot()
         fig = plt.figure(figsize=(15,10))
         gs = gridspec.GridSpec(1, 1)
         ax0 = plt.subplot(gs[0])
@@ -479,7 +475,7 @@ def smart_observation(radfile, itime, telescope, planet, star,
     """
 
     # Read-in .rad file
-    wlhr, wno, solar_spec, TOA_flux, rad_streams = readsmart.rad(radfile,getdata=True)
+    wlhr, wno, solar_spec, TOA_flux, rad_streams = read_rad(radfile)
 
     # Calculate Hi-res reflectivity spectrum
     Ahr = (TOA_flux / solar_spec) #* np.pi / planet.Phi
@@ -530,6 +526,7 @@ def smart_observation(radfile, itime, telescope, planet, star,
         if tmax > Amax: Amax = tmax
         #ymin,ymax = np.min(A), np.max(A)
         plot_tag = 'observed_smart_'+tag+'.pdf'
+        mpl, plt, gridspec = import_pyplot()
         fig = plt.figure(figsize=(15,10))
         gs = gridspec.GridSpec(1, 1)
         ax0 = plt.subplot(gs[0])
@@ -597,6 +594,7 @@ def plot_spec():
     if tmax > Amax: Amax = tmax
     #ymin,ymax = np.min(A), np.max(A)
     plot_tag = 'observed_smart_'+tag+'.pdf'
+    mpl, plt, gridspec = import_pyplot()
     fig = plt.figure(figsize=(15,10))
     gs = gridspec.GridSpec(1, 1)
     ax0 = plt.subplot(gs[0])
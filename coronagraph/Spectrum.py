@@ -1,5 +1,5 @@
 import numpy as np
-import readsmart as rs
+from .smart import read_rad
 
 class Spectrum(object):
 
@@ -18,8 +18,8 @@ class Spectrum(object):
             print("Incompatible input file.")
             return
 
-        # Read-in .rad file with readsmart
-        wlhr, wno, solar_spec, TOA_flux, rad_streams = readsmart.rad(radfile,getdata=True)
+        # Read-in .rad file
+        wlhr, wno, solar_spec, TOA_flux, rad_streams = read_rad(path)
 
         # Calculate Hi-res reflectivity spectrum
         Ahr = (TOA_flux / solar_spec) #* np.pi / planet.Phi
@@ -2,12 +2,22 @@ from .teleplanstar import Telescope, Planet, Star
 from .call_noise import call_noise
 from .make_noise import make_noise
 import observe
-from .observe import generate_observation, smart_observation, planetzoo_observation, process_noise, exptime_band, interp_cont_over_band
+from .observe import generate_observation, smart_observation, planetzoo_observation, process_noise, iter_noise, process_noise_poisson, exptime_band, interp_cont_over_band
 from .utils import Input
-from .degrade_spec import degrade_spec, downbin_spec
+from .degrade_spec import degrade_spec, downbin_spec, rebin_spec, RebinOperator, DownbinAccumulator
 import filters
-from .convolve_spec import convolve_spec
+from .convolve_spec import convolve_spec, FilterBank
 from .count_rates import count_rates
 from .count_rates_wrapper import count_rates_wrapper
 import noise_routines
 from .count_rates_new import count_rates_new
+from .instrument import Instrument
+from .sweep import sweep
+from .wavelength import WavelengthGrid
+from .planetlib import PlanetLibrary
+from .smart import read_rad, iter_rad, downbin_rad
+from .catalog import Catalog, exptime_catalog
+from .cache import ResultCache, result_cache, memoize, cached_count_rates, cached_count_rates_new, cached_make_noise
+from .incremental import IncrementalEvaluator
+from .orbit import Orbit, solve_kepler, orbit_geometry, phase_curve
+from .completeness import completeness, sample_orbits
@@ -0,0 +1,226 @@
+# Import dependent modules
+import numpy as np
+import os
+import glob
+import hashlib
+import inspect
+from functools import wraps
+from .utils import LRUCache, get_cache_dir
+from .count_rates import count_rates
+from .count_rates_new import count_rates_new
+from .make_noise import make_noise
+
+# Bump to invalidate results cached on disk by earlier versions
+CACHE_VERSION = "1"
+
+class ResultCache(object):
+    """
+    Two-tier cache of count rate results keyed by content hashes: an
+    in-memory LRU and an optional on-disk tier of one .npz file per key.
+
+    Parameters
+    ----------
+    maxsize : int (optional)
+        Maximum number of results held in memory
+    disk : bool (optional)
+        Also store results on disk
+    cachedir : str (optional)
+        Directory of the on-disk tier, get_cache_dir()/results by default
+    max_bytes : int (optional)
+        Maximum total size of the on-disk tier; the least recently used
+        files are deleted beyond it
+
+    Note
+    ----
+    Results are tuples of arrays. Copies are returned on every hit, so
+    callers may modify them freely.
+    """
+
+    def __init__(self, maxsize=32, disk=False, cachedir=None, max_bytes=2**30):
+        self.memory = LRUCache(maxsize=maxsize)
+        self.disk = disk
+        self.cachedir = cachedir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def directory(self):
+        if self.cachedir is None:
+            return os.path.join(get_cache_dir(), "results")
+        return self.cachedir
+
+    def get(self, key):
+        """
+        Cached result for key, or None.
+        """
+        result = self.memory.get(key)
+        if result is None and self.disk:
+            result = self._load(key)
+            if result is not None:
+                self.memory.set(key, result)
+        if result is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return tuple(np.array(x) for x in result)
+
+    def set(self, key, result):
+        """
+        Store a result (a tuple of arrays) under key.
+        """
+        result = tuple(np.array(x) for x in result)
+        self.memory.set(key, result)
+        if self.disk:
+            self._save(key, result)
+
+    def clear(self, disk=False):
+        """
+        Empty the memory tier, and the on-disk tier if disk=True.
+        """
+        self.memory.clear()
+        if disk:
+            for fn in glob.glob(os.path.join(self.directory, "*.npz")):
+                _remove(fn)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _load(self, key):
+        fn = self._path(key)
+        try:
+            with np.load(fn) as data:
+                result = tuple(data["r%i" % i] for i in range(len(data.files)))
+            # Mark as recently used for eviction
+            os.utime(fn, None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return result
+
+    def _save(self, key, result):
+        # Object arrays (e.g. None entries) can't be saved without pickling
+        if any(x.dtype == object for x in result):
+            return False
+        fn = self._path(key)
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            tmp = "%s.%d.tmp" % (fn, os.getpid())
+            with open(tmp, "wb") as f:
+                np.savez(f, **dict(("r%i" % i, x) for i, x in enumerate(result)))
+            os.rename(tmp, fn)
+        except (IOError, OSError):
+            return False
+        self._evict()
+        return True
+
+    def _evict(self):
+        # Delete the least recently used files beyond max_bytes
+        files = []
+        for fn in glob.glob(os.path.join(self.directory, "*.npz")):
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, fn))
+        total = sum(f[1] for f in files)
+        for mtime, size, fn in sorted(files):
+            if total <= self.max_bytes:
+                break
+            _remove(fn)
+            total -= size
+
+# Cache shared by the memoized count rate functions
+result_cache = ResultCache()
+
+def hash_args(*args, **kwargs):
+    """
+    Stable hex digest of arbitrary arguments: arrays by their contents,
+    numbers and strings by value, and objects (Telescope, Planet, Star,
+    filter wheels, ...) by their class and attributes.
+    """
+    h = hashlib.sha1()
+    _update_hash(h, args)
+    _update_hash(h, kwargs)
+    return h.hexdigest()
+
+def memoize(func, cache=None, ignore=("profile",)):
+    """
+    Wrap a count rate function so that calls with identical inputs return
+    the cached result instead of recomputing it.
+
+    Parameters
+    ----------
+    func : function
+        Function returning a tuple of arrays
+    cache : ResultCache (optional)
+        Cache to use, result_cache by default
+    ignore : tuple (optional)
+        Arguments that bypass the cache when given (e.g. profile, which is
+        filled in as a side effect)
+
+    Returns
+    -------
+    wrapper : function
+        Memoized func
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        c = result_cache if cache is None else cache
+        if any(kwargs.get(name) is not None for name in ignore):
+            return func(*args, **kwargs)
+        # Bind arguments so that defaults and keywords hash consistently
+        try:
+            callargs = inspect.getcallargs(func, *args, **kwargs)
+        except TypeError:
+            return func(*args, **kwargs)
+        key = hash_args(CACHE_VERSION, func.__module__, func.__name__, callargs)
+        result = c.get(key)
+        if result is None:
+            result = func(*args, **kwargs)
+            if result is not None:
+                c.set(key, result)
+        return result
+    return wrapper
+
+cached_count_rates = memoize(count_rates)
+cached_count_rates_new = memoize(count_rates_new)
+cached_make_noise = memoize(make_noise)
+
+def _update_hash(h, obj):
+    """
+    Feed obj into hash h, recursing into containers and object attributes.
+    """
+    if obj is None or isinstance(obj, (bool, int, float, complex, str)) or \
+            np.isscalar(obj):
+        h.update(("%s:%r;" % (type(obj).__name__, obj)).encode("utf-8"))
+    elif isinstance(obj, np.ndarray):
+        a = np.ascontiguousarray(obj)
+        h.update(("ndarray%s%s;" % (a.dtype.str, a.shape)).encode("ascii"))
+        if a.dtype == object:
+            _update_hash(h, a.tolist())
+        else:
+            h.update(a.tobytes())
+    elif isinstance(obj, dict):
+        h.update(b"dict{")
+        for k in sorted(obj, key=str):
+            _update_hash(h, k)
+            _update_hash(h, obj[k])
+        h.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        h.update(("%s[" % type(obj).__name__).encode("ascii"))
+        for x in obj:
+            _update_hash(h, x)
+        h.update(b"]")
+    elif hasattr(obj, "__dict__"):
+        h.update(("%s.%s(" % (type(obj).__module__, type(obj).__name__)).encode("utf-8"))
+        _update_hash(h, vars(obj))
+        h.update(b")")
+    else:
+        h.update(("%s:%r;" % (type(obj).__name__, obj)).encode("utf-8"))
+
+def _remove(fn):
+    try:
+        os.remove(fn)
+    except OSError:
+        pass
@@ -0,0 +1,220 @@
+# Import dependent modules
+import numpy as np
+import os
+import csv
+from .teleplanstar import Planet, Star
+from .instrument import Instrument
+
+class Catalog(object):
+    """
+    Columnar table of targets, one row per star-planet pair.
+
+    Parameters
+    ----------
+    distance : array
+        Distance to system (pc)
+    Teff : array
+        Stellar effective temperature (K)
+    Rs : array
+        Stellar radius (solar radii)
+    Rp : array
+        Radius of planet (Earth Radii)
+    a : array
+        Semi-major axis (AU)
+    alpha : array (optional)
+        Phase angle (deg)
+    Nez : array (optional)
+        Number of exzodis (zodis)
+    names : array (optional)
+        Target names
+
+    Note
+    ----
+    Scalars are broadcast to the length of the catalog. Load catalogs from
+    text or binary tables with Catalog.load().
+    """
+
+    # Catalog columns, and the default value of optional ones
+    COLUMNS = ("distance", "Teff", "Rs", "Rp", "a", "alpha", "Nez")
+    DEFAULTS = {"alpha": 90., "Nez": 1.}
+
+    def __init__(self, distance, Teff, Rs, Rp, a, alpha=90., Nez=1., names=None):
+        values = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float))
+                                       for x in (distance, Teff, Rs, Rp, a, alpha, Nez)])
+        for col, x in zip(self.COLUMNS, values):
+            setattr(self, col, np.array(x))
+        if names is None:
+            names = np.arange(len(self.distance)).astype(str)
+        self.names = np.asarray(names)
+
+    def __len__(self):
+        return len(self.distance)
+
+    def __getitem__(self, key):
+        # Column by name, or a sub-catalog of the selected rows
+        if isinstance(key, str):
+            return getattr(self, key)
+        return Catalog(names=self.names[key],
+                       **dict((col, getattr(self, col)[key]) for col in self.COLUMNS))
+
+    def __str__(self):
+        return 'Catalog: %i targets, %.3g-%.3g pc' \
+            % (len(self), np.min(self.distance), np.max(self.distance))
+
+    @classmethod
+    def load(cls, path, columns=None):
+        """
+        Load a catalog from a .csv (or other delimited text) file or from a
+        .npy structured array / .npz archive.
+
+        Parameters
+        ----------
+        path : str
+            Path to catalog file
+        columns : dict (optional)
+            Catalog column : file column name, for files whose column names
+            differ from Catalog.COLUMNS (e.g. {"distance": "sy_dist"})
+        """
+        ext = os.path.splitext(path)[1].lower()
+        if ext in (".npy", ".npz"):
+            return cls.from_npy(path, columns=columns)
+        return cls.from_csv(path, columns=columns)
+
+    @classmethod
+    def from_csv(cls, path, columns=None, delimiter=","):
+        """
+        Load a catalog from a delimited text file with a header row of
+        column names. Empty fields are read as NaN.
+        """
+        with open(path) as f:
+            rows = [row for row in csv.reader(f, delimiter=delimiter) if row]
+        header = [h.strip() for h in rows[0]]
+        table = {}
+        for i, h in enumerate(header):
+            table[h] = [row[i].strip() if i < len(row) else "" for row in rows[1:]]
+        return cls._from_table(table, columns)
+
+    @classmethod
+    def from_npy(cls, path, columns=None):
+        """
+        Load a catalog from a .npy structured array or a .npz archive of
+        columns.
+        """
+        data = np.load(path)
+        if hasattr(data, "files"):
+            table = dict((k, data[k]) for k in data.files)
+        else:
+            table = dict((k, data[k]) for k in data.dtype.names)
+        return cls._from_table(table, columns)
+
+    def save(self, path):
+        """
+        Save the catalog as a .npy structured array, which loads much faster
+        than text.
+        """
+        dtype = [(col, float) for col in self.COLUMNS] + \
+            [("name", self.names.astype(str).dtype)]
+        data = np.zeros(len(self), dtype=dtype)
+        for col in self.COLUMNS:
+            data[col] = getattr(self, col)
+        data["name"] = self.names.astype(str)
+        np.save(path, data)
+
+    @classmethod
+    def _from_table(cls, table, columns):
+        # Map file columns onto catalog columns
+        if columns is None:
+            columns = {}
+        kwargs = {}
+        for col in cls.COLUMNS:
+            key = columns.get(col, col)
+            if key in table:
+                kwargs[col] = _to_float(table[key])
+            elif col in cls.DEFAULTS:
+                kwargs[col] = cls.DEFAULTS[col]
+            else:
+                raise KeyError("Catalog column '%s' not found" % key)
+        key = columns.get("name", "name")
+        if key in table:
+            kwargs["names"] = np.asarray(table[key]).astype(str)
+        return cls(**kwargs)
+
+def exptime_catalog(catalog, telescope, spectrum, wantsnr=10.0, chunksize=4096,
+                    **kwargs):
+    """
+    Exposure time to reach a given SNR in each spectral element for every
+    target in a catalog.
+
+    Parameters
+    ----------
+    catalog : Catalog
+        Targets
+    telescope : Telescope or Instrument
+        Telescope object, or an Instrument to reuse
+    spectrum : Spectrum
+        Spectrum object (or any object with wl, spec and starflux
+        attributes) holding the hi-res wavelength grid (um), albedo spectrum
+        and TOA stellar flux (W/m**2/um) assumed for every planet. If
+        starflux is None, each target uses the blackbody flux of its star
+        at its semi-major axis instead.
+    wantsnr : float (optional)
+        Signal-to-noise required in each spectral element
+    chunksize : int (optional)
+        Number of targets evaluated at a time, bounding memory use
+    **kwargs
+        Passed to Instrument() when a Telescope is given
+
+    Returns
+    -------
+    lam : array
+        Wavelength grid (um)
+    DtSNR : array
+        (Ntarget, Nlam) exposure times [hours], NaN for targets with missing
+        (NaN) catalog values
+
+    Note
+    ----
+    The albedo and stellar spectrum are degraded onto the wavelength grid
+    once, and the count rates of each chunk of targets are computed in one
+    vectorized pass.
+    """
+    if isinstance(telescope, Instrument):
+        inst = telescope
+    else:
+        kwargs.setdefault("SILENT", True)
+        inst = Instrument(telescope, wantsnr=wantsnr, **kwargs)
+
+    # Degrade the spectra once for all targets
+    A, Fs = inst.degrade(spectrum)
+
+    lam = inst.lam
+    DtSNR = np.empty((len(catalog), len(lam)))
+    for i0 in range(0, len(catalog), chunksize):
+        rows = slice(i0, i0 + chunksize)
+        planet = Planet(d=catalog.distance[rows], Nez=catalog.Nez[rows],
+                        Rp=catalog.Rp[rows], a=catalog.a[rows],
+                        alpha=catalog.alpha[rows])
+        star = Star(Teff=catalog.Teff[rows], Rs=catalog.Rs[rows])
+        DtSNR[rows] = inst.evaluate_degraded(planet, star, A, Fs).DtSNR
+
+    # Missing data gives no exposure time, rather than exptime_element's 0
+    missing = np.zeros(len(catalog), dtype=bool)
+    for col in catalog.COLUMNS:
+        missing |= np.isnan(getattr(catalog, col))
+    DtSNR[missing] = np.nan
+
+    # Exposure time scales as SNR**2
+    if wantsnr != inst.wantsnr:
+        DtSNR *= (float(wantsnr) / inst.wantsnr)**2
+
+    return lam, DtSNR
+
+def _to_float(values):
+    """
+    Column of numbers (or numeric strings, with empty strings as NaN) as a
+    float array.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind in "fiub":
+        return values.astype(float)
+    return np.array([float(v) if str(v).strip() else np.nan for v in values])
@@ -0,0 +1,240 @@
+# Import dependent modules
+import numpy as np
+import multiprocessing
+from .instrument import Instrument
+from .orbit import orbit_geometry
+from .teleplanstar import lambertPhaseFunction
+from .noise_routines import Fstar, Fplan, FpFs, cplan, czodi, cezodi, cspeck, \
+    set_throughput
+
+def completeness(telescope, planet, star, spectrum, a=None, Rp=None, e=0.,
+                 itime=10.0, snr=5.0, band=(0.5, 0.6), Cmin=None,
+                 Nsamples=10**6, chunksize=10**5, max_workers=1, seed=None,
+                 **kwargs):
+    """
+    Monte Carlo completeness: the probability that a planet on a randomly
+    oriented orbit, seen at a random orbital phase, is detected.
+
+    Orbits are sampled with isotropic inclinations and uniform arguments of
+    periastron and mean anomalies. A sample is detected if the planet lies
+    between the IWA and OWA (the set_throughput() cut) at the wavelengths of
+    the detection band, and reaches the required SNR in the band within
+    itime (and, if Cmin is given, has a planet/star contrast of at least
+    Cmin), according to the same count rate model as count_rates_new().
+
+    Parameters
+    ----------
+    telescope : Telescope or Instrument
+        Telescope object, or an Instrument to reuse
+    planet : Planet
+        Planet object; its distance, zodis, and (unless a and Rp are given)
+        semi-major axis and radius are used
+    star : Star
+        Star object containing parameters
+    spectrum : Spectrum
+        Spectrum object (or any object with wl, spec and starflux
+        attributes). The stellar flux is taken to be that at planet.a and
+        is scaled by (planet.a/r)**2 to the distance r of each sample from
+        its star, for every semi-major axis a; if starflux is None, the
+        blackbody flux of the star is used.
+    a : float or array (optional)
+        Semi-major axes (AU), planet.a by default
+    Rp : float or array (optional)
+        Planet radii (Earth radii), planet.Rp by default
+    e : float (optional)
+        Eccentricity of the sampled orbits
+    itime : float (optional)
+        Integration time (hours)
+    snr : float (optional)
+        Signal-to-noise required in the detection band
+    band : tuple (optional)
+        (min, max) wavelength (um) of the spectral elements combined for
+        detection
+    Cmin : float (optional)
+        Minimum planet/star contrast, averaged over the band
+    Nsamples : int (optional)
+        Number of orbits sampled
+    chunksize : int (optional)
+        Number of orbits evaluated at a time, bounding memory use
+    max_workers : int (optional)
+        Number of worker processes for the chunks; None for the number of
+        CPUs. Uses concurrent.futures where available and a
+        multiprocessing.Pool on Python 2. With max_workers=1 the chunks run
+        serially in this process, as they do (with a warning) if no worker
+        processes can be started.
+    seed : int (optional)
+        Random seed. Each chunk draws from its own generator seeded from it,
+        so results do not depend on max_workers.
+    **kwargs
+        Passed to Instrument() when a Telescope is given
+
+    Returns
+    -------
+    C : float or array
+        Completeness (detection probability), with shape
+        np.shape(a) + np.shape(Rp)
+
+    Note
+    ----
+    The count rates are computed once per semi-major axis for a reference
+    planet at full phase and scaled for each sample by the phase function,
+    the stellar distance and the throughput cut, which is exact for the
+    count rate model. All radii share the same orbit samples.
+    """
+    if isinstance(telescope, Instrument):
+        inst = telescope
+    else:
+        kwargs.setdefault("SILENT", True)
+        inst = Instrument(telescope, **kwargs)
+
+    if a is None:
+        a = planet.a
+    if Rp is None:
+        Rp = planet.Rp
+    shape = np.shape(a) + np.shape(Rp)
+    a = np.atleast_1d(np.asarray(a, dtype=float)).ravel()
+    Rp = np.atleast_1d(np.asarray(Rp, dtype=float)).ravel()
+
+    iband = (inst.lam >= band[0]) & (inst.lam <= band[1])
+    if not np.any(iband):
+        raise ValueError("No spectral elements between %g and %g um" % band)
+
+    # Degrade the spectra once
+    A, Fs = inst.degrade(spectrum)
+
+    # Chunks of orbits, each with its own seed
+    sizes = [min(chunksize, Nsamples - i0) for i0 in range(0, Nsamples, chunksize)]
+    seeds = np.random.RandomState(seed).randint(0, 2**31 - 1, size=len(sizes))
+
+    tasks = []
+    for ia in range(len(a)):
+        ref = _reference_rates(inst, planet, star, A, Fs, a[ia], iband)
+        for n, s in zip(sizes, seeds):
+            tasks.append((ia, s, n, a[ia], e, Rp, itime, snr, Cmin, ref))
+
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    if (max_workers == 1) or (len(tasks) <= 1):
+        results = [_completeness_chunk(task) for task in tasks]
+    else:
+        results = _run_pool(tasks, max_workers)
+
+    detected = np.zeros((len(a), len(Rp)))
+    for task, counts in zip(tasks, results):
+        detected[task[0]] += counts
+    C = (detected / Nsamples).reshape(shape)
+    if C.ndim == 0:
+        return float(C)
+    return C
+
+def _run_pool(tasks, max_workers):
+    """
+    Evaluate the chunks on a pool of worker processes: concurrent.futures
+    if available, otherwise (Python 2) a multiprocessing.Pool, or serially
+    with a warning if no worker processes can be started.
+    """
+    # Imported here to keep it out of `import coronagraph`
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        ProcessPoolExecutor = None
+    if ProcessPoolExecutor is not None:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            return list(pool.map(_completeness_chunk, tasks))
+    try:
+        pool = multiprocessing.Pool(processes=max_workers)
+    except (OSError, ImportError, ValueError) as e:
+        print("WARNING: could not start worker processes (%s), running completeness serially" % e)
+        return [_completeness_chunk(task) for task in tasks]
+    try:
+        return pool.map(_completeness_chunk, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+def sample_orbits(rng, n, a, e=0.):
+    """
+    Geometry of n planets on randomly oriented orbits at random phases.
+
+    Parameters
+    ----------
+    rng : numpy.random.RandomState or Generator
+        Random number generator
+    n : int
+        Number of samples
+    a : float
+        Semi-major axis (AU)
+    e : float (optional)
+        Eccentricity
+
+    Returns
+    -------
+    r, alpha, x, y : array
+        Planet-star distance (AU), phase angle (deg) and sky-projected
+        offsets (AU), see orbit_geometry()
+    """
+    # Isotropic inclinations; the node only rotates the projected orbit
+    i = np.arccos(rng.uniform(0., 1., n))*180./np.pi
+    omega = rng.uniform(0., 360., n)
+    M = rng.uniform(0., 2.*np.pi, n)
+    return orbit_geometry(M, a, e=e, i=i, omega=omega)
+
+def _reference_rates(inst, planet, star, A, Fs, a, iband):
+    """
+    Count rates in the detection band of a planet of unit radius at full
+    phase and r = a, with the throughput not yet cut at the IWA/OWA.
+    """
+    lam, dlam, q, diam, X = inst.lam, inst.dlam, inst.q, inst.diam, inst.X
+    d, Teff, Rs = planet.distance, star.Teff, star.Rs
+    T = inst.Tput + np.zeros_like(lam)
+    if inst.GROUND:
+        T = T * inst.Tatmos
+    if Fs is not None:
+        # Stellar flux given at planet.a
+        Fs = Fs * (planet.a / a)**2
+    Fs = inst.starflux(Fs, Teff, Rs, a)
+    ref = {
+        "cp": cplan(q, inst.fpa, T, lam, dlam, Fplan(A, 1., Fs, 1., d), diam),
+        "cz": czodi(q, X, T, lam, dlam, diam, planet.MzV),
+        "cez": cezodi(q, X, T, lam, dlam, diam, a,
+                      Fstar(lam, Teff, Rs, 1., AU=True), planet.Nez, planet.MezV),
+        "csp": cspeck(q, T, inst.C, lam, dlam, Fstar(lam, Teff, Rs, d), diam),
+        "cdet": inst.cD + inst.cR + inst.cth,
+        "Cratio": FpFs(A, 1., 1., a),
+    }
+    for k in ref:
+        ref[k] = (np.zeros_like(lam) + ref[k])[iband]
+    ref.update(lam=lam[iband], d=d, diam=diam, IWA=inst.IWA, OWA=inst.OWA,
+               lammin=inst.lammin, FIX_OWA=inst.FIX_OWA, SILENT=inst.SILENT)
+    return ref
+
+def _completeness_chunk(task):
+    """
+    Number of detected samples in one chunk of orbits, for each radius.
+    """
+    ia, seed, n, a, e, Rp, itime, snr, Cmin, ref = task
+    rng = np.random.RandomState(seed)
+    r, alpha, x, y = sample_orbits(rng, n, a, e=e)
+
+    # Throughput cut at the IWA/OWA
+    sep = np.sqrt(x**2 + y**2)/ref["d"]*np.pi/180./3600. # separation in radians
+    f = set_throughput(ref["lam"], 1., ref["diam"], sep[:,np.newaxis], ref["IWA"],
+                       ref["OWA"], ref["lammin"], FIX_OWA=ref["FIX_OWA"],
+                       SILENT=ref["SILENT"])
+    f = f + np.zeros((n, len(ref["lam"])))
+
+    # Scale the reference count rates, summed over the band
+    Phi = lambertPhaseFunction(alpha)
+    g = (a / r)**2
+    cp = Phi*g*np.dot(f, ref["cp"])
+    cb = np.dot(f, ref["cz"] + ref["csp"]) + g*np.dot(f, ref["cez"]) + np.sum(ref["cdet"])
+
+    # SNR in the band for each radius, assuming background subtraction
+    Dt = itime * 3600.
+    cp = cp[:,np.newaxis] * Rp**2
+    SNR = cp*Dt/np.sqrt((cp + 2*cb[:,np.newaxis])*Dt)
+    detected = SNR >= snr
+    if Cmin is not None:
+        Cratio = (Phi*g)[:,np.newaxis] * Rp**2 * np.mean(ref["Cratio"])
+        detected &= Cratio >= Cmin
+    return np.sum(detected, axis=0)
@@ -1,10 +1,42 @@
 import numpy as np
 import scipy as sp
-from .degrade_spec import degrade_spec
+from .degrade_spec import degrade_spec, RebinOperator
+from .utils import LRUCache, hash_arrays
 from scipy import interp
-from scipy import ndimage
+from scipy import sparse
 
 def convolve_spec(Ahr, lamhr, filters, forceTopHat=False):
+    """
+    Convolve a hi-res spectrum with each filter of a filter wheel.
+
+    Parameters
+    ----------
+    Ahr : array
+        Hi-res spectrum, or a 2-D (Nspec, Nhi) stack of spectra
+    lamhr : array
+        Wavelength grid for Ahr (um)
+    filters : Wheel
+        Filter wheel
+    forceTopHat : bool (optional)
+        Use tophat filters of width FWHM instead of the response functions
+
+    Returns
+    -------
+    F : array
+        Spectrum in each filter, sorted by bandcenter
+
+    Note
+    ----
+    Applies the cached FilterBank for (filters, lamhr), so repeated calls
+    on the same grid cost a single sparse matrix product.
+    """
+    return FilterBank.cached(filters, lamhr, forceTopHat=forceTopHat)(Ahr)
+
+def convolve_spec_loop(Ahr, lamhr, filters, forceTopHat=False):
+    """
+    Convolve a hi-res spectrum with each filter of a filter wheel, one filter
+    at a time (reference implementation of convolve_spec()).
+    """
     
     # if wl grid is backwards reverse it
     if lamhr[1] > lamhr[0]:
@@ -14,10 +46,10 @@ def convolve_spec(Ahr, lamhr, filters, forceTopHat=False):
         Ahr=Ahr[::-1]
    
     # Sort filters by wavelength
-    tdict = sorted(filters.__dict__.iteritems(), key=lambda x: x[1].bandcenter)
+    tdict = sorted(filters.__dict__.items(), key=lambda x: x[1].bandcenter)
     F = []
     for x in tdict:
-        if (x[1].wl == None) or (x[1].response == None) or forceTopHat:
+        if (x[1].wl is None) or (x[1].response is None) or forceTopHat:
             # Use FWHM with tophat convolution
             Fi = tophat_instrument(Ahr, lamhr, x[1].bandcenter, FWHM=x[1].FWHM)
         else:
@@ -25,7 +57,197 @@ def convolve_spec(Ahr, lamhr, filters, forceTopHat=False):
         F.append(Fi)
     
     return np.array(F)
-    
+
+class FilterBank(object):
+    """
+    Filter wheel "compiled" for a fixed hi-res wavelength grid: a sparse
+    (Nfilter, Nhi) weight matrix that reproduces convolve_spec_loop(), so the
+    photometry of any number of spectra is a single matrix product.
+
+    Parameters
+    ----------
+    wheel : Wheel
+        Filter wheel (see filters.imager)
+    lamhr : array
+        Hi-res wavelength grid (um)
+    forceTopHat : bool (optional)
+        Use tophat filters of width FWHM instead of the response functions
+
+    Attributes
+    ----------
+    names : list
+        Filter attribute names, sorted by bandcenter
+    bandcenters, FWHM : array
+        Filter bandcenters and widths (um), sorted by bandcenter
+    matrix : scipy.sparse.csr_matrix
+        (Nfilter, Nhi) weights
+    nan_rows : array
+        Filters whose convolution is NaN (see degrade_spec)
+    """
+
+    # Filter banks shared between calls, keyed by a hash of wheel and grid
+    _cache = LRUCache(maxsize=16)
+
+    def __init__(self, wheel, lamhr, forceTopHat=False):
+        lamhr = np.asarray(lamhr, dtype=float)
+        tdict = sorted(wheel.__dict__.items(), key=lambda x: x[1].bandcenter)
+        self.names = [x[0] for x in tdict]
+        self.bandcenters = np.array([x[1].bandcenter for x in tdict])
+        self.FWHM = np.array([x[1].FWHM for x in tdict])
+        self.shape = (len(tdict), len(lamhr))
+
+        # Work on an increasing grid, as in convolve_spec_loop()
+        rev = lamhr[1] < lamhr[0]
+        lam = lamhr[::-1] if rev else lamhr
+
+        rows = []
+        self.nan_rows = np.zeros(len(tdict), dtype=bool)
+        for i, x in enumerate(tdict):
+            if (x[1].wl is None) or (x[1].response is None) or forceTopHat:
+                # Use FWHM with tophat convolution
+                w = _tophat_weights(lam, x[1].bandcenter, x[1].FWHM)
+            else:
+                w, self.nan_rows[i] = _filter_response_weights(lam, x[1].wl, x[1].response)
+            rows.append(w)
+        matrix = sparse.vstack(rows, format="csr") if rows else \
+            sparse.csr_matrix(self.shape)
+        if rev:
+            matrix = matrix[:,::-1].tocsr()
+        self.matrix = matrix
+
+    @classmethod
+    def cached(cls, wheel, lamhr, forceTopHat=False):
+        """
+        Return the filter bank for this wheel and grid, constructing it only
+        if it is not already in the LRU cache.
+        """
+        key = (_wheel_hash(wheel), hash_arrays(lamhr), bool(forceTopHat))
+        bank = cls._cache.get(key)
+        if bank is None:
+            bank = cls(wheel, lamhr, forceTopHat=forceTopHat)
+            cls._cache.set(key, bank)
+        return bank
+
+    def __call__(self, Ahr):
+        """
+        Convolve a hi-res spectrum, or a 2-D (Nspec, Nhi) stack of spectra,
+        with every filter.
+        """
+        Ahr = np.asarray(Ahr, dtype=float)
+        if Ahr.ndim == 1:
+            F = self.matrix.dot(Ahr)
+        else:
+            F = self.matrix.dot(Ahr.T).T
+        F[...,self.nan_rows] = np.nan
+        return F
+
+def _wheel_hash(wheel):
+    """
+    Hash of the filters in a wheel (names, bandcenters, FWHMs and responses).
+    """
+    arrays = []
+    for name, f in sorted(wheel.__dict__.items()):
+        arrays.append(np.frombuffer(name.encode("utf-8"), dtype=np.uint8))
+        arrays.append(np.array([f.bandcenter, f.FWHM], dtype=float))
+        arrays.append(f.wl)
+        arrays.append(f.response)
+    return hash_arrays(*arrays)
+
+def _filter_response_weights(wlh, wlf, response):
+    """
+    Sparse (1, Nhi) row reproducing convolve_filter_response(..., degrade=True)
+    on the increasing grid wlh, and whether the result is NaN.
+    """
+    wlf = np.asarray(wlf, dtype=float)
+    response = np.asarray(response, dtype=float)
+    Nhi = len(wlh)
+    Nfilt = len(wlf)
+    dlo = wlf[1] - wlf[0]
+    dhi = wlf[-1] - wlf[-2]
+    # Select only this wavelength region
+    idx = np.where((wlh > (np.min(wlf)-dlo*10)) & (wlh < (np.max(wlf)+dhi*10)))[0]
+    wlhr = wlh[idx]
+    Nspec = len(wlhr)
+    isnan = False
+    try:
+        op = RebinOperator(wlhr, wlf, method="degrade")
+        # Filter-weighted sum of the degraded spectrum
+        w = sparse.csr_matrix(response / np.sum(response)).dot(op.matrix)
+        isnan = bool(np.any(op.nan_rows))
+    except ValueError:
+        print("Error in degrade_spec, switching to numpy interpolation.")
+        if Nspec > Nfilt:
+            # Interpolate filter response to hi-res spectral grid
+            R = np.interp(wlhr, wlf, response)
+            w = sparse.csr_matrix(R / np.sum(R))
+        else:
+            # Interpolate spectrum to hi-res filter grid
+            w = sparse.csr_matrix(response / np.sum(response)).dot(_interp_matrix(wlf, wlhr))
+    # Place the columns of the selected region in the full grid
+    w = sparse.coo_matrix(w)
+    return sparse.csr_matrix((w.data, (w.row, idx[w.col])), shape=(1, Nhi)), isnan
+
+def _tophat_weights(lam, bandcenter, FWHM):
+    """
+    Sparse (1, Nhi) row reproducing tophat_instrument() on the increasing
+    grid lam: the tophatfold() window averages at the two grid points
+    around the bandcenter, interpolated to the bandcenter.
+    """
+    lammin = lam[0]
+    lammax = lam[-1]
+    interp_row = _interp_matrix(np.atleast_1d(bandcenter), lam)
+    w = sparse.csr_matrix((1, len(lam)))
+    for k, c in zip(interp_row.indices, interp_row.data):
+        lo = lam[k] - 0.5*FWHM
+        hi = lam[k] + 0.5*FWHM
+        wk = _integral_weights(lam, max(lo, lammin), min(hi, lammax))
+        # Reflected parts of the window, as in tophatfold()
+        if lo < lammin:
+            wk = wk + _integral_weights(lam, lammin, min(2.*lammin - lo, lammax))
+        if hi > lammax:
+            wk = wk + _integral_weights(lam, max(2.*lammax - hi, lammin), lammax)
+        w = w + c * wk / FWHM
+    return sparse.csr_matrix(w)
+
+def _integral_weights(lam, a, b):
+    """
+    Sparse (1, len(lam)) row w such that w.dot(f) is the integral from a to
+    b of the piecewise-linear f on the increasing grid lam (lammin <= a <= b
+    <= lammax).
+    """
+    N = len(lam)
+    h = np.diff(lam)
+    ja, jb = np.clip(np.searchsorted(lam, [a, b], side="right") - 1, 0, N - 2)
+    w = np.zeros(jb - ja + 2)
+    # Full trapezoids of the segments ja..jb-1
+    hs = h[ja:jb]
+    w[:-2] += 0.5 * hs
+    w[1:-1] += 0.5 * hs
+    # Add the part of segment jb below b and remove the part of ja below a
+    for x, j, sign in ((b, jb, 1.), (a, ja, -1.)):
+        t = (x - lam[j]) / h[j]
+        w[j-ja] += sign * h[j] * (t - 0.5*t*t)
+        w[j-ja+1] += sign * h[j] * 0.5*t*t
+    cols = np.arange(ja, jb + 2)
+    return sparse.csr_matrix((w, (np.zeros(len(cols), dtype=int), cols)), shape=(1, N))
+
+def _interp_matrix(x, xp):
+    """
+    Sparse (len(x), len(xp)) matrix M such that M.dot(fp) equals
+    np.interp(x, xp, fp), including its clamping outside xp.
+    """
+    x = np.asarray(x, dtype=float)
+    N = len(xp)
+    j = np.clip(np.searchsorted(xp, x, side="right") - 1, 0, max(N-2, 0))
+    if N > 1:
+        t = np.clip((x - xp[j]) / (xp[j+1] - xp[j]), 0., 1.)
+    else:
+        t = np.zeros(len(x))
+    rows = np.concatenate([np.arange(len(x)), np.arange(len(x))])
+    cols = np.concatenate([j, np.minimum(j+1, N-1)])
+    vals = np.concatenate([1. - t, t])
+    return sparse.csr_matrix((vals, (rows, cols)), shape=(len(x), N))
+
 def convolve_filter_response(wlh, fh, wlf, response, degrade=False):
     
     # if wl grid is backwards reverse it
@@ -83,21 +305,76 @@ def convolve_filter_response(wlh, fh, wlf, response, degrade=False):
 def tophat_instrument(Fp, wl_hr, wlgrid, FWHM=0.035):
 
     Fratio11=tophatfold(wl_hr, Fp, FWHM)
-    Fratio=interp(wlgrid,wl_hr,Fratio11)
+    if Fratio11.ndim == 1:
+        Fratio=interp(wlgrid,wl_hr,Fratio11)
+    else:
+        # Interpolate each spectrum in the stack
+        Fratio=_interp_matrix(np.atleast_1d(wlgrid), wl_hr).dot(Fratio11.T).T
+        if np.ndim(wlgrid) == 0:
+            Fratio=Fratio[...,0]
 
     return Fratio
     
 def tophatfold(lam, flux, FWHM=0.035):
-    lammin=min(lam)
-    lammax=max(lam)
-    dlambda=FWHM/17.
-    interlam=np.arange(lammin,lammax,dlambda)
-    interflux=interp(interlam,lam,flux)
+    """
+    Smooth a spectrum with a tophat of width FWHM.
+
+    Parameters
+    ----------
+    lam : array
+        Increasing wavelength grid (um)
+    flux : array
+        Spectrum, or a 2-D (Nspec, Nlam) stack of spectra
+    FWHM : float (optional)
+        Width of the tophat (um)
+
+    Returns
+    -------
+    fluxfold : array
+        Smoothed spectrum on the lam grid
+
+    Note
+    ----
+    Averages the piecewise-linear spectrum exactly over each window using
+    cumulative sums on the native grid, so the cost scales with len(lam)
+    rather than with (lammax - lammin) / FWHM. Windows that extend past the
+    ends of the grid are reflected back into it, as in the
+    ndimage.uniform_filter() smoothing this replaces.
+    """
+    lam = np.asarray(lam, dtype=float)
+    flux = np.asarray(flux, dtype=float)
+    lammin = lam[0]
+    lammax = lam[-1]
+    h = np.diff(lam)
+
+    # Cumulative integral of the spectrum at each grid point
+    cum = np.zeros(flux.shape)
+    cum[...,1:] = np.cumsum(0.5 * (flux[...,1:] + flux[...,:-1]) * h, axis=-1)
+
+    def integral(x):
+        # Integral of the piecewise-linear spectrum from lammin to x
+        j = np.clip(np.searchsorted(lam, x, side="right") - 1, 0, len(lam) - 2)
+        hj = h[j]
+        t = x - lam[j]
+        t /= hj
+        # cum + h t (f0 + t (f1 - f0) / 2), in place to limit temporaries
+        out = flux[...,j+1] - flux[...,j]
+        out *= 0.5 * t
+        out += flux[...,j]
+        out *= t
+        out *= hj
+        out += cum[...,j]
+        return out
 
-    #convovle flux array with gaussian--use smooth
-    fold=sp.ndimage.filters.uniform_filter(interflux,size=17)
+    lo = lam - 0.5*FWHM
+    hi = lam + 0.5*FWHM
+    fold = integral(np.minimum(hi, lammax)) - integral(np.maximum(lo, lammin))
+    # Reflect the parts of the windows that fall off either end of the grid
+    nlo = np.searchsorted(lo, lammin)
+    nhi = np.searchsorted(hi, lammax, side="right")
+    fold[...,:nlo] += integral(np.minimum(2.*lammin - lo[:nlo], lammax))
+    fold[...,nhi:] += cum[...,-1:] - integral(np.maximum(2.*lammax - hi[nhi:], lammin))
 
-    #interpolate back to original grid
-    fluxfold=interp(lam,interlam,fold)
+    fluxfold = fold / FWHM
 
-    return fluxfold
\ No newline at end of file
+    return fluxfold
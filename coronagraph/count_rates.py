@@ -1,9 +1,10 @@
 # Import dependent modules
 import numpy as np
 import sys
-from .degrade_spec import degrade_spec, downbin_spec
+from .degrade_spec import degrade_spec, downbin_spec, rebin_spec, RebinOperator
 from .convolve_spec import convolve_spec
-from .noise_routines import Fstar, Fplan, FpFs, cplan, czodi, cezodi, cspeck, cdark, cread, ctherm, ccic, f_airy, ctherm_earth
+from .noise_routines import Fstar, Fplan, FpFs, cplan, czodi, cezodi, cspeck, cdark, cread, ctherm, ccic, f_airy, ctherm_earth, \
+    set_atmos_throughput, get_thermal_ground_intensity, construct_lam
 import pdb
 import os
 
@@ -83,23 +84,8 @@ def count_rates(Ahr, lamhr, solhr,
 
     # Set wavelength grid
     if COMPUTE_LAM:
-        lam  = lammin #in [um]
-        Nlam = 1
-        while (lam < lammax):
-            lam  = lam + lam/Res
-            Nlam = Nlam +1
-        lam    = np.zeros(Nlam)
-        lam[0] = lammin
-        for j in range(1,Nlam):
-            lam[j] = lam[j-1] + lam[j-1]/Res
+        lam, dlam = construct_lam(lammin, lammax, Res)
         Nlam = len(lam)
-        dlam = np.zeros(Nlam) #grid widths (um)
-        # Set wavelength widths
-        for j in range(1,Nlam-1):
-            dlam[j] = 0.5*(lam[j+1]+lam[j]) - 0.5*(lam[j-1]+lam[j]) #TODO This doesn't look right!
-        #widths at edges are same as neighbor
-        dlam[0] = dlam[1]
-        dlam[Nlam-1] = dlam[Nlam-2]
     elif IMAGE:
         pass
     else:
@@ -165,31 +151,17 @@ def count_rates(Ahr, lamhr, solhr,
                 print 'WARNING: portions of spectrum outside OWA'
     # Modify throughput by atmospheric transmission if GROUND-based
     if GROUND:
-        # Read in earth transmission file
-        fn = os.path.join(os.path.dirname(__file__), "ground/earth_transmission_atacama_30deg.txt")
-        tdata = np.genfromtxt(fn, skip_header=5)
-        wl_atmos = tdata[:,0]
-        Tatmoshr = tdata[:,1]
         # Degrade atmospheric transmission to wavelength gridpoints
-        Tatmos = degrade_spec(Tatmoshr, wl_atmos,lam,dlam=dlam)
-        if False:
-            import matplotlib.pyplot as plt; from matplotlib import gridspec
-            fig1 = plt.figure(figsize=(8,6))
-            gs = gridspec.GridSpec(1,1)
-            ax1 = plt.subplot(gs[0])
-            ax1.plot(lam, Tatmos, c="orange", ls="steps-mid")
-            ax1.set_ylabel("Earth Atmospheric Transmission")
-            ax1.set_xlabel("Wavelength [um]")
-            plt.show()
+        Tatmos = set_atmos_throughput(lam, dlam, rebin_spec)
         # Multiply telescope throughput by atmospheric throughput
         T = T * Tatmos
 
-
-
     # Degrade albedo and stellar spectrum
     if COMPUTE_LAM:
-        A = degrade_spec(Ahr,lamhr,lam,dlam=dlam)
-        Fs = degrade_spec(solhr, lamhr, lam, dlam=dlam)
+        # Both spectra share the hi-res grid, so reuse one cached operator
+        rebin = RebinOperator.cached(lamhr, lam, dlam=dlam)
+        A = rebin(Ahr)
+        Fs = rebin(solhr)
         #A = downbin_spec(Ahr,lamhr,lam,dlam=dlam)
         #Fs = downbin_spec(solhr, lamhr, lam, dlam=dlam)
     elif IMAGE:
@@ -220,30 +192,12 @@ def count_rates(Ahr, lamhr, solhr,
         cth = np.zeros_like(cp)
     # Add earth thermal photons if GROUND
     if GROUND:
-        # Read in earth thermal data
-        fn = os.path.join(os.path.dirname(__file__), "ground/earth_thermal_atacama_30deg.txt")
-        tdata = np.genfromtxt(fn, skip_header=6)
-        wl_therm = tdata[:,0]  # um
-        Fthermhr = tdata[:,1]  # W/m^2/um
-        # Degrade earth thermal flux
-        Ftherm = degrade_spec(Fthermhr, wl_therm,lam,dlam=dlam)
-        # Compute intensity
-        Itherm  = Ftherm / np.pi
+        # Compute ground intensity due to sky background
+        Itherm  = get_thermal_ground_intensity(lam, dlam, rebin_spec)
         # Compute Earth thermal photon count rate
         cthe = ctherm_earth(q, X, lam, dlam, diam, Itherm)
         # Add earth thermal photon counts to telescope thermal counts
         cth = cth + cthe
-        if False:
-            import matplotlib.pyplot as plt; from matplotlib import gridspec
-            fig2 = plt.figure(figsize=(8,6))
-            gs = gridspec.GridSpec(1,1)
-            ax1 = plt.subplot(gs[0])
-            ax1.plot(lam, cthe, c="blue", ls="steps-mid", label="Earth Thermal")
-            ax1.plot(lam, cth, c="red", ls="steps-mid", label="Telescope Thermal")
-            ax1.plot(lam, cp, c="k", ls="steps-mid", label="Planet")
-            ax1.set_ylabel("Photon Count Rate [1/s]")
-            ax1.set_xlabel("Wavelength [um]")
-            plt.show()
 
     cnoise =  cp + 2*(cz + cez + csp + cD + cR + cth)                        # assumes background subtraction
     cb = (cz + cez + csp + cD + cR + cth)
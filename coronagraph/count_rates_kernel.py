@@ -0,0 +1,194 @@
+# Import dependent modules
+import numpy as np
+from .noise_routines import Fstar, Fplan, cplan, czodi, cezodi, cspeck, \
+    cdark, cread, ctherm, ctherm_earth, exptime_element
+from .utils import profile_stage
+
+def count_rates_kernel(lam, dlam, q, T, A, Fs, De, Re, theta, Itherm,
+                       fpa, Phi, Rp, Teff, Rs, r, d, Nez, diam, C, X,
+                       DNHpix, Dtmax, Tsys, emis, MzV, MezV, wantsnr,
+                       IMAGE=False, THERMAL=False, backend="numpy", profile=None):
+    """
+    Compute all photon count rates, the noise count rate and the exposure time
+    to reach a given SNR from the wavelength-dependent inputs set up in
+    count_rates_new().
+
+    With backend="numba" a single compiled loop over wavelength evaluates
+    every term, sharing common factors and allocating only the outputs. It
+    falls back to the NumPy implementation (the individual noise_routines
+    functions) if numba is not installed or if any parameter is an array
+    rather than a scalar.
+
+    Parameters
+    ----------
+    lam, dlam : ndarray
+        Wavelength grid and bin widths (um)
+    q, T, De, Re, theta : ndarray or float
+        Quantum efficiency, throughput, dark current, read noise and lenslet
+        size on the wavelength grid
+    A, Fs : ndarray
+        Low-res albedo and TOA stellar flux (W/m**2/um)
+    Itherm : ndarray or None
+        Sky thermal intensity (W/m**2/um/sr), or None if not GROUND-based
+    fpa, Phi, Rp, Teff, Rs, r, d, Nez, diam, C, X, DNHpix, Dtmax, Tsys, emis, MzV, MezV : float
+        Parameters as in count_rates_new()
+    wantsnr : float
+        Signal-to-noise required in each spectral element
+    IMAGE : bool
+        Imaging mode (not IFS)
+    THERMAL : bool
+        set to compute thermal photon counts due to telescope temperature
+    backend : str (optional)
+        'numpy' (default) or 'numba'
+    profile : dict (optional)
+        Record the time and memory of each noise term (or of the fused
+        kernel) here, see profile_stage()
+
+    Returns
+    -------
+    cp, cz, cez, csp, cD, cR, cth, cnoise, DtSNR : ndarray
+        Count rates (s**-1) and exposure time to SNR (hr)
+    """
+    scalars = (fpa, Phi, Rp, Teff, Rs, r, d, Nez, diam, C, X, DNHpix, Dtmax,
+               Tsys, emis, MzV, MezV)
+    kernel = None
+    if (backend == "numba") and all(np.ndim(x) == 0 for x in scalars) \
+            and np.ndim(T) == 1:
+        kernel = _fused_kernel()
+
+    if kernel is None:
+        return _count_rates_numpy(lam, dlam, q, T, A, Fs, De, Re, theta, Itherm,
+                                  fpa, Phi, Rp, Teff, Rs, r, d, Nez, diam, C, X,
+                                  DNHpix, Dtmax, Tsys, emis, MzV, MezV, wantsnr,
+                                  IMAGE=IMAGE, THERMAL=THERMAL, profile=profile)
+
+    Nlam = len(lam)
+    GROUND = Itherm is not None
+    if not GROUND:
+        Itherm = np.zeros(Nlam)
+    as1d = lambda x: np.ascontiguousarray(np.broadcast_to(x, (Nlam,)), dtype=np.float64)
+    with profile_stage(profile, "fused_kernel"):
+        out = kernel(as1d(lam), as1d(dlam), as1d(q), as1d(T), as1d(A),
+                     as1d(Fs), as1d(De), as1d(Re), as1d(theta), as1d(Itherm),
+                     *[float(x) for x in scalars + (wantsnr,)] +
+                     [bool(THERMAL), GROUND])
+    return out
+
+def _count_rates_numpy(lam, dlam, q, T, A, Fs, De, Re, theta, Itherm,
+                       fpa, Phi, Rp, Teff, Rs, r, d, Nez, diam, C, X,
+                       DNHpix, Dtmax, Tsys, emis, MzV, MezV, wantsnr,
+                       IMAGE=False, THERMAL=False, profile=None):
+    """
+    Pure-NumPy implementation of count_rates_kernel().
+    """
+    with profile_stage(profile, "cp"):
+        Fp = Fplan(A, Phi, Fs, Rp, d)         # planet flux at telescope
+        cp     =  cplan(q, fpa, T, lam, dlam, Fp, diam)                        # planet count rate
+    with profile_stage(profile, "cz"):
+        cz     =  czodi(q, X, T, lam, dlam, diam, MzV)                         # solar system zodi count rate
+    with profile_stage(profile, "cez"):
+        cez    =  cezodi(q, X, T, lam, dlam, diam, r, \
+            Fstar(lam,Teff,Rs,1.,AU=True), Nez, MezV)                          # exo-zodi count rate
+    with profile_stage(profile, "csp"):
+        csp    =  cspeck(q, T, C, lam, dlam, Fstar(lam,Teff,Rs,d), diam)       # speckle count rate
+    with profile_stage(profile, "cD"):
+        cD     =  cdark(De, X, lam, diam, theta, DNHpix, IMAGE=IMAGE)          # dark current count rate
+    with profile_stage(profile, "cR"):
+        cR     =  cread(Re, X, lam, diam, theta, DNHpix, Dtmax, IMAGE=IMAGE)   # readnoise count rate
+    with profile_stage(profile, "cth"):
+        if THERMAL:
+            cth    =  ctherm(q, X, lam, dlam, diam, Tsys, emis)                # internal thermal count rate
+        else:
+            cth = np.zeros_like(cp)
+        if Itherm is not None:
+            cth = cth + ctherm_earth(q, X, lam, dlam, diam, Itherm)            # Earth thermal count rate
+    with profile_stage(profile, "DtSNR"):
+        cb = (cz + cez + csp + cD + cR + cth)
+        cnoise =  cp + 2*cb                # assumes background subtraction
+        DtSNR = exptime_element(lam, cp, cnoise, wantsnr)
+    return cp, cz, cez, csp, cD, cR, cth, cnoise, DtSNR
+
+_compiled = []
+
+def _fused_kernel():
+    """
+    Compile (once per process, cached on disk by numba) and return the fused
+    count rate loop, or None if numba is not installed. numba is only
+    imported here so that importing coronagraph does not pay for it.
+    """
+    if not _compiled:
+        try:
+            from numba import jit
+            _compiled.append(jit(nopython=True, nogil=True, cache=True)(_fused_loop))
+        except ImportError:
+            _compiled.append(None)
+    return _compiled[0]
+
+def _fused_loop(lam, dlam, q, T, A, Fs, De, Re, theta, Itherm,
+                fpa, Phi, Rp, Teff, Rs, r, d, Nez, diam, C, X,
+                DNHpix, Dtmax, Tsys, emis, MzV, MezV, wantsnr,
+                THERMAL, GROUND):
+    """
+    Single pass over wavelength computing every count rate term, following
+    the formulae in noise_routines.
+    """
+    hc    = 1.986446e-25   # h*c (kg*m**3/s**2)
+    c1    = 3.7417715e-16  # 2*pi*h*c*c (kg m**4 / s**3)
+    c2    = 1.4387769e-2   # h*c/k (m K)
+    Rsun  = 6.958e8        # solar radius (m)
+    Rearth = 6.371e6       # radius of Earth (m)
+    pc    = 3.08567e16     # parsec (m)
+    AU    = 1.495979e11    # AU (m)
+    F0V   = 3.6e-8         # zero-mag V-band flux (W/m**2/um)
+    FsolV = 1.86e+3        # Solar V-band flux at 1 AU
+
+    # Factors shared by all wavelengths
+    area   = np.pi*(diam/2.)**2.
+    fzodi  = F0V*10**(-MzV/2.5)/FsolV
+    fezodi = Nez*(1./r)**2.*F0V*10**(-MezV/2.5)/FsolV
+    dil1AU = (Rs*Rsun/AU)**2.          # stellar dilution at 1 AU
+    dild   = (Rs*Rsun/d/pc)**2.        # stellar dilution at the observer
+    dilsun = (Rsun/AU)**2.
+    fplan  = Phi*(Rp*Rearth/d/pc)**2.
+    rad2as = 180.*3600./np.pi
+
+    Nlam = len(lam)
+    cp = np.empty(Nlam)
+    cz = np.empty(Nlam)
+    cez = np.empty(Nlam)
+    csp = np.empty(Nlam)
+    cD = np.empty(Nlam)
+    cR = np.empty(Nlam)
+    cth = np.empty(Nlam)
+    cnoise = np.empty(Nlam)
+    DtSNR = np.empty(Nlam)
+    for i in range(Nlam):
+        lamm = lam[i]*1.e-6                      # wavelength (m)
+        photon = lamm/hc
+        common = area*q[i]*dlam[i]*photon
+        # Stellar blackbody flux at the surface (W/m**2/um)
+        Bstar = c1/((lamm**5.)*(np.exp(c2/lamm/Teff)-1.))*1.e-6
+        Bsun = c1/((lamm**5.)*(np.exp(c2/lamm/5778.)-1.))*1.e-6
+        # square aperture size (arcsec**2) and size in sr**2
+        Omega = (X*lamm/diam*rad2as)**2.
+        Omega_sr = np.pi*(X*lamm/diam)**2.
+        Npix = 2*DNHpix*4.*Omega/np.pi/theta[i]**2.
+
+        cp[i] = common*fpa*T[i]*A[i]*Fs[i]*fplan
+        cz[i] = common*T[i]*Omega*Bsun*dilsun*fzodi
+        cez[i] = common*T[i]*Omega*Bstar*dil1AU*fezodi
+        csp[i] = common*T[i]*C*Bstar*dild
+        cD[i] = De[i]*Npix
+        cR[i] = Npix/(Dtmax*3600.)*Re[i]
+        cth[i] = 0.
+        if THERMAL:
+            Bsys = c1/((lamm**5.)*(np.exp(c2/lamm/Tsys)-1.))*1.e-6/np.pi
+            cth[i] += common*emis*Bsys*Omega_sr
+        if GROUND:
+            cth[i] += common*Itherm[i]*Omega_sr
+        cnoise[i] = cp[i] + 2*(cz[i] + cez[i] + csp[i] + cD[i] + cR[i] + cth[i])
+        if cp[i] > 0.:
+            DtSNR[i] = (wantsnr**2.*cnoise[i])/cp[i]**2./3600. # (hr)
+        else:
+            DtSNR[i] = np.inf
+    return cp, cz, cez, csp, cD, cR, cth, cnoise, DtSNR
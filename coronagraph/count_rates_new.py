@@ -1,13 +1,16 @@
 # Import dependent modules
 import numpy as np
 import sys
-from .degrade_spec import degrade_spec, downbin_spec
+from functools import partial
+from .degrade_spec import degrade_spec, downbin_spec, rebin_spec, RebinOperator
 from .convolve_spec import convolve_spec
 from .noise_routines import Fstar, Fplan, FpFs, cplan, czodi, cezodi, cspeck, \
     cdark, cread, ctherm, ccic, f_airy, ctherm_earth, construct_lam, \
     set_quantum_efficiency, set_read_noise, set_dark_current, set_lenslet, \
     set_throughput, set_atmos_throughput, get_thermal_ground_intensity, \
     exptime_element
+from .count_rates_kernel import count_rates_kernel
+from .utils import profile_stage
 import pdb
 import os
 
@@ -35,7 +38,8 @@ def count_rates_new(Ahr, lamhr, solhr,
                 MzV    = 23.0,
                 MezV   = 22.0,
                 wantsnr=10.0, FIX_OWA = False, COMPUTE_LAM = False,
-                SILENT = False, NIR = True, THERMAL = False, GROUND = False):
+                SILENT = False, NIR = True, THERMAL = False, GROUND = False,
+                backend = "numpy", profile = None):
     """
     Generate photon count rates for specified telescope and planet parameters
 
@@ -61,10 +65,35 @@ def count_rates_new(Ahr, lamhr, solhr,
         re-adjusts pixel size in NIR, as would occur if a second instrument was designed to handle the NIR
     THERMAL : bool
         set to compute thermal photon counts due to telescope temperature
+    backend : str (optional)
+        'numpy' (default), or 'numba' to evaluate the count rates in a single
+        compiled pass (falls back to 'numpy' if numba is not installed or
+        parameters are arrays). numba is only imported and the kernel
+        compiled when 'numba' is requested.
+    profile : dict (optional)
+        If given, filled with the wall time and memory allocated by each
+        stage of the calculation, as {stage: {"time": s, "alloc": bytes}}.
+        Stages are "grid", "detector", "throughput", "ground", "degrade" and
+        each noise term ("cp", "cz", ...; or "fused_kernel" for the numba
+        backend)
+
+    Note
+    ----
+    The parameters alpha, Phi, Rp, Teff, Rs, r, d, Nez, diam, Tput, C and X
+    may be given as broadcastable arrays of any shape S, in which case the
+    count rates, Cratio, and DtSNR are returned with shape S + (Nlam,), while
+    lam, dlam, A and q remain 1-D. The hi-res spectra are degraded only once.
     """
 
-    convolution_function = downbin_spec
-    #convolution_function = degrade_spec
+    # Append a wavelength axis to array-valued parameters
+    alpha, Phi, Rp, Teff, Rs, r, d, Nez, diam, Tput, C, X = \
+        [_expand(p) for p in (alpha, Phi, Rp, Teff, Rs, r, d, Nez, diam, Tput, C, X)]
+
+    # Rebin through cached RebinOperators equivalent to downbin_spec
+    # (or degrade_spec), so repeated calls on the same grids are cheap
+    convolution_method = "downbin"
+    #convolution_method = "degrade"
+    convolution_function = partial(rebin_spec, method=convolution_method)
 
     # Configure for different telescope observing modes
     if mode == 'Imaging':
@@ -89,86 +118,71 @@ def count_rates_new(Ahr, lamhr, solhr,
     fpa = f_airy(X)
 
     # Set wavelength grid
-    if COMPUTE_LAM:
-        lam, dlam = construct_lam(lammin, lammax, Res)
-    elif IMAGE:
-        pass
-    else:
-        # Throw error
-        print "Error in make_noise: Not computing wavelength grid or providing filters!"
-        return None
-
-    # Set Quantum Efficiency
-    q = set_quantum_efficiency(lam, qe, NIR=NIR)
-
-    # Set Dark current and Read noise
-    De = set_dark_current(lam, De, lammax, Tdet, NIR=NIR)
-    Re = set_read_noise(lam, Re, NIR=NIR)
-
-    # Set Angular size of lenslet
-    theta = set_lenslet(lam, lammin, diam, NIR=NIR)
+    with profile_stage(profile, "grid"):
+        if COMPUTE_LAM:
+            lam, dlam = construct_lam(lammin, lammax, Res)
+        elif IMAGE:
+            pass
+        else:
+            # Throw error
+            print "Error in make_noise: Not computing wavelength grid or providing filters!"
+            return None
+
+    with profile_stage(profile, "detector"):
+        # Set Quantum Efficiency
+        q = set_quantum_efficiency(lam, qe, NIR=NIR)
+
+        # Set Dark current and Read noise
+        De = set_dark_current(lam, De, lammax, Tdet, NIR=NIR)
+        Re = set_read_noise(lam, Re, NIR=NIR)
+
+        # Set Angular size of lenslet
+        theta = set_lenslet(lam, lammin, diam, NIR=NIR)
 
     # Set throughput
-    sep  = r/d*np.sin(alpha*np.pi/180.)*np.pi/180./3600. # separation in radians
-    T = set_throughput(lam, Tput, diam, sep, IWA, OWA, lammin, FIX_OWA=FIX_OWA, SILENT=SILENT)
+    with profile_stage(profile, "throughput"):
+        sep  = r/d*np.sin(alpha*np.pi/180.)*np.pi/180./3600. # separation in radians
+        T = set_throughput(lam, Tput, diam, sep, IWA, OWA, lammin, FIX_OWA=FIX_OWA, SILENT=SILENT)
 
-    # Modify throughput by atmospheric transmission if GROUND-based
+    # Modify throughput by atmospheric transmission if GROUND-based, and
+    # compute ground intensity due to sky background
     if GROUND:
-        Tatmos = set_atmos_throughput(lam, dlam, convolution_function)
+        with profile_stage(profile, "ground"):
+            Tatmos = set_atmos_throughput(lam, dlam, convolution_function)
+            Itherm  = get_thermal_ground_intensity(lam, dlam, convolution_function)
         # Multiply telescope throughput by atmospheric throughput
         T = T * Tatmos
+    else:
+        Itherm = None
 
     # Degrade albedo and stellar spectrum
-    if COMPUTE_LAM:
-        A = convolution_function(Ahr,lamhr,lam,dlam=dlam)
-        Fs = convolution_function(solhr, lamhr, lam, dlam=dlam)
-    elif IMAGE:
-        # Convolve with filter response
-        A = convolve_spec(Ahr, lamhr, filters)
-        Fs = convolve_spec(solhr, lamhr, filters)
-    else:
-        A = Ahr
-        Fs = solhr
+    with profile_stage(profile, "degrade"):
+        if COMPUTE_LAM:
+            # Both spectra share the hi-res grid, so reuse one cached operator
+            rebin = RebinOperator.cached(lamhr, lam, dlam=dlam, method=convolution_method)
+            A = rebin(Ahr)
+            Fs = rebin(solhr)
+        elif IMAGE:
+            # Convolve with filter response
+            A = convolve_spec(Ahr, lamhr, filters)
+            Fs = convolve_spec(solhr, lamhr, filters)
+        else:
+            A = Ahr
+            Fs = solhr
 
     # Compute fluxes
     #Fs = Fstar(lam, Teff, Rs, r, AU=True) # stellar flux on planet
-    Fp = Fplan(A, Phi, Fs, Rp, d)         # planet flux at telescope
     Cratio = FpFs(A, Phi, Rp, r)
 
     ##### Compute count rates #####
-    cp     =  cplan(q, fpa, T, lam, dlam, Fp, diam)                            # planet count rate
-    cz     =  czodi(q, X, T, lam, dlam, diam, MzV)                           # solar system zodi count rate
-    cez    =  cezodi(q, X, T, lam, dlam, diam, r, \
-        Fstar(lam,Teff,Rs,1.,AU=True), Nez, MezV)                            # exo-zodi count rate
-    csp    =  cspeck(q, T, C, lam, dlam, Fstar(lam,Teff,Rs,d), diam)         # speckle count rate
-    cD     =  cdark(De, X, lam, diam, theta, DNHpix, IMAGE=IMAGE)            # dark current count rate
-    cR     =  cread(Re, X, lam, diam, theta, DNHpix, Dtmax, IMAGE=IMAGE)     # readnoise count rate
-    if THERMAL:
-        cth    =  ctherm(q, X, lam, dlam, diam, Tsys, emis)                      # internal thermal count rate
-    else:
-        cth = np.zeros_like(cp)
-    # Add earth thermal photons if GROUND
-    if GROUND:
-        # Compute ground intensity due to sky background
-        Itherm  = get_thermal_ground_intensity(lam, dlam, convolution_function)
-        # Compute Earth thermal photon count rate
-        cthe = ctherm_earth(q, X, lam, dlam, diam, Itherm)
-        # Add earth thermal photon counts to telescope thermal counts
-        cth = cth + cthe
-        if False:
-            import matplotlib.pyplot as plt; from matplotlib import gridspec
-            fig2 = plt.figure(figsize=(8,6))
-            gs = gridspec.GridSpec(1,1)
-            ax1 = plt.subplot(gs[0])
-            ax1.plot(lam, cthe, c="blue", ls="steps-mid", label="Earth Thermal")
-            ax1.plot(lam, cth, c="red", ls="steps-mid", label="Telescope Thermal")
-            ax1.plot(lam, cp, c="k", ls="steps-mid", label="Planet")
-            ax1.set_ylabel("Photon Count Rate [1/s]")
-            ax1.set_xlabel("Wavelength [um]")
-            plt.show()
-
-    cb = (cz + cez + csp + cD + cR + cth)
-    cnoise =  cp + 2*cb                # assumes background subtraction
+    # All noise terms in one pass (fused numba loop if available, see
+    # count_rates_kernel); Earth thermal photons are added to cth if GROUND
+    cp, cz, cez, csp, cD, cR, cth, cnoise, DtSNR = \
+        count_rates_kernel(lam, dlam, q, T, A, Fs, De, Re, theta, Itherm,
+                           fpa, Phi, Rp, Teff, Rs, r, d, Nez, diam, C, X,
+                           DNHpix, Dtmax, Tsys, emis, MzV, MezV, wantsnr,
+                           IMAGE=IMAGE, THERMAL=THERMAL, backend=backend,
+                           profile=profile)
     ctot = cp + cz + cez + csp + cD + cR + cth
 
     '''
@@ -188,7 +202,17 @@ def count_rates_new(Ahr, lamhr, solhr,
     See also the top of page 4 of Brown (2005).
     '''
 
-    # Exposure time to SNR
-    DtSNR = exptime_element(lam, cp, cnoise, wantsnr)
+    # Give all per-target outputs the full broadcast shape
+    Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR = \
+        [np.array(x) for x in np.broadcast_arrays(Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR)]
 
     return lam, dlam, A, q, Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR
+
+def _expand(x):
+    """
+    Append a trailing (wavelength) axis to an array-valued parameter so that
+    it broadcasts against the wavelength grid. Scalars are returned unchanged.
+    """
+    if np.ndim(x) == 0:
+        return x
+    return np.asarray(x, dtype=float)[...,np.newaxis]
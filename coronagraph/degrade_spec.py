@@ -7,93 +7,139 @@ Created on Mon Jul  6 11:00:41 2015
 
 import numpy as np
 import scipy as sp
-from scipy import interpolate
-from scipy.stats import binned_statistic
+from scipy import sparse
+from .utils import LRUCache, hash_arrays
 
 def degrade_spec(specHR, lamHR, lamLR, dlam=None):
+    """
+    Degrade a high-resolution spectrum onto a low-resolution wavelength grid
+    by averaging it over each low-res spectral element.
+
+    The trapezoidal integral of the hi-res spectrum is accumulated once, the
+    low-res bin edges are located with a binary search, and every bin average
+    is obtained from a difference of the cumulative integral. Bins containing
+    3 or fewer hi-res points are linearly interpolated to the bin center
+    instead.
+
+    Parameters
+    ----------
+    specHR : array
+        High-res spectrum, or a 2-D (Nspec, Nhi) stack of spectra sharing
+        the same wavelength grid
+    lamHR : array
+        Wavelength grid for specHR (um)
+    lamLR : array
+        Low-res wavelength grid (um)
+    dlam : array (optional)
+        Low-res wavelength bin widths (um); computed from lamLR if not given
+
+    Returns
+    -------
+    specLO : array
+        Low-res spectrum, shaped (Nlo,) or (Nspec, Nlo)
+    """
 
     # Store input variables (not 100% necessary)
-    lamHI  = np.array(lamHR)
-    spec   = np.array(specHR)
-    lamLO  = np.array(lamLR)
+    lamHI  = np.array(lamHR, dtype=float)
+    spec   = np.array(specHR, dtype=float)
+    lamLO  = np.array(lamLR, dtype=float)
     if dlam is not None:
-        dlamLO = dlam
-
+        dlamLO = np.array(dlam, dtype=float)
 
     # Reverse ordering if wl vector is decreasing with index
     if lamHR[0] > lamHR[1]:
-        lamHI = np.array(lamHR[::-1])
-        spec = np.array(specHR[::-1])
+        lamHI = lamHI[::-1]
+        spec = spec[...,::-1]
     if lamLR[0] > lamLR[1]:
-        lamLO = np.array(lamLR[::-1])
+        lamLO = lamLO[::-1]
         if dlam is not None:
-            dlamLO = dlam[::-1]
-
-    # Number of gridpoints in output
-    Nspec = len(lamLO)
-    specLO = np.zeros(Nspec)
-
-    # Loop over all spectral elements
-    for i in range(Nspec):
-        #print 'i=',i
-        # If dlam not provided, must determine bin widths
-        if dlam is None:
-            # Define short and long wavelength edges of the
-            # low res grid, special cases at the edge of the grid
-            if i > 0 and i < Nspec-1:
-                #print "loop1"
-                lamS = 0.5*(lamLO[i-1] + lamLO[i])
-                lamL = 0.5*(lamLO[i+1] + lamLO[i])
-            elif i == 0:
-                #print "loop2"
-                lamS = lamLO[i] - 0.5*(lamLO[i+1] - lamLO[i])
-                lamL = 0.5*(lamLO[i+1] + lamLO[i])
-            else:
-                #print "loop3"
-                lamS = 0.5*(lamLO[i-1] + lamLO[i])
-                lamL = lamLO[i] + 0.5*(lamLO[i] - lamLO[i-1])
-        else:
-            lamS = lamLO[i] - 0.5*dlamLO[i]
-            lamL = lamLO[i] + 0.5*dlamLO[i]
-
-        # Elements of hi-res grid within the low-res element
-        eps = 1e-10
-        iss = (lamHI - lamS >= eps) & (lamHI - lamL <= eps)
-
-        # If there aren't any high-res elements within low
-        # res element, then error
-        check1 = False if True in iss else True
-        if check1:
-            print("Error in DEGRADE_SPECTRUM: wavelength grids do not sync")
-
-        # If 3 of less elements of spectrum within low-res gridpoint,
-        # then do an interpolation, otherwise, integrate the high-res
-        # spectrum over the low-res element, distributing the integrated
-        # energey into the low-res element
-        if len(lamHI[iss]) == 0:
-            print "No HiRes elements in Low Res bin!"
-            import sys; sys.exit()
-        elif len(lamHI[iss]) == 1:
-            specs = spec[iss]
-        elif len(lamHI[iss]) <= 3:
-            interpfunc = interpolate.interp1d(lamHI[iss], spec[iss], kind='linear',bounds_error=False)
-            specs = interpfunc(lamLO[i])
-        else:
-            interpfunc = interpolate.interp1d(lamHI[iss], spec[iss], kind='linear',bounds_error=False, fill_value=0.0)
-            speci = np.hstack([interpfunc(lamS), spec[iss], interpfunc(lamL)])
-            #print speci
-            lami = np.hstack([lamS,lamHI[iss],lamL])
-            #print lami
-            specs = np.trapz(speci,x=lami) / (lamL - lamS)
-            #print specs
+            dlamLO = dlamLO[::-1]
+
+    # Define short and long wavelength edges of each low-res element
+    if dlam is None:
+        lamS, lamL = _bin_edges(lamLO)
+    else:
+        lamS = lamLO - 0.5*dlamLO
+        lamL = lamLO + 0.5*dlamLO
+
+    # Elements of hi-res grid within each low-res element are i0:i1
+    eps = 1e-10
+    i0 = np.searchsorted(lamHI, lamS + eps, side='left')
+    i1 = np.searchsorted(lamHI, lamL + eps, side='right')
+    Nin = i1 - i0
+
+    # If there aren't any high-res elements within a low-res element, then error
+    if np.any(Nin <= 0):
+        raise ValueError("No HiRes elements in Low Res bin! "
+                         "Wavelength grids do not sync in degrade_spec().")
 
-        # Insert result into output array
-        specLO[i] = specs
+    # Integrate the high-res spectrum over each low-res element from
+    # differences of the cumulative integral, distributing the integrated
+    # energy into the low-res element. The spectrum is taken to fall to zero
+    # at the element edges, as in the original per-element integration.
+    # All spectra in a 2-D stack are integrated at once along the last axis.
+    cumint = np.cumsum(0.5*np.diff(lamHI)*(spec[...,1:] + spec[...,:-1]), axis=-1)
+    cumint = np.concatenate([np.zeros(spec.shape[:-1] + (1,)), cumint], axis=-1)
+    iS = np.minimum(i0, len(lamHI) - 1)
+    iL = np.maximum(i1 - 1, 0)
+    specLO = (cumint[...,iL] - cumint[...,iS] +
+              0.5*spec[...,iS]*(lamHI[iS] - lamS) +
+              0.5*spec[...,iL]*(lamL - lamHI[iL])) / (lamL - lamS)
+
+    # If 3 or less elements of spectrum within low-res gridpoint,
+    # then do an interpolation instead
+    one = (Nin == 1)
+    specLO[...,one] = spec[...,i0[one]]
+    few = (Nin > 1) & (Nin <= 3)
+    if np.any(few):
+        specLO[...,few] = _interp_within(lamLO[few], lamHI, spec, i0[few], i1[few])
 
     return specLO
 
+def _bin_edges(lamLO):
+    """
+    Short and long wavelength edges of a low-res grid, placed halfway between
+    neighboring gridpoints, with special cases at the edges of the grid.
+    """
+    mid = 0.5*(lamLO[1:] + lamLO[:-1])
+    lamS = np.concatenate([[lamLO[0] - 0.5*(lamLO[1] - lamLO[0])], mid])
+    lamL = np.concatenate([mid, [lamLO[-1] + 0.5*(lamLO[-1] - lamLO[-2])]])
+    return lamS, lamL
+
+def _interp_within(lamLO, lamHI, spec, i0, i1):
+    """
+    Linearly interpolate spec to lamLO using only the hi-res points i0:i1
+    within each low-res element; NaN outside of those points.
+    """
+    k = np.searchsorted(lamHI, lamLO, side='right') - 1
+    k = np.clip(k, i0, i1 - 2)
+    t = (lamLO - lamHI[k]) / (lamHI[k+1] - lamHI[k])
+    specLO = spec[...,k] + t*(spec[...,k+1] - spec[...,k])
+    outside = (lamLO < lamHI[i0]) | (lamLO > lamHI[i1-1])
+    specLO[...,outside] = np.nan
+    return specLO
+
 def downbin_spec(specHR, lamHR, lamLR, dlam=None):
     """
+    Down-bin a high-resolution spectrum onto a low-resolution wavelength grid
+    by taking the mean of all hi-res points within each low-res element.
+
+    Parameters
+    ----------
+    specHR : array
+        High-res spectrum, or a 2-D (Nspec, Nhi) stack of spectra sharing
+        the same wavelength grid
+    lamHR : array
+        Wavelength grid for specHR (um)
+    lamLR : array
+        Low-res wavelength grid (um)
+    dlam : array
+        Low-res wavelength bin widths (um)
+
+    Returns
+    -------
+    specLR : array
+        Low-res spectrum, shaped (Nlo,) or (Nspec, Nlo)
     """
 
     if dlam is None:
@@ -110,7 +156,264 @@ def downbin_spec(specHR, lamHR, lamLR, dlam=None):
     # Calculate bin edges
     LRedges = np.hstack([lamLR - 0.5*dlam, lamLR[-1]+0.5*dlam[-1]])
 
-    # Call scipy.stats.binned_statistic()
+    # Call scipy.stats.binned_statistic(), which bins every row of a 2-D
+    # stack of spectra in one pass (scipy.stats is slow to import, so
+    # only do so when needed)
+    from scipy.stats import binned_statistic
     specLR = binned_statistic(lamHR, specHR, statistic="mean", bins=LRedges)[0]
 
     return specLR
+
+class RebinOperator(object):
+    """
+    Linear operator that rebins spectra from a fixed high-res wavelength grid
+    onto a fixed low-res grid, stored as a sparse CSR matrix so that any
+    spectrum on the hi-res grid is degraded with a single sparse mat-vec.
+
+    Parameters
+    ----------
+    lamHR : array
+        High-res wavelength grid (um)
+    lamLR : array
+        Low-res wavelength grid (um)
+    dlam : array (optional)
+        Low-res wavelength bin widths (um)
+    method : str (optional)
+        'degrade' to reproduce degrade_spec(), or 'downbin' to reproduce
+        downbin_spec()
+
+    Note
+    ----
+    Use RebinOperator.cached() to share operators between calls that use
+    identical grids.
+    """
+
+    # Operators shared between calls, keyed by a hash of the grids
+    _cache = LRUCache(maxsize=16)
+
+    def __init__(self, lamHR, lamLR, dlam=None, method="degrade"):
+        lamHR = np.asarray(lamHR, dtype=float)
+        lamLR = np.asarray(lamLR, dtype=float)
+        if method == "degrade":
+            rows, cols, weights, self.nan_rows = _degrade_weights(lamHR, lamLR, dlam)
+        elif method == "downbin":
+            rows, cols, weights, self.nan_rows = _downbin_weights(lamHR, lamLR, dlam)
+        else:
+            raise ValueError("Invalid RebinOperator method. Select 'degrade' or 'downbin'.")
+        self.method = method
+        self.shape = (len(lamLR), len(lamHR))
+        self.matrix = sparse.csr_matrix((weights, (rows, cols)), shape=self.shape)
+
+    @classmethod
+    def cached(cls, lamHR, lamLR, dlam=None, method="degrade"):
+        """
+        Return the operator for these grids, constructing it only if it is
+        not already in the LRU cache.
+        """
+        key = (method, hash_arrays(lamHR, lamLR, dlam))
+        op = cls._cache.get(key)
+        if op is None:
+            op = cls(lamHR, lamLR, dlam=dlam, method=method)
+            cls._cache.set(key, op)
+        return op
+
+    def __call__(self, specHR):
+        """
+        Rebin a spectrum, or a 2-D (Nspec, Nhi) stack of spectra, on the
+        hi-res grid onto the low-res grid.
+        """
+        specHR = np.asarray(specHR, dtype=float)
+        if specHR.ndim == 1:
+            specLO = self.matrix.dot(specHR)
+        else:
+            specLO = self.matrix.dot(specHR.T).T
+        specLO[...,self.nan_rows] = np.nan
+        return specLO
+
+def rebin_spec(specHR, lamHR, lamLR, dlam=None, method="degrade"):
+    """
+    Drop-in replacement for degrade_spec() and downbin_spec() that applies a
+    cached RebinOperator, so repeated calls on the same grids only cost a
+    sparse mat-vec.
+    """
+    return RebinOperator.cached(lamHR, lamLR, dlam=dlam, method=method)(specHR)
+
+def _degrade_weights(lamHR, lamLR, dlam=None):
+    """
+    Sparse (row, col, weight) triplets and NaN rows reproducing degrade_spec().
+    """
+    # Work on increasing grids, as in degrade_spec()
+    Nhi = len(lamHR)
+    revHI = lamHR[0] > lamHR[1]
+    lamHI = lamHR[::-1] if revHI else lamHR
+    lamLO = np.array(lamLR)
+    if dlam is not None:
+        dlamLO = np.asarray(dlam, dtype=float)
+    if lamLR[0] > lamLR[1]:
+        lamLO = lamLO[::-1]
+        if dlam is not None:
+            dlamLO = dlamLO[::-1]
+
+    # Low-res element edges and hi-res elements within each one (i0:i1)
+    if dlam is None:
+        lamS, lamL = _bin_edges(lamLO)
+    else:
+        lamS = lamLO - 0.5*dlamLO
+        lamL = lamLO + 0.5*dlamLO
+    eps = 1e-10
+    i0 = np.searchsorted(lamHI, lamS + eps, side='left')
+    i1 = np.searchsorted(lamHI, lamL + eps, side='right')
+    Nin = i1 - i0
+    if np.any(Nin <= 0):
+        raise ValueError("No HiRes elements in Low Res bin! "
+                         "Wavelength grids do not sync in RebinOperator.")
+
+    # Integrated elements: trapezoid weights over [lamS, in-bin points, lamL]
+    iint = np.where(Nin > 3)[0]
+    n = Nin[iint]
+    rows = np.repeat(iint, n)
+    first = np.repeat(np.cumsum(n) - n, n)
+    pos = np.arange(np.sum(n)) - first
+    cols = np.repeat(i0[iint], n) + pos
+    left = np.where(pos == 0, np.repeat(lamS[iint], n), lamHI[np.maximum(cols - 1, 0)])
+    right = np.where(pos == np.repeat(n - 1, n), np.repeat(lamL[iint], n),
+                     lamHI[np.minimum(cols + 1, Nhi - 1)])
+    weights = 0.5*(right - left) / np.repeat(lamL[iint] - lamS[iint], n)
+    rows, cols, weights = [rows], [cols], [weights]
+
+    # Single element: take its value
+    ione = np.where(Nin == 1)[0]
+    rows.append(ione)
+    cols.append(i0[ione])
+    weights.append(np.ones(len(ione)))
+
+    # Two or three elements: linear interpolation to the bin center
+    ifew = np.where((Nin > 1) & (Nin <= 3))[0]
+    k = np.searchsorted(lamHI, lamLO[ifew], side='right') - 1
+    k = np.clip(k, i0[ifew], i1[ifew] - 2)
+    t = (lamLO[ifew] - lamHI[k]) / (lamHI[k+1] - lamHI[k])
+    rows.extend([ifew, ifew])
+    cols.extend([k, k + 1])
+    weights.extend([1.0 - t, t])
+    outside = (lamLO[ifew] < lamHI[i0[ifew]]) | (lamLO[ifew] > lamHI[i1[ifew]-1])
+
+    cols = np.concatenate(cols)
+    if revHI:
+        cols = Nhi - 1 - cols
+    return np.concatenate(rows), cols, np.concatenate(weights), ifew[outside]
+
+def _downbin_weights(lamHR, lamLR, dlam=None):
+    """
+    Sparse (row, col, weight) triplets and NaN rows reproducing downbin_spec().
+    """
+    if dlam is None:
+        raise ValueError("Please supply dlam in downbin_spec()")
+    dlam = np.asarray(dlam, dtype=float)
+
+    LRedges = _downbin_edges(lamLR, dlam)
+    Nbin = len(lamLR)
+    ibin, inside = _downbin_index(LRedges, lamHR)
+    cols = np.where(inside)[0]
+    rows = ibin[inside]
+
+    # Average of all hi-res points in each bin; empty bins are NaN
+    counts = np.bincount(rows, minlength=Nbin)
+    weights = 1.0 / counts[rows]
+    return rows, cols, weights, np.where(counts == 0)[0]
+
+def _downbin_edges(lamLR, dlam):
+    """
+    Low-res bin edges, as in downbin_spec().
+    """
+    LRedges = np.hstack([lamLR - 0.5*dlam, lamLR[-1]+0.5*dlam[-1]])
+    if np.any(np.diff(LRedges) < 0):
+        raise ValueError("Bin edges must be monotonically increasing in downbin_spec()")
+    return LRedges
+
+def _downbin_index(LRedges, lamHR):
+    """
+    Bin index of each hi-res point, following scipy.stats.binned_statistic(),
+    and whether it falls inside the low-res grid.
+    """
+    Nbin = len(LRedges) - 1
+    ibin = np.searchsorted(LRedges, lamHR, side='right') - 1
+    ibin[lamHR == LRedges[-1]] = Nbin - 1
+    inside = (ibin >= 0) & (ibin < Nbin)
+    return ibin, inside
+
+class DownbinAccumulator(object):
+    """
+    Streaming version of downbin_spec(): hi-res points are added in chunks
+    (in any order) and only the running sum and count in each low-res bin
+    are kept, so the full hi-res spectrum never has to be in memory.
+
+    Parameters
+    ----------
+    lamLR : array
+        Low-res wavelength grid (um)
+    dlam : array
+        Low-res wavelength bin widths (um)
+    Nspec : int (optional)
+        Number of spectra binned together; add() then takes (Nspec, N) stacks
+
+    Example
+    -------
+    >>> acc = DownbinAccumulator(lam, dlam)
+    >>> for lamHR, specHR in chunks:
+    ...     acc.add(lamHR, specHR)
+    >>> specLR = acc.result()
+    """
+
+    def __init__(self, lamLR, dlam, Nspec=None):
+        self.lamLR = np.asarray(lamLR, dtype=float)
+        self.edges = _downbin_edges(self.lamLR, np.asarray(dlam, dtype=float))
+        self.Nspec = Nspec
+        Nbin = len(self.lamLR)
+        self.counts = np.zeros(Nbin)
+        if Nspec is None:
+            self.sums = np.zeros(Nbin)
+        else:
+            self.sums = np.zeros((Nspec, Nbin))
+
+    @property
+    def lammin(self):
+        # Lower edge of the grid; shorter wavelengths are not binned
+        return self.edges[0]
+
+    @property
+    def lammax(self):
+        # Upper edge of the grid; longer wavelengths are not binned
+        return self.edges[-1]
+
+    def add(self, lamHR, specHR):
+        """
+        Add a chunk of hi-res points to the bins.
+
+        Parameters
+        ----------
+        lamHR : array
+            Wavelengths of the chunk (um)
+        specHR : array
+            Spectrum, or a (Nspec, N) stack of spectra, at lamHR
+        """
+        lamHR = np.asarray(lamHR, dtype=float)
+        specHR = np.asarray(specHR, dtype=float)
+        Nbin = len(self.counts)
+        ibin, inside = _downbin_index(self.edges, lamHR)
+        ibin = ibin[inside]
+        self.counts += np.bincount(ibin, minlength=Nbin)
+        if self.Nspec is None:
+            self.sums += np.bincount(ibin, weights=specHR[inside], minlength=Nbin)
+        else:
+            for k in range(self.Nspec):
+                self.sums[k] += np.bincount(ibin, weights=specHR[k][inside], minlength=Nbin)
+
+    def result(self):
+        """
+        Mean of the hi-res points in each bin (NaN for empty bins), shaped
+        (Nlo,) or (Nspec, Nlo).
+        """
+        with np.errstate(invalid="ignore", divide="ignore"):
+            specLR = self.sums / self.counts
+        specLR[...,self.counts == 0] = np.nan
+        return specLR
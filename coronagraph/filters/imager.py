@@ -1,7 +1,6 @@
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib import gridspec
 import os
+from ..utils import import_pyplot
 
 class Filter(object):
     """Filter for telescope imaging mode.
@@ -60,6 +59,7 @@ class Wheel(object):
      
     def plot(self, ax=None):
         
+        mpl, plt, gridspec = import_pyplot()
         if ax == None:
             fig = plt.figure(figsize=(14,10))
             gs = gridspec.GridSpec(1,1) 
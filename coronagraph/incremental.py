@@ -0,0 +1,344 @@
+# Import dependent modules
+import numpy as np
+from collections import OrderedDict
+from functools import partial
+from .degrade_spec import rebin_spec, RebinOperator
+from .convolve_spec import FilterBank
+from .noise_routines import Fstar, Fplan, FpFs, cplan, czodi, cezodi, cspeck, \
+    cdark, cread, ctherm, f_airy, ctherm_earth, construct_lam, \
+    set_quantum_efficiency, set_read_noise, set_dark_current, set_lenslet, \
+    set_throughput, set_atmos_throughput, get_thermal_ground_intensity, \
+    exptime_element
+from .count_rates_new import _expand
+from .observe import process_noise
+from .utils import profile_stage, hash_arrays
+
+# Parameters of the evaluator and their defaults, as in count_rates_new(),
+# plus the integration time (hours) and number of noise realizations used
+# for the noised spectrum
+PARAMETERS = OrderedDict([
+    ("mode", "IFS"), ("filter_wheel", None),
+    ("lammin", 0.4), ("lammax", 2.5), ("Res", 70.0), ("diam", 10.0),
+    ("Tput", 0.05), ("C", 1e-10), ("IWA", 3.0), ("OWA", 20.0),
+    ("Tsys", 150.0), ("Tdet", 50.0), ("emis", 0.9), ("De", 1e-4),
+    ("DNHpix", 3.0), ("Re", 0.1), ("Dtmax", 1.0), ("X", 1.5), ("qe", 0.9),
+    ("MzV", 23.0), ("MezV", 22.0), ("wantsnr", 10.0),
+    ("FIX_OWA", False), ("SILENT", False), ("NIR", True),
+    ("THERMAL", False), ("GROUND", False),
+    ("itime", 10.0), ("Nreal", None),
+])
+
+# Parameters given a wavelength axis when they are arrays (see _expand)
+EXPANDED = ("alpha", "Phi", "Rp", "Teff", "Rs", "r", "d", "Nez", "diam",
+            "Tput", "C", "X")
+
+# Convolution method for IFS spectra, as in count_rates_new()
+CONVOLUTION_METHOD = "downbin"
+
+def _grid(mode, filter_wheel, lammin, lammax, Res):
+    if mode == 'Imaging':
+        # sorted filter dict by bandcenters
+        tdict = sorted(filter_wheel.__dict__.items(), key=lambda x: x[1].bandcenter)
+        lam = np.array([x[1].bandcenter for x in tdict])
+        dlam = np.array([x[1].FWHM for x in tdict])
+        return lam, dlam
+    elif mode == 'IFS':
+        return construct_lam(lammin, lammax, Res)
+    raise ValueError("Invalid telescope observing mode. Select 'IFS', or 'Imaging'.")
+
+def _rebin(mode, filter_wheel, lamhr, grid):
+    # Operator taking a hi-res spectrum onto the wavelength grid
+    if mode == 'Imaging':
+        return FilterBank.cached(filter_wheel, lamhr)
+    lam, dlam = grid
+    return RebinOperator.cached(lamhr, lam, dlam=dlam, method=CONVOLUTION_METHOD)
+
+def _sep(r, d, alpha):
+    return r/d*np.sin(alpha*np.pi/180.)*np.pi/180./3600. # separation in radians
+
+def _Tatmos(GROUND, lam, dlam):
+    if not GROUND:
+        return None
+    return set_atmos_throughput(lam, dlam, partial(rebin_spec, method=CONVOLUTION_METHOD))
+
+def _Itherm(GROUND, lam, dlam):
+    if not GROUND:
+        return None
+    return get_thermal_ground_intensity(lam, dlam, partial(rebin_spec, method=CONVOLUTION_METHOD))
+
+def _T(Tinst, Tatmos):
+    if Tatmos is None:
+        return Tinst
+    return Tinst * Tatmos
+
+def _cth(THERMAL, Itherm, q, X, lam, dlam, diam, Tsys, emis):
+    if THERMAL:
+        cth = ctherm(q, X, lam, dlam, diam, Tsys, emis)         # internal thermal count rate
+    else:
+        cth = np.zeros_like(lam)
+    if Itherm is not None:
+        cth = cth + ctherm_earth(q, X, lam, dlam, diam, Itherm) # Earth thermal count rate
+    return cth
+
+def _noise(itime, Nreal, Cratio, cp, cb, rng):
+    return process_noise(itime * 3600., Cratio, cp, cb, Nreal=Nreal, rng=rng)
+
+# Stages of the calculation: name : (inputs, function). Inputs are
+# parameters or earlier stages, passed to the function in order.
+STAGES = OrderedDict([
+    ("grid",    (("mode", "filter_wheel", "lammin", "lammax", "Res"), _grid)),
+    ("lam",     (("grid",), lambda grid: grid[0])),
+    ("dlam",    (("grid",), lambda grid: grid[1])),
+    ("IMAGE",   (("mode",), lambda mode: mode == 'Imaging')),
+    ("fpa",     (("X",), f_airy)),   # fraction of planetary signal in Airy pattern
+    ("q",       (("lam", "qe", "NIR"),
+                 lambda lam, qe, NIR: set_quantum_efficiency(lam, qe, NIR=NIR))),
+    ("De_lam",  (("lam", "De", "lammax", "Tdet", "NIR"),
+                 lambda lam, De, lammax, Tdet, NIR:
+                     set_dark_current(lam, De, lammax, Tdet, NIR=NIR))),
+    ("Re_lam",  (("lam", "Re", "NIR"),
+                 lambda lam, Re, NIR: set_read_noise(lam, Re, NIR=NIR))),
+    ("theta",   (("lam", "lammin", "diam", "NIR"),
+                 lambda lam, lammin, diam, NIR: set_lenslet(lam, lammin, diam, NIR=NIR))),
+    ("sep",     (("r", "d", "alpha"), _sep)),
+    ("Tinst",   (("lam", "Tput", "diam", "sep", "IWA", "OWA", "lammin", "FIX_OWA", "SILENT"),
+                 lambda lam, Tput, diam, sep, IWA, OWA, lammin, FIX_OWA, SILENT:
+                     set_throughput(lam, Tput, diam, sep, IWA, OWA, lammin,
+                                    FIX_OWA=FIX_OWA, SILENT=SILENT))),
+    ("Tatmos",  (("GROUND", "lam", "dlam"), _Tatmos)),
+    ("Itherm",  (("GROUND", "lam", "dlam"), _Itherm)),
+    ("T",       (("Tinst", "Tatmos"), _T)),
+    ("rebin",   (("mode", "filter_wheel", "lamhr", "grid"), _rebin)),
+    ("A",       (("rebin", "Ahr"), lambda rebin, Ahr: rebin(Ahr))),
+    ("Fs",      (("rebin", "solhr"), lambda rebin, solhr: rebin(solhr))),
+    ("Fp",      (("A", "Phi", "Fs", "Rp", "d"), Fplan)),        # planet flux at telescope
+    ("Cratio",  (("A", "Phi", "Rp", "r"), FpFs)),
+    ("Fs1AU",   (("lam", "Teff", "Rs"),
+                 lambda lam, Teff, Rs: Fstar(lam, Teff, Rs, 1., AU=True))),
+    ("Fsd",     (("lam", "Teff", "Rs", "d"), Fstar)),
+    ("cp",      (("q", "fpa", "T", "lam", "dlam", "Fp", "diam"), cplan)),
+    ("cz",      (("q", "X", "T", "lam", "dlam", "diam", "MzV"), czodi)),
+    ("cez",     (("q", "X", "T", "lam", "dlam", "diam", "r", "Fs1AU", "Nez", "MezV"), cezodi)),
+    ("csp",     (("q", "T", "C", "lam", "dlam", "Fsd", "diam"), cspeck)),
+    ("cD",      (("De_lam", "X", "lam", "diam", "theta", "DNHpix", "IMAGE"),
+                 lambda De, X, lam, diam, theta, DNHpix, IMAGE:
+                     cdark(De, X, lam, diam, theta, DNHpix, IMAGE=IMAGE))),
+    ("cR",      (("Re_lam", "X", "lam", "diam", "theta", "DNHpix", "Dtmax", "IMAGE"),
+                 lambda Re, X, lam, diam, theta, DNHpix, Dtmax, IMAGE:
+                     cread(Re, X, lam, diam, theta, DNHpix, Dtmax, IMAGE=IMAGE))),
+    ("cth",     (("THERMAL", "Itherm", "q", "X", "lam", "dlam", "diam", "Tsys", "emis"), _cth)),
+    ("cb",      (("cz", "cez", "csp", "cD", "cR", "cth"),
+                 lambda cz, cez, csp, cD, cR, cth: cz + cez + csp + cD + cR + cth)),
+    ("cnoise",  (("cp", "cb"), lambda cp, cb: cp + 2*cb)),   # assumes background subtraction
+    ("DtSNR",   (("lam", "cp", "cnoise", "wantsnr"), exptime_element)),
+    ("noise",   (("itime", "Nreal", "Cratio", "cp", "cb", "rng"), _noise)),
+])
+
+def _dependents(stages):
+    """
+    Map each parameter and stage to every stage that depends on it,
+    directly or indirectly, in evaluation order.
+    """
+    direct = {}
+    for name, (inputs, func) in stages.items():
+        for x in inputs:
+            direct.setdefault(x, []).append(name)
+    order = list(stages)
+    dependents = {}
+    for x in direct:
+        found = set()
+        todo = list(direct[x])
+        while todo:
+            name = todo.pop()
+            if name not in found:
+                found.add(name)
+                todo.extend(direct.get(name, []))
+        dependents[x] = [name for name in order if name in found]
+    return dependents
+
+class IncrementalEvaluator(object):
+    """
+    Count rate calculation of count_rates_new() split into stages that are
+    recomputed only when their inputs change.
+
+    Each stage (the wavelength grid, detector properties, throughput,
+    degraded spectra, each noise term, ...) remembers its result. Changing a
+    parameter with set() only discards the stages that depend on it, and
+    they are recomputed on the next access; everything else is reused. For
+    example changing alpha recomputes the throughput and the count rates
+    that scale with it, C only the speckle count rate, Dtmax only the read
+    noise count rate and itime only the noised spectrum (plus, in each
+    case, the background sum and exposure times that depend on them),
+    without degrading the hi-res spectra again.
+
+    Parameters
+    ----------
+    Ahr : array
+        hi-res planetary albedo spectrum
+    lamhr : array
+        wavelength grid for Ahr (um)
+    solhr : array
+        hi-res TOA solar spectrum (W/m**2/um)
+    alpha, Phi, Rp, Teff, Rs, r, d, Nez : float or array
+        Planet and star parameters as in count_rates_new()
+    rng : numpy.random.Generator (optional)
+        Random number generator for the noised spectrum, see process_noise()
+    profile : dict (optional)
+        If given, filled with the time and memory of each stage evaluation,
+        see profile_stage()
+    **kwargs
+        Any other parameter of count_rates_new() (mode, filter_wheel,
+        lammin, ..., wantsnr, FIX_OWA, SILENT, NIR, THERMAL, GROUND), the
+        integration time itime (hours) and the number of noise realizations
+        Nreal, with defaults in PARAMETERS
+
+    Attributes
+    ----------
+    evaluations : dict
+        Number of times each stage has been computed
+
+    Note
+    ----
+    Stage results are available as attributes or items (evaluator.cp,
+    evaluator["DtSNR"]), see STAGES for the full list. As in
+    count_rates_new(), array-valued planet and star parameters are
+    broadcast against the wavelength grid. The noise terms are evaluated
+    with NumPy, matching count_rates_new(backend="numpy").
+    """
+
+    def __init__(self, Ahr, lamhr, solhr, alpha, Phi, Rp, Teff, Rs, r, d, Nez,
+                 rng=None, profile=None, **kwargs):
+        unknown = [k for k in kwargs if k not in PARAMETERS]
+        if unknown:
+            raise TypeError("Unknown parameters: %s" % ", ".join(unknown))
+        self.profile = profile
+        self.evaluations = dict((name, 0) for name in STAGES)
+        self._params = dict(PARAMETERS)
+        self._params.update(kwargs)
+        self._params.update(Ahr=Ahr, lamhr=lamhr, solhr=solhr, alpha=alpha,
+                            Phi=Phi, Rp=Rp, Teff=Teff, Rs=Rs, r=r, d=d, Nez=Nez,
+                            rng=rng)
+        for name in EXPANDED:
+            self._params[name] = _expand(self._params[name])
+        # Content digests of array parameters, so that arrays modified in
+        # place and passed to set() again are recognized as changed
+        self._digests = dict((name, hash_arrays(value))
+                             for name, value in self._params.items()
+                             if isinstance(value, np.ndarray))
+        self._values = {}
+
+    def set(self, **params):
+        """
+        Change parameters, discarding only the stages that depend on them.
+        Parameters set to their current value invalidate nothing. Arrays
+        are compared by content with their value at the last set(), so an
+        array modified in place must be passed to set() again.
+
+        Returns
+        -------
+        stale : list
+            Stages that will be recomputed on the next access
+        """
+        stale = set()
+        for name, value in params.items():
+            if name not in self._params:
+                raise TypeError("Unknown parameter: %s" % name)
+            if name in EXPANDED:
+                value = _expand(value)
+            if isinstance(value, np.ndarray) or name in self._digests:
+                digest = hash_arrays(value) if isinstance(value, np.ndarray) else None
+                if digest is not None and digest == self._digests.get(name):
+                    continue
+                if digest is None:
+                    del self._digests[name]
+                else:
+                    self._digests[name] = digest
+            elif _same(self._params[name], value):
+                continue
+            self._params[name] = value
+            stale.update(_DEPENDENTS.get(name, []))
+        for name in stale:
+            self._values.pop(name, None)
+        return [name for name in STAGES if name in stale]
+
+    def get(self, name):
+        """
+        Value of a parameter or stage, computing the stage (and any stale
+        stages it depends on) if needed.
+        """
+        if name in self._params:
+            return self._params[name]
+        if name not in STAGES:
+            raise KeyError("Unknown parameter or stage: %s" % name)
+        try:
+            return self._values[name]
+        except KeyError:
+            pass
+        inputs, func = STAGES[name]
+        args = [self.get(x) for x in inputs]
+        with profile_stage(self.profile, name):
+            value = func(*args)
+        self.evaluations[name] += 1
+        self._values[name] = value
+        return value
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __getattr__(self, name):
+        # Only called for names that aren't regular attributes
+        if name.startswith("_") or (name not in STAGES and
+                                    name not in self.__dict__.get("_params", {})):
+            raise AttributeError(name)
+        return self.get(name)
+
+    @property
+    def stale(self):
+        """
+        Stages that have not been computed since their inputs last changed.
+        """
+        return [name for name in STAGES if name not in self._values]
+
+    def count_rates(self):
+        """
+        Photon count rates, in the same order as count_rates_new()
+
+        Returns
+        -------
+        lam, dlam, A, q, Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR : array
+        """
+        lam, dlam, A, q = [self.get(x) for x in ("lam", "dlam", "A", "q")]
+        # Give all per-target outputs the full broadcast shape
+        Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR = [np.array(x) for x in
+            np.broadcast_arrays(*[self.get(x) for x in
+                ("Cratio", "cp", "csp", "cz", "cez", "cD", "cR", "cth", "DtSNR")])]
+        return lam, dlam, A, q, Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR
+
+    def observe(self):
+        """
+        Noised spectrum for the integration time itime, as in
+        generate_observation()
+
+        Returns
+        -------
+        spec : array
+            Noised Planet/Star flux ratio in each spectral bin
+        sig : array
+            One-sigma errors on flux ratio in each spectral bin
+        SNR : array
+            Signal-to-noise ratio in each spectral bin
+        """
+        return self.get("noise")
+
+_DEPENDENTS = _dependents(STAGES)
+
+def _same(old, new):
+    """
+    Whether a (non-array) parameter value is unchanged.
+    """
+    if old is new:
+        return True
+    try:
+        return bool(old == new)
+    except (TypeError, ValueError):
+        return False
@@ -0,0 +1,255 @@
+# Import dependent modules
+import numpy as np
+import sys
+from functools import partial
+from .degrade_spec import rebin_spec, RebinOperator
+from .convolve_spec import convolve_spec
+from .noise_routines import Fstar, Fplan, FpFs, cplan, czodi, cezodi, cspeck, \
+    cdark, cread, ctherm, f_airy, ctherm_earth, construct_lam, \
+    set_quantum_efficiency, set_read_noise, set_dark_current, set_lenslet, \
+    set_throughput, set_atmos_throughput, get_thermal_ground_intensity, \
+    exptime_element
+from .count_rates_new import _expand
+from .Noise import Output
+
+class Instrument(object):
+    """
+    Telescope "compiled" for repeated count rate evaluations.
+
+    Everything in count_rates_new() that depends only on the telescope (the
+    wavelength grid, quantum efficiency, dark current, read noise, lenslet
+    size, Airy fraction, dark/read count rates, telescope thermal counts and,
+    if GROUND, the site transmission and sky thermal counts) is computed once
+    here. evaluate() then only does the work that depends on the target.
+
+    Parameters
+    ----------
+    telescope : Telescope
+        Telescope object containing parameters. Its values are copied at
+        construction; build a new Instrument after modifying the telescope.
+    wantsnr : float (optional)
+        Signal-to-noise required in each spectral element for DtSNR
+    FIX_OWA : bool
+        set to fix OWA at OWA*lammin/D, as would occur if lenslet array is limiting the OWA
+    SILENT : bool
+        Suppress printing
+    NIR : bool
+        re-adjusts pixel size in NIR, as would occur if a second instrument was designed to handle the NIR
+    THERMAL : bool
+        set to compute thermal photon counts due to telescope temperature
+    GROUND : bool
+        set to include atmospheric transmission and sky thermal emission
+    convolution_method : str (optional)
+        'downbin' or 'degrade', see RebinOperator
+    """
+
+    def __init__(self, telescope, wantsnr=10.0, FIX_OWA=False, SILENT=False,
+                 NIR=True, THERMAL=False, GROUND=False,
+                 convolution_method="downbin"):
+
+        self.wantsnr = wantsnr
+        self.FIX_OWA = FIX_OWA
+        self.SILENT = SILENT
+        self.GROUND = GROUND
+        self.convolution_method = convolution_method
+
+        # Telescope Parameters
+        self.mode   = telescope.mode
+        self.lammin = telescope.lammin       # Wavelength minimum
+        self.lammax = telescope.lammax       # Wavelength maximum
+        self.Res    = telescope.resolution   # Resolving power
+        self.diam   = telescope.diameter     # Diameter (m)
+        self.Tput   = telescope.throughput   # Throughput
+        self.C      = telescope.contrast     # Raw contrast
+        self.IWA    = telescope.IWA          # Inner working angle
+        self.OWA    = telescope.OWA          # Outer working angle
+        self.X      = telescope.X            # size of photometric aperture (lambda/D)
+
+        # Configure for different telescope observing modes
+        if self.mode == 'Imaging':
+            self.filters = telescope.filter_wheel
+            self.IMAGE = True
+            # sorted filter dict by bandcenters
+            tdict = sorted(self.filters.__dict__.items(), key=lambda x: x[1].bandcenter)
+            # Construct array of wavelengths
+            self.lam = np.array([x[1].bandcenter for x in tdict])
+            # Construct array of wavelength bin widths (FWHM)
+            self.dlam = np.array([x[1].FWHM for x in tdict])
+        elif self.mode == 'IFS':
+            self.filters = None
+            self.IMAGE = False
+            self.lam, self.dlam = construct_lam(self.lammin, self.lammax, self.Res)
+        else:
+            print("Invalid telescope observing mode. Select 'IFS', or 'Imaging'.")
+            sys.exit()
+        lam, dlam, diam, X = self.lam, self.dlam, self.diam, self.X
+
+        # fraction of planetary signal in Airy pattern
+        self.fpa = f_airy(X)
+
+        # Set Quantum Efficiency
+        self.q = set_quantum_efficiency(lam, telescope.qe, NIR=NIR)
+
+        # Set Dark current and Read noise
+        self.De = set_dark_current(lam, telescope.darkcurrent, self.lammax,
+                                   telescope.Tdet, NIR=NIR)
+        self.Re = set_read_noise(lam, telescope.readnoise, NIR=NIR)
+
+        # Set Angular size of lenslet
+        self.theta = set_lenslet(lam, self.lammin, diam, NIR=NIR)
+
+        # Detector count rates
+        self.cD = cdark(self.De, X, lam, diam, self.theta, telescope.DNHpix,
+                        IMAGE=self.IMAGE)                                   # dark current count rate
+        self.cR = cread(self.Re, X, lam, diam, self.theta, telescope.DNHpix,
+                        telescope.Dtmax, IMAGE=self.IMAGE)                  # readnoise count rate
+        if THERMAL:
+            self.cth = ctherm(self.q, X, lam, dlam, diam, telescope.Tsys,
+                              telescope.emissivity)                         # internal thermal count rate
+        else:
+            self.cth = np.zeros_like(lam)
+
+        # Atmospheric transmission and Earth thermal photons if GROUND
+        convolve = partial(rebin_spec, method=convolution_method)
+        if GROUND:
+            self.Tatmos = set_atmos_throughput(lam, dlam, convolve)
+            Itherm = get_thermal_ground_intensity(lam, dlam, convolve)
+            self.cth = self.cth + ctherm_earth(self.q, X, lam, dlam, diam, Itherm)
+        else:
+            self.Tatmos = None
+
+    def evaluate(self, planet, star, spectrum):
+        """
+        Generate photon count rates for one target.
+
+        Parameters
+        ----------
+        planet : Planet
+            Planet object containing parameters
+        star : Star
+            Star object containing parameters
+        spectrum : Spectrum
+            Spectrum object (or any object with wl, spec and starflux
+            attributes) holding the hi-res wavelength grid (um), albedo
+            spectrum and TOA stellar flux (W/m**2/um)
+
+        Returns
+        -------
+        output : Output
+            Output object holding the count rates
+
+        Note
+        ----
+        As in count_rates_new(), planet and star parameters may be arrays,
+        which are broadcast against the wavelength grid.
+        """
+        # Degrade albedo and stellar spectrum
+        A, Fs = self.degrade(spectrum)
+        return self.evaluate_degraded(planet, star, A, Fs)
+
+    def degrade(self, spectrum):
+        """
+        Degrade a hi-res albedo and stellar spectrum onto the instrument's
+        wavelength grid.
+
+        Parameters
+        ----------
+        spectrum : Spectrum
+            Spectrum object (or any object with wl, spec and starflux
+            attributes), see evaluate()
+
+        Returns
+        -------
+        A : array
+            Albedo spectrum on lam
+        Fs : array or None
+            TOA stellar flux on lam (W/m**2/um), None if spectrum.starflux is
+        """
+        if self.IMAGE:
+            # Convolve with filter response
+            A = convolve_spec(spectrum.spec, spectrum.wl, self.filters)
+            Fs = None if spectrum.starflux is None else \
+                convolve_spec(spectrum.starflux, spectrum.wl, self.filters)
+        else:
+            rebin = RebinOperator.cached(spectrum.wl, self.lam, dlam=self.dlam,
+                                         method=self.convolution_method)
+            A = rebin(spectrum.spec)
+            Fs = None if spectrum.starflux is None else rebin(spectrum.starflux)
+        return A, Fs
+
+    def starflux(self, Fs, Teff, Rs, r):
+        """
+        TOA stellar flux at the planet on lam (W/m**2/um): Fs if given,
+        otherwise the blackbody flux of a star of temperature Teff (K) and
+        radius Rs (solar radii) at r (AU).
+        """
+        if Fs is None:
+            return Fstar(self.lam, Teff, Rs, r, AU=True)
+        return Fs
+
+    def evaluate_degraded(self, planet, star, A, Fs):
+        """
+        Generate photon count rates from an albedo and stellar spectrum that
+        are already on the instrument's wavelength grid (see degrade()), so
+        that they can be reused across targets.
+
+        Parameters
+        ----------
+        planet : Planet
+            Planet object containing parameters
+        star : Star
+            Star object containing parameters
+        A : array
+            Albedo spectrum on lam
+        Fs : array or None
+            TOA stellar flux on lam (W/m**2/um), or (Ntarget, Nlam) fluxes
+            for array-valued targets. If None, the blackbody flux of the
+            star at the planet's semi-major axis is used (see starflux()).
+
+        Returns
+        -------
+        output : Output
+            Output object holding the count rates
+        """
+        lam, dlam, diam, X, q = self.lam, self.dlam, self.diam, self.X, self.q
+
+        # Planet and Stellar Parameters
+        alpha, Phi, Rp, r, d, Nez, Teff, Rs = \
+            [_expand(p) for p in (planet.alpha, planet.Phi, planet.Rp, planet.a,
+                                  planet.distance, planet.Nez, star.Teff, star.Rs)]
+
+        # Set throughput
+        sep  = r/d*np.sin(alpha*np.pi/180.)*np.pi/180./3600. # separation in radians
+        T = set_throughput(lam, self.Tput, diam, sep, self.IWA, self.OWA,
+                           self.lammin, FIX_OWA=self.FIX_OWA, SILENT=self.SILENT)
+        if self.GROUND:
+            # Multiply telescope throughput by atmospheric throughput
+            T = T * self.Tatmos
+
+        # Compute fluxes
+        Fs = self.starflux(Fs, Teff, Rs, r)
+        Fp = Fplan(A, Phi, Fs, Rp, d)         # planet flux at telescope
+        Cratio = FpFs(A, Phi, Rp, r)
+
+        ##### Compute count rates #####
+        cp     =  cplan(q, self.fpa, T, lam, dlam, Fp, diam)                   # planet count rate
+        cz     =  czodi(q, X, T, lam, dlam, diam, planet.MzV)                  # solar system zodi count rate
+        cez    =  cezodi(q, X, T, lam, dlam, diam, r, \
+            Fstar(lam,Teff,Rs,1.,AU=True), Nez, planet.MezV)                   # exo-zodi count rate
+        csp    =  cspeck(q, T, self.C, lam, dlam, Fstar(lam,Teff,Rs,d), diam)  # speckle count rate
+        cD, cR, cth = self.cD, self.cR, self.cth
+
+        cb = (cz + cez + csp + cD + cR + cth)
+        cnoise =  cp + 2*cb                # assumes background subtraction
+
+        # Exposure time to SNR
+        DtSNR = exptime_element(lam, cp, cnoise, self.wantsnr)
+
+        # Give all per-target outputs the full broadcast shape
+        Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR = \
+            [np.array(x) for x in np.broadcast_arrays(Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR)]
+
+        # Cram all the coronagraph output arrays into an Output object
+        return Output(lam=lam, dlam=dlam, A=A, q=q, Cratio=Cratio,
+                      cp=cp, csp=csp, cz=cz, cez=cez, cD=cD, cR=cR,
+                      cth=cth, DtSNR=DtSNR)
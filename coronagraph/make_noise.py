@@ -1,8 +1,9 @@
 # Import dependent modules
 import numpy as np
-from .degrade_spec import degrade_spec
+from .degrade_spec import degrade_spec, RebinOperator
 from .convolve_spec import convolve_spec
-from .noise_routines import Fstar, Fplan, FpFs, cplan, czodi, cezodi, cspeck, cdark, cread, ctherm, ccic, f_airy
+from .noise_routines import Fstar, Fplan, FpFs, cplan, czodi, cezodi, cspeck, cdark, cread, ctherm, ccic, f_airy, \
+    construct_lam
 import pdb
 
 def make_noise(Ahr, lamhr, solhr, telescope, planet, star, wantsnr=10.0, FIX_OWA = False, COMPUTE_LAM = False,\
@@ -87,23 +88,8 @@ def make_noise(Ahr, lamhr, solhr, telescope, planet, star, wantsnr=10.0, FIX_OWA
 
     # Set wavelength grid
     if COMPUTE_LAM:
-        lam  = lammin #in [um]
-        Nlam = 1
-        while (lam < lammax):
-            lam  = lam + lam/Res
-            Nlam = Nlam +1
-        lam    = np.zeros(Nlam)
-        lam[0] = lammin
-        for j in range(1,Nlam):
-            lam[j] = lam[j-1] + lam[j-1]/Res
+        lam, dlam = construct_lam(lammin, lammax, Res)
         Nlam = len(lam)
-        dlam = np.zeros(Nlam) #grid widths (um)
-        # Set wavelength widths
-        for j in range(1,Nlam-1):
-            dlam[j] = 0.5*(lam[j+1]+lam[j]) - 0.5*(lam[j-1]+lam[j])
-        #widths at edges are same as neighbor
-        dlam[0] = dlam[1]
-        dlam[Nlam-1] = dlam[Nlam-2]
     elif IMAGE:
         pass
     else:
@@ -159,8 +145,10 @@ def make_noise(Ahr, lamhr, solhr, telescope, planet, star, wantsnr=10.0, FIX_OWA
 
     # Degrade albedo and stellar spectrum
     if COMPUTE_LAM:
-        A = degrade_spec(Ahr,lamhr,lam,dlam=dlam)
-        Fs = degrade_spec(solhr, lamhr, lam, dlam=dlam)
+        # Both spectra share the hi-res grid, so reuse one cached operator
+        rebin = RebinOperator.cached(lamhr, lam, dlam=dlam)
+        A = rebin(Ahr)
+        Fs = rebin(solhr)
     elif IMAGE:
         # Convolve with filter response
         A = convolve_spec(Ahr, lamhr, filters)
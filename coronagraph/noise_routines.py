@@ -1,8 +1,9 @@
 import numpy as np
 import scipy as sp
 from scipy import special
-from numba import jit
 import os
+from functools import partial
+from .utils import load_table, LRUCache, hash_arrays, get_cache_dir, save_npy
 
 __all__ = ["Fstar", "Fplan", "FpFs", "cplan", "czodi", "cezodi", "cspeck", "cdark",
            "cread", "ccic", "f_airy", "f_airy_int", "ctherm", "ctherm_earth",
@@ -151,8 +152,7 @@ def cezodi(q, X, T, lam, dlam, D, r, Fstar, Nez, Mezv, SUN=False, CIRC=False):
         Teffs  = 5778.   # Sun effective temperature
         Rs  = 1.       # Sun radius (in solar radii)
         #Fsol  = Fstar(lam, Teffs, Rs, 1., AU=True)  # Sun as blackbody (W/m**2/um)
-    rat   = np.zeros(len(lam))
-    rat[:]= Fstar[:]/FsolV # ratio of solar flux to V-band solar flux
+    rat   = Fstar/FsolV # ratio of solar flux to V-band solar flux
     if CIRC:
         # circular aperture size (arcsec**2)
         Omega = np.pi*(X/2.*lam*1e-6/D*180.*3600./np.pi)**2.
@@ -258,74 +258,107 @@ def ccic(Rc, X, lam, D, theta, DNhpix, Dtmax, IMAGE=False, CIRC=False):
     return Npix/(Dtmax*3600.)*Rc
 
 
-def f_airy(X, CIRC=False):
+def f_airy(X, CIRC=False, obscuration=0.0):
     """
     fraction of Airy power contained in square or circular aperture
     --------
     X - size of photometric aperture (lambda/D)
     CIRC - keyword to use a circular aperture
+    obscuration - central obscuration (fraction of the telescope diameter)
 
     f_airy - fraction of power in Airy pattern of size X*lambda/D
     """
-    if CIRC:
+    if CIRC and obscuration == 0:
         # Circular aperture
         # fraction of power in Airy disk to X*lambda/D
         fpa = 1. - special.jv(0,np.pi*X)**2. - special.jv(1,np.pi*X)**2.
+    elif CIRC:
+        # Obscured pupil, from the tabulated numerical integral
+        fpa = f_airy_int(X, aperture="circular", obscuration=obscuration)
     else:
-        # Square aperture
-        X_grid   = np.arange(100)/10.
-        # fpa on grid, computed using code below
-        fpa_grid = \
-            [ 0.00000,    0.0309038,     0.117701,     0.244285,     0.388709,     0.528808,\
-             0.647304,     0.734911,     0.790813,     0.820765,     0.833866,     0.839249,\
-             0.843710,     0.850753,     0.860930,     0.872944,     0.884901,     0.895255,\
-             0.903243,     0.908880,     0.912712,     0.915504,     0.917992,     0.920720,\
-             0.923959,     0.927698,     0.931686,     0.935540,     0.938892,     0.941519,\
-             0.943427,     0.944836,     0.946081,     0.947471,     0.949178,     0.951186,\
-             0.953330,     0.955383,     0.957163,     0.958591,     0.959709,     0.960639,\
-             0.961530,     0.962501,     0.963607,     0.964837,     0.966128,     0.967391,\
-             0.968543,     0.969532,     0.970352,     0.971048,     0.971696,     0.972377,\
-             0.973147,     0.974014,     0.974941,     0.975857,     0.976696,     0.977418,\
-             0.978026,     0.978559,     0.979075,     0.979627,     0.980241,     0.980912,\
-             0.981611,     0.982297,     0.982935,     0.983505,     0.984008,     0.984464,\
-             0.984904,     0.985360,     0.985853,     0.986387,     0.986949,     0.987510,\
-             0.988040,     0.988519,     0.988944,     0.989331,     0.989707,     0.990099,\
-             0.990524,     0.990983,     0.991459,     0.991931,     0.992376,     0.992783,\
-             0.993154,     0.993502,     0.993844,     0.994197,     0.994571,     0.994966,\
-             0.995376,     0.995784,     0.996176,     0.996542]
-        fpa = np.interp(X, X_grid, fpa_grid)
+        # Square aperture, from the tabulated numerical integral
+        fpa = f_airy_int(X, aperture="square", obscuration=obscuration)
     return fpa
 
-def f_airy_int(X):
+# In-memory copies of the f_airy_int tables
+_airy_cache = LRUCache(8)
+
+def f_airy_int(X, aperture="square", obscuration=0.0, dX=0.01):
     """
-    numerical integration to determine fraction of Airy power
-    contained square aperture (SLOW!)
+    fraction of Airy power contained in a square or circular aperture,
+    by numerical integration of the point spread function of a (centrally
+    obscured) circular pupil
     --------
-
-    X - size of photometric aperture (lambda/D)
+    X - size of photometric aperture (lambda/D): half-width of a square
+        aperture or radius of a circular one. Scalar or array.
+    aperture - "square" or "circular"
+    obscuration - central obscuration (fraction of the telescope diameter)
+    dX - resolution of the integration grid (lambda/D)
 
     f_airy - fraction of Airy power in aperture of size X*lambda/D
+
+    The integral is tabulated on a grid from 0 to the next multiple of
+    10 lambda/D above max(X) in a single array operation and interpolated
+    to X. Tables are kept in memory and saved to get_cache_dir()/airy/.
+    """
+    if aperture not in ("square", "circular"):
+        raise ValueError("aperture must be 'square' or 'circular'")
+    Xmax = 10. * max(np.ceil(np.max(X) / 10.), 1.)
+    key = (aperture, float(obscuration), float(dX), Xmax)
+    fpa_grid = _airy_cache.get(key)
+    if fpa_grid is None:
+        fn = os.path.join(get_cache_dir(), "airy",
+                          "f_airy_%s_obs%.6g_dX%.6g_X%.6g.npy" % key)
+        try:
+            fpa_grid = np.load(fn)
+        except (IOError, OSError, ValueError):
+            fpa_grid = _airy_table(aperture, obscuration, dX, Xmax)
+            save_npy(fn, fpa_grid)
+        fpa_grid.flags.writeable = False
+        _airy_cache.set(key, fpa_grid)
+    X_grid = dX * np.arange(len(fpa_grid))
+    return np.interp(X, X_grid, fpa_grid)
+
+def _airy_table(aperture, obscuration, dX, Xmax):
     """
-    N = 1000      # sets horizontal and vertical grid resolution
-    E0 = 1.27324  # total power contained in Airy pattern
-    xg = X * np.arange(N) / (N-1)   # horizontal grid
-    yg = X * np.arange(N) / (N-1)   # vertical grid
-    Iairy = np.zeros([N,N])
-    for i in range(N):
-        for j in range(N):
-            # compute Airy intensity
-            Iairy[i,j] = 4. * special.jv(1,np.pi*np.sqrt(xg[i]**2. + yg[j]**2.))**2. \
-            /(np.pi*np.sqrt(xg[i]**2. + yg[j]**2.))**2.
-    Iairy[0,0] = 1.0
-    E     = 0.0
-    # area of each dxdy element
-    dA    = (X/N)**2.
-    for i in range(N):
-        for j in range(N):
-            # sum intensities
-            E = E + Iairy[i,j]*dA
-    E = 4.*E # factor of 4 as integral only over one quadrant
-    fpa   = E/E0
+    Fraction of Airy power within apertures of size 0, dX, 2*dX, ... Xmax
+    (lambda/D), integrating the PSF with the midpoint rule on cells of
+    width dX (square) or dX/10 (circular).
+    """
+    eps = obscuration
+    E0 = 4. / np.pi * (1. - eps**2.)  # total power contained in Airy pattern
+
+    def Iairy(r):
+        # PSF of the obscured pupil, normalized to the unobscured peak
+        x = np.pi * r
+        amp = 2. * special.j1(x) / x
+        if eps > 0:
+            amp -= eps**2. * 2. * special.j1(eps * x) / (eps * x)
+        return amp**2.
+
+    M = int(round(Xmax / dX))
+    if aperture == "square":
+        # Cell midpoints in one quadrant
+        u = (np.arange(M) + 0.5) * dX
+        # Power in the (k+1)-th square minus the k-th is the L-shaped
+        # strip of row k and column k (equal by symmetry), i.e. twice the
+        # sum of row k up to the diagonal less the diagonal cell. Rows are
+        # summed in blocks to bound memory.
+        strip = np.empty(M)
+        block = max(1, 2**20 // M)
+        for k0 in range(0, M, block):
+            k1 = min(k0 + block, M)
+            k = np.arange(k0, k1)
+            I = Iairy(np.sqrt(u[k,np.newaxis]**2. + u[np.newaxis,:k1]**2.))
+            I[np.arange(k1)[np.newaxis,:] > k[:,np.newaxis]] = 0.
+            strip[k0:k1] = 2. * np.sum(I, axis=1) - I[k - k0, k]
+        E = 4. * np.cumsum(strip) * dX**2.
+    else:
+        sub = 10
+        r = (np.arange(M * sub) + 0.5) * dX / sub
+        E = np.cumsum(Iairy(r) * 2. * np.pi * r) * dX / sub
+        E = E[sub-1::sub]
+    return np.concatenate([[0.], E / E0])
 
 def ctherm(q, X, lam, dlam, D, Tsys, emis):
     '''
@@ -365,7 +398,9 @@ def ctherm_earth(q, X, lam, dlam, D, Itherm):
     Omega = np.pi*(X*lam*1.e-6/D)**2. # aperture size (sr**2)
     return np.pi*q*dlam*Itherm*Omega*(lam*1.e-6/hc)*(D/2)**2.
 
-@jit
+# Wavelength grids returned by construct_lam
+_lam_cache = LRUCache(32)
+
 def construct_lam(lammin, lammax, Res):
     """
     Construct wavelength grid.
@@ -378,28 +413,56 @@ def construct_lam(lammin, lammax, Res):
         Maximum wavelength [microns]
     Res : float
         Resolving power (lambda / delta-lambda)
+
+    Returns
+    -------
+    lam : array
+        Wavelength grid [microns], lam[j] = lammin*(1+1/Res)**j, extending
+        to the first point >= lammax (two points if lammin >= lammax)
+    dlam : array
+        Grid widths [microns]
+
+    Note
+    ----
+    Grids are computed in closed form and cached, so the returned arrays
+    are read-only; copy them before modifying. See also WavelengthGrid.
     """
-    # Set wavelength grid
-    lam  = lammin #in [um]
-    Nlam = 1
-    while (lam < lammax):
-        lam  = lam + lam/Res
-        Nlam = Nlam +1
-    lam    = np.zeros(Nlam)
-    lam[0] = lammin
-    for j in range(1,Nlam):
-        lam[j] = lam[j-1] + lam[j-1]/Res
+    key = (float(lammin), float(lammax), float(Res))
+    grid = _lam_cache.get(key)
+    if grid is None:
+        grid = _construct_lam(*key)
+        for arr in grid:
+            arr.flags.writeable = False
+        _lam_cache.set(key, grid)
+    return grid
+
+def _construct_lam(lammin, lammax, Res):
+    """
+    Geometric series equivalent to lam[j] = lam[j-1] + lam[j-1]/Res.
+    """
+    g = 1. + 1./Res
+    # Smallest number of steps reaching lammax, corrected for rounding in
+    # the logarithms. At least one step is taken, so lammin >= lammax gives
+    # the two-point grid [lammin, lammin*g] (the original while loop took
+    # no steps there and failed on its one-point grid)
+    k = max(int(np.ceil(np.log(lammax/lammin)/np.log(g))), 1)
+    while (k > 1) and (lammin*g**(k-1) >= lammax):
+        k -= 1
+    while lammin*g**k < lammax:
+        k += 1
+    lam = lammin*g**np.arange(k+1)
     Nlam = len(lam)
-    dlam = np.zeros(Nlam) #grid widths (um)
+    if Nlam == 2:
+        # No interior points; both widths are the single grid step
+        return lam, np.diff(lam).repeat(2)
+    dlam = np.empty(Nlam) #grid widths (um)
     # Set wavelength widths
-    for j in range(1,Nlam-1):
-        dlam[j] = 0.5*(lam[j+1]+lam[j]) - 0.5*(lam[j-1]+lam[j])
+    dlam[1:-1] = 0.5*(lam[2:] - lam[:-2])
     #widths at edges are same as neighbor
     dlam[0] = dlam[1]
     dlam[Nlam-1] = dlam[Nlam-2]
     return lam, dlam
 
-@jit
 def set_quantum_efficiency(lam, qe, NIR=False, qe_nir=0.9):
     """
 
@@ -410,14 +473,10 @@ def set_quantum_efficiency(lam, qe, NIR=False, qe_nir=0.9):
     q_nir : float (optional)
         NIR quantum efficiency
     """
-    Nlam = len(lam)
-    q = np.zeros(Nlam)
-    for j in range(Nlam):
-        if (lam[j] <= 0.7):
-            q[j] = qe
-        else:
-            q[j] = qe*(1.0 - (lam[j]-0.7)/(1.0-0.7))
-    if q[j] < 0.0: q[j] = 0.
+    lam = np.asarray(lam)
+    # Flat to 0.7 um, then falling linearly to zero at 1 um
+    q = np.where(lam <= 0.7, qe, qe*(1.0 - (lam-0.7)/(1.0-0.7)))
+    q = np.clip(q, 0., None)
 
     if NIR:
         iNIR  = (lam > 1.0)
@@ -500,14 +559,10 @@ def set_lenslet(lam, lammin, diam,
     lammin_nir : float (optional)
         Wavelength min to use for NIR lenslet size
     """
-    Nlam = len(lam)
     if NIR:
-        theta = np.zeros(Nlam)
-        iVIS  = (lam <= 1.0)
-        iNIR  = (lam > 1.0)
-        theta[iVIS] = lammin/1e6/diam/2.*(180/np.pi*3600.)
-        # If there are wavelength bins longer than 1um:
-        theta[iNIR] = lammin_nir/1e6/diam/2.*(180/np.pi*3600.)
+        # Wavelength bins longer than 1um use the NIR lenslet size
+        lamref = np.where(lam <= 1.0, lammin, lammin_nir)
+        theta = lamref/1e6/diam/2.*(180/np.pi*3600.)
     else:
         theta = lammin/1.e6/diam/2.*(180/np.pi*3600.) # assumes sampled at ~lambda/2D (arcsec)
 
@@ -542,19 +597,20 @@ def set_throughput(lam, Tput, diam, sep, IWA, OWA, lammin,
     Nlam = len(lam)
     T    = Tput + np.zeros(Nlam)
     iIWA = ( sep < IWA*lam/diam/1.e6 )
-    if (True if True in iIWA else False):
-        T[iIWA] = 0. #zero transmission for points inside IWA have no throughput
+    if np.any(iIWA):
+        T = np.where(iIWA, 0., T) #zero transmission for points inside IWA have no throughput
         if ~SILENT:
             print 'WARNING: portions of spectrum inside IWA'
     if FIX_OWA:
-        if ( sep > OWA*lammin/diam/1.e6 ):
-            T[:] = 0. #planet outside OWA, where there is no throughput
+        iOWA = ( sep > OWA*lammin/diam/1.e6 )
+        if np.any(iOWA):
+            T = np.where(iOWA, 0., T) #planet outside OWA, where there is no throughput
             if ~SILENT:
                 print 'WARNING: planet outside fixed OWA'
     else:
         iOWA = ( sep > OWA*lam/diam/1.e6 )
-        if (True if True in iOWA else False):
-            T[iOWA] = 0. #points outside OWA have no throughput
+        if np.any(iOWA):
+            T = np.where(iOWA, 0., T) #points outside OWA have no throughput
             if ~SILENT:
                 print 'WARNING: portions of spectrum outside OWA'
     return T
@@ -572,14 +628,16 @@ def set_atmos_throughput(lam, dlam, convolve, plot=False):
         Wavelength bin width grid
     convolve : func
         Function used to degrade/downbin spectrum
+
+    Note
+    ----
+    Results are memoized per (site table, wavelength grid, convolve); the
+    returned array is read-only.
     """
-    # Read in earth transmission file
+    # Read in earth transmission file and degrade atmospheric transmission
+    # to wavelength gridpoints (or reuse a previous result on this grid)
     fn = os.path.join(os.path.dirname(__file__), "ground/earth_transmission_atacama_30deg.txt")
-    tdata = np.genfromtxt(fn, skip_header=5)
-    wl_atmos = tdata[:,0]
-    Tatmoshr = tdata[:,1]
-    # Degrade atmospheric transmission to wavelength gridpoints
-    Tatmos = convolve(Tatmoshr, wl_atmos,lam,dlam=dlam)
+    Tatmos = _degrade_ground_table(fn, 5, lam, dlam, convolve)
     if plot:
         import matplotlib.pyplot as plt; from matplotlib import gridspec
         fig1 = plt.figure(figsize=(8,6))
@@ -603,18 +661,43 @@ def get_thermal_ground_intensity(lam, dlam, convolve):
         Wavelength bin width grid
     convolve : func
         Function used to degrade/downbin spectrum
+
+    Note
+    ----
+    Results are memoized per (site table, wavelength grid, convolve); the
+    returned array is read-only.
     """
-    # Read in earth thermal data
+    # Read in earth thermal data and degrade earth thermal flux
+    # (or reuse a previous result on this grid)
     fn = os.path.join(os.path.dirname(__file__), "ground/earth_thermal_atacama_30deg.txt")
-    tdata = np.genfromtxt(fn, skip_header=6)
-    wl_therm = tdata[:,0]  # um
-    Fthermhr = tdata[:,1]  # W/m^2/um
-    # Degrade earth thermal flux
-    Ftherm = convolve(Fthermhr, wl_therm,lam,dlam=dlam)
+    Ftherm = _degrade_ground_table(fn, 6, lam, dlam, convolve)
     # Compute intensity
     Itherm  = Ftherm / np.pi
+    Itherm.flags.writeable = False
     return Itherm
 
+# Degraded site products, keyed by table identity and wavelength grid
+_ground_cache = LRUCache(maxsize=32)
+
+def _degrade_ground_table(fn, skip_header, lam, dlam, convolve):
+    """
+    Degrade the second column of a ground/ site table onto (lam, dlam) with
+    convolve, memoizing the result in a bounded LRU cache.
+    """
+    # Partial functions are rebuilt on every call, so key on their contents
+    if isinstance(convolve, partial):
+        ckey = (convolve.func, convolve.args, tuple(sorted(convolve.keywords.items())))
+    else:
+        ckey = convolve
+    key = (fn, skip_header, os.path.getmtime(fn), hash_arrays(lam, dlam), ckey)
+    specLO = _ground_cache.get(key)
+    if specLO is None:
+        tdata = load_table(fn, skip_header=skip_header)
+        specLO = np.asarray(convolve(tdata[:,1], tdata[:,0], lam, dlam=dlam))
+        specLO.flags.writeable = False
+        _ground_cache.set(key, specLO)
+    return specLO
+
 def exptime_element(lam, cp, cn, wantsnr):
     """
     Calculate the exposure time (in hours) to get a specified signal-to-noise.
@@ -635,7 +718,8 @@ def exptime_element(lam, cp, cn, wantsnr):
     DtSNR : ndarray
         Exposure time necessary to get specified SNR [hours]
     """
-    DtSNR = np.zeros(len(lam))
+    cp, cn = np.broadcast_arrays(cp, cn)
+    DtSNR = np.zeros(cp.shape)
     i = (cp > 0.)
     j = (cp <= 0.0)
     DtSNR[i] = (wantsnr**2.*cn[i])/cp[i]**2./3600. # (hr)
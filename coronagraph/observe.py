@@ -1,14 +1,12 @@
 import numpy as np
-import matplotlib as mpl
-import matplotlib.pyplot as plt
-from matplotlib import gridspec
-from matplotlib import rc
 import os
-rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
-mpl.rcParams['font.size'] = 20.0
 
 from .make_noise import make_noise
+from .cache import cached_make_noise
 from .teleplanstar import Telescope, Planet, Star
+from .planetlib import PlanetLibrary, PLANETZOO
+from .smart import read_rad
+from .utils import import_pyplot
 
 planetdir = "planets/"
 relpath = os.path.join(os.path.dirname(__file__), planetdir)
@@ -70,130 +68,20 @@ def planetzoo_observation(name='earth', telescope=Telescope(), planet=Planet(),
     startype = planet.star
     tag = name
 
-    if True:
-
-        #if whichplanet == 'earth':
-        fn = 'earth_quadrature_radiance_refl.dat'
-        model = np.loadtxt(os.path.join(planetdir,fn), skiprows=8)
-        lamhr = model[:,0]
-        radhr = model[:,1]
-        solhr = model[:,2]
-        reflhr = model[:,3]
-        Ahr   = np.pi*(np.pi*radhr/solhr) # hi-resolution reflectivity
-        planet.Rp    = 1.0     # Earth radii
-        planet.r     = 1.0     # semi-major axis (AU)
-
-        if whichplanet == 'venus':
-            fn = 'Venus_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 0.95     #Earth radii
-            planet.r     = 0.72     #semi-major axis (AU)
-
-        if whichplanet == 'archean':
-            fn = 'ArcheanEarth_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 1.0     #Earth radii
-            planet.r     = 1.0     #semi-major axis (AU)
-
-        if whichplanet == 'earlymars':
-            fn = 'EarlyMars_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 0.53     #Earth radii
-            planet.r     = 1.52     #semi-major axis (AU)
-
-        if whichplanet == 'hazyarchean':
-            fn = 'Hazy_ArcheanEarth_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 1.0     #Earth radii
-            planet.r     = 1.0     #semi-major axis (AU)
-
-        if whichplanet == 'earlyvenus':
-            fn = 'EarlyVenus_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 0.95     #Earth radii
-            planet.r     = 0.72     #semi-major axis (AU)
-
-        if whichplanet == 'jupiter':
-            fn = planetdir+'Jupiter_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 10.86     #Earth radii
-            planet.r     = 5.20     #semi-major axis (AU)
-
-        if whichplanet == 'saturn':
-            fn = planetdir+'Saturn_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 9.00     #Earth radii
-            planet.r     = 9.54     #semi-major axis (AU)
-
-        if whichplanet == 'uranus':
-            fn = 'Uranus_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 3.97     #Earth radii
-            planet.r     = 19.19     #semi-major axis (AU)
-
-
-        if whichplanet == 'warmuranus':
-            fn = 'Uranus_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 3.97     #Earth radii
-            planet.r     = 5.20     #semi-major axis (AU)
-
-        if whichplanet == 'warmneptune':
-            fn = 'Neptune_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 3.97     #Earth radii
-            planet.r     = 5.20     #semi-major axis (AU)
-
-        if whichplanet == 'neptune':
-            fn = 'Neptune_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 3.85     #Earth radii
-            planet.r     = 30.07     #semi-major axis (AU)
-
-
-        if whichplanet == 'mars':
-            fn = 'Mars_geo_albedo.txt'
-            model = np.loadtxt(os.path.join(planetdir,fn))
-            lamhr = model[:,0]
-            Ahr   = model[:,1]
-            planet.Rp    = 0.53     #Earth radii
-            planet.r     = 1.52     #semi-major axis (AU)
-
-        if whichplanet == 'fstarozone':
-            print('fstarozone functionality not yet added')
-            #fn = 'fstarcloudy.sav'
-            #fn = 'F2V_5.e-1fCO2_1.e6H2Volc_1.e10BIF.out_toa.rad'
-            #READCOL, 'planets/'+fn, lamhr, wnhr, sunhr, fluxhr
-            #restore, 'planets/'+fn
-            #lamhr = reverse(wl_)
-            #ahr = reverse(cloudyalb_)
-            #Ahr = (2/3.) * fluxhr/(sunhr/2.) #geometric albedo & phase corrections
-            #Rp    = 1.0     #Earth radii
-            #r     = 1.72    #semi-major axis (AU)
-
-
+    # Load the hi-res spectrum from the planet zoo library
+    planets = PlanetLibrary.cached(planetdir)
+    if whichplanet == 'fstarozone':
+        print('fstarozone functionality not yet added')
+    if whichplanet not in PLANETZOO:
+        # Default to the Earth model
+        whichplanet = 'earth'
+    lamhr, Ahr, solhr = planets.load(whichplanet)
+    if solhr is None:
+        # Use the stellar spectrum of the Earth model
+        solhr = planets.load('earth')[2]
+    info = planets.info(whichplanet)
+    planet.Rp    = info['Rp']     # Earth radii
+    planet.r     = info['a']      # semi-major axis (AU)
 
     # star parameters
     if startype == '':
@@ -211,7 +99,7 @@ def planetzoo_observation(name='earth', telescope=Telescope(), planet=Planet(),
     # Shawn: "I don't like noise.  It makes me sad."
 
     lam, dlam, A, q, Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR \
-        = make_noise(Ahr, lamhr, solhr, telescope, planet, star, COMPUTE_LAM=True, THERMAL=THERMAL)
+        = cached_make_noise(Ahr, lamhr, solhr, telescope, planet, star, COMPUTE_LAM=True, THERMAL=THERMAL)
 
     # Calculate background photon count rate
     cb = (cz + cez + csp + cD + cR + cth)
@@ -287,9 +175,10 @@ def generate_observation(wlhr, Ahr, solhr, itime, telescope, planet, star,
     If savedata=True then data will be saved
     """
 
-    # Skip call_noise and just call: noise
+    # Skip call_noise and just call: noise (memoized, so re-running the same
+    # configuration, e.g. with a different itime, reuses the count rates)
     lam, dlam, A, q, Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR = \
-        make_noise(Ahr, wlhr, solhr, telescope, planet, star, wantsnr=wantsnr, COMPUTE_LAM=True, THERMAL=THERMAL)
+        cached_make_noise(Ahr, wlhr, solhr, telescope, planet, star, wantsnr=wantsnr, COMPUTE_LAM=True, THERMAL=THERMAL)
 
     # Calculate background photon count rate
     cb = (cz + cez + csp + cD + cR + cth)
@@ -356,7 +245,8 @@ def smart_observation(radfile, itime, telescope, planet, star,
     sig : array
         One sigma errorbars on albedo spectrum
     rwl : array
-        Wavelength grid of SMART output
+        Wavelength grid of SMART output (within the telescope bandpass in
+        Spectroscopy mode)
     Ahr : array
         Albedo grid of SMART output
 
@@ -366,17 +256,14 @@ def smart_observation(radfile, itime, telescope, planet, star,
     If savedata=True then data will be saved
     """
 
-    # try importing readsmart
-    try:
-        import readsmart as rs
-    except ImportError:
-        print "Module 'readsmart' not found. Please install on your local machine \
-        to proceed with this function. The source can be found at: \
-        https://github.com/jlustigy/readsmart"
-        return None, None, None, None, None
-
-    # Read-in .rad file
-    wlhr, wno, solar_spec, TOA_flux, rad_streams = rs.rad(radfile,getdata=True)
+    # Read-in .rad file, keeping only the wavelengths observed by a
+    # spectrograph (plus two spectral elements on either side for degrading)
+    if telescope.mode == 'Imaging':
+        lammin, lammax = None, None
+    else:
+        lammin = telescope.lammin * (1. - 2./telescope.resolution)
+        lammax = telescope.lammax * (1. + 2./telescope.resolution)
+    wlhr, wno, solar_spec, TOA_flux, rad_streams = read_rad(radfile, lammin=lammin, lammax=lammax)
 
     # Calculate Hi-res reflectivity spectrum
     Ahr = (TOA_flux / solar_spec) #* np.pi / planet.Phi
@@ -385,7 +272,7 @@ def smart_observation(radfile, itime, telescope, planet, star,
 
     # Skip call_noise and just call: noise
     lam, dlam, A, q, Cratio, cp, csp, cz, cez, cD, cR, cth, DtSNR = \
-        make_noise(Ahr, wlhr, solar_spec, telescope, planet, star, wantsnr=wantsnr, COMPUTE_LAM=True, THERMAL=THERMAL)
+        cached_make_noise(Ahr, wlhr, solar_spec, telescope, planet, star, wantsnr=wantsnr, COMPUTE_LAM=True, THERMAL=THERMAL)
 
     # Calculate background photon count rate
     cb = (cz + cez + csp + cD + cR + cth)
@@ -444,6 +331,7 @@ def plot_spec():
     if tmax > Amax: Amax = tmax
     #ymin,ymax = np.min(A), np.max(A)
     plot_tag = 'observed_smart_'+tag+'.pdf'
+    mpl, plt, gridspec = import_pyplot()
     fig = plt.figure(figsize=(15,10))
     gs = gridspec.GridSpec(1, 1)
     ax0 = plt.subplot(gs[0])
@@ -477,6 +365,7 @@ def plot_coronagraph_spectrum(wl, ofrat, sig, itime, d, ref_lam, SNR,
                               save=False, tag=""):
 
     # Set matplotlib params
+    mpl, plt, gridspec = import_pyplot()
     mpl.rc('font', family='Times New Roman')
     mpl.rcParams['font.size'] = 25.0
 
@@ -521,7 +410,7 @@ def plot_coronagraph_spectrum(wl, ofrat, sig, itime, d, ref_lam, SNR,
     else:
         plt.show()
 
-def process_noise(Dt, Cratio, cp, cb):
+def process_noise(Dt, Cratio, cp, cb, Nreal=None, rng=None):
     """
     Computes SNR, noised data, and error on noised data.
 
@@ -535,15 +424,27 @@ def process_noise(Dt, Cratio, cp, cb):
         Planet Photon count rate in each spectral bin
     cb : array
         Background Photon count rate in each spectral bin
+    Nreal : int (optional)
+        Number of noise realizations to draw. If None, a single realization
+        with the shape of Cratio is returned.
+    rng : numpy.random.Generator (optional)
+        Random number generator (or RandomState) to draw from; the global
+        np.random state is used if None
 
     Returns
     -------
     cont : array
-        Noised Planet/Star flux ratio in each spectral bin
+        Noised Planet/Star flux ratio in each spectral bin, with shape
+        (Nreal, Nlam) if Nreal is given
     sigma : array
         One-sigma errors on flux ratio in each spectral bin
     SNR : array
         Signal-to-noise ratio in each spectral bin
+
+    Note
+    ----
+    Use iter_noise() to stream realizations in chunks when Nreal is too
+    large to hold in memory.
     """
 
     # Calculate signal-to-noise assuming background subtraction (the "2")
@@ -553,10 +454,140 @@ def process_noise(Dt, Cratio, cp, cb):
     sigma= Cratio/SNR
 
     # Add gaussian noise to flux ratio
-    cont = Cratio + np.random.randn(len(Cratio))*sigma
+    if (Nreal is None) and (rng is None):
+        cont = Cratio + np.random.randn(len(Cratio))*sigma
+    else:
+        cont = _draw_noise(Cratio, sigma, Nreal, rng)
 
     return cont, sigma, SNR
 
+def iter_noise(Dt, Cratio, cp, cb, Nreal, chunksize=10000, rng=None):
+    """
+    Generator form of process_noise() for many noise realizations: yields the
+    noised Planet/Star flux ratio in chunks of shape (chunksize, Nlam) (the
+    last chunk may be smaller), Nreal realizations in total.
+
+    Parameters
+    ----------
+    Dt, Cratio, cp, cb :
+        As in process_noise()
+    Nreal : int
+        Total number of noise realizations
+    chunksize : int (optional)
+        Number of realizations per chunk
+    rng : numpy.random.Generator (optional)
+        Random number generator (or RandomState) to draw from; the global
+        np.random state is used if None
+
+    Example
+    -------
+    >>> rng = np.random.default_rng(42)
+    >>> for cont in iter_noise(Dt, Cratio, cp, cb, 1000000, rng=rng):
+    ...     save(cont)
+    """
+    SNR  = cp*Dt/np.sqrt((cp + 2*cb)*Dt)
+    sigma= Cratio/SNR
+    for i in range(0, Nreal, chunksize):
+        yield _draw_noise(Cratio, sigma, min(chunksize, Nreal - i), rng)
+
+def _draw_noise(Cratio, sigma, Nreal, rng):
+    """
+    Cratio plus gaussian noise of standard deviation sigma, for Nreal
+    realizations (stacked along a new first axis) or one if Nreal is None.
+    """
+    shape = np.broadcast(Cratio, sigma).shape
+    if Nreal is not None:
+        shape = (Nreal,) + shape
+    if rng is None:
+        cont = np.random.standard_normal(shape)
+    else:
+        cont = rng.standard_normal(shape)
+    cont *= sigma
+    cont += Cratio
+    return cont
+
+def process_noise_poisson(Dt, Cratio, cp, cb, Nreal=None, rng=None,
+                          threshold=1000.):
+    """
+    Computes SNR, photon-counting noised data, and error on noised data.
+
+    Simulates the roll-subtraction observation assumed by the "2" in the
+    background noise: two exposures of Dt/2 at different telescope roll
+    angles, subtracted so that each planet image is accompanied by the
+    background from the other exposure. Planet counts in the two apertures
+    and background counts in the apertures and in the subtracted reference
+    pixels are drawn separately from Poisson distributions. Any expected
+    count above threshold is drawn from the Gaussian approximation
+    N(n, sqrt(n)) instead, which is much faster for bright targets.
+
+    Parameters
+    ----------
+    Dt : float
+        Telescope integration time in seconds (both exposures)
+    Cratio : array
+        Planet/Star flux ratio in each spectral bin
+    cp : array
+        Planet Photon count rate in each spectral bin
+    cb : array
+        Background Photon count rate in each spectral bin
+    Nreal : int (optional)
+        Number of noise realizations to draw. If None, a single realization
+        with the shape of Cratio is returned.
+    rng : numpy.random.Generator (optional)
+        Random number generator (or RandomState) to draw from; the global
+        np.random state is used if None
+    threshold : float (optional)
+        Expected number of counts above which a Gaussian is used
+
+    Returns
+    -------
+    cont : array
+        Noised Planet/Star flux ratio in each spectral bin, with shape
+        (Nreal, Nlam) if Nreal is given
+    sigma : array
+        One-sigma errors on flux ratio in each spectral bin
+    SNR : array
+        Signal-to-noise ratio in each spectral bin
+    """
+    if rng is None:
+        rng = np.random
+
+    # Calculate signal-to-noise assuming background subtraction (the "2")
+    SNR  = cp*Dt/np.sqrt((cp + 2*cb)*Dt)
+
+    # Calculate 1-sigma errors
+    sigma= Cratio/SNR
+
+    shape = np.broadcast(Cratio, cp, cb).shape
+    if Nreal is not None:
+        shape = (Nreal,) + shape
+
+    # Expected counts summed over both exposures: planet, background in
+    # the planet apertures, and background in the subtracted reference
+    Np = np.broadcast_to(cp*Dt, shape)
+    Nb = np.broadcast_to(cb*Dt, shape)
+    counts = _draw_counts(Np, rng, threshold)
+    counts += _draw_counts(Nb, rng, threshold)
+    counts -= _draw_counts(Nb, rng, threshold)
+
+    # Scale background-subtracted planet counts to flux ratio
+    cont = Cratio * counts / (cp*Dt)
+
+    return cont, sigma, SNR
+
+def _draw_counts(n, rng, threshold):
+    """
+    Poisson draws with mean n, using N(n, sqrt(n)) where n > threshold.
+    """
+    counts = np.empty(n.shape)
+    big = n > threshold
+    if np.any(big):
+        counts[big] = n[big] + np.sqrt(n[big])*rng.standard_normal(np.count_nonzero(big))
+    small = ~big
+    if np.any(small):
+        counts[small] = rng.poisson(n[small])
+    return counts
+
 def calc_SNR(itime, cp, cb, poisson=2.):
 
     cnoise = cp + poisson*cb
@@ -0,0 +1,255 @@
+# Import dependent modules
+import numpy as np
+import copy
+from .teleplanstar import Planet, lambertPhaseFunction
+from .instrument import Instrument
+
+# Days per year, for Kepler's third law
+YEAR = 365.25
+
+def solve_kepler(M, e, tol=1e-12, maxiter=50):
+    """
+    Solve Kepler's equation M = E - e*sin(E) for the eccentric anomaly,
+    by Newton iteration on all elements at once.
+
+    Parameters
+    ----------
+    M : float or array
+        Mean anomaly (radians)
+    e : float or array
+        Eccentricity (0 <= e < 1), broadcastable against M
+    tol : float (optional)
+        Convergence tolerance on E (radians)
+    maxiter : int (optional)
+        Maximum number of Newton iterations
+
+    Returns
+    -------
+    E : array
+        Eccentric anomaly (radians), in [0, 2*pi)
+    """
+    M = np.mod(M, 2.*np.pi)
+    e = np.asarray(e, dtype=float)
+    # Starting guess that converges for all eccentricities
+    E = np.where(e < 0.8, M, np.pi) + np.zeros_like(e)
+    for i in range(maxiter):
+        dE = (E - e*np.sin(E) - M) / (1. - e*np.cos(E))
+        E = E - dE
+        if np.all(np.abs(dE) < tol):
+            break
+    else:
+        print("WARNING: Kepler's equation did not converge in %i iterations" % maxiter)
+    return E
+
+def orbit_geometry(M, a, e=0., i=90., Omega=0., omega=0.):
+    """
+    Planet-star distance, phase angle and sky-projected offsets at given
+    mean anomalies. All arguments broadcast against each other.
+
+    Parameters
+    ----------
+    M : float or array
+        Mean anomaly (radians)
+    a : float or array
+        Semi-major axis (AU)
+    e : float or array
+        Eccentricity
+    i : float or array
+        Inclination (deg), 90 for an edge-on orbit
+    Omega : float or array
+        Longitude of the ascending node (deg)
+    omega : float or array
+        Argument of periastron (deg)
+
+    Returns
+    -------
+    r : array
+        Planet-star distance (AU)
+    alpha : array
+        Phase angle (deg)
+    x, y : array
+        Sky-projected offsets of the planet from the star (AU)
+
+    Note
+    ----
+    The line of sight points away from the observer, so alpha = 0 (full
+    phase) when the planet is behind the star.
+    """
+    E = solve_kepler(M, e)
+    e = np.asarray(e, dtype=float)
+    # True anomaly and distance from the star
+    nu = 2.*np.arctan2(np.sqrt(1. + e)*np.sin(E/2.), np.sqrt(1. - e)*np.cos(E/2.))
+    r = a*(1. - e*np.cos(E))
+    # Rotate the orbit onto the sky
+    i, Omega, omega = [np.asarray(x, dtype=float)*np.pi/180. for x in (i, Omega, omega)]
+    cosO, sinO = np.cos(Omega), np.sin(Omega)
+    cosu, sinu = np.cos(omega + nu), np.sin(omega + nu)
+    x = r*(cosO*cosu - sinO*sinu*np.cos(i))
+    y = r*(sinO*cosu + cosO*sinu*np.cos(i))
+    # Phase angle from the line-of-sight component, sinu*sin(i)
+    alpha = np.arccos(np.clip(sinu*np.sin(i), -1., 1.))*180./np.pi
+    return r, alpha, x, y
+
+class Orbit(object):
+    """
+    Keplerian orbit of a planet, evaluated at many epochs at once.
+
+    Parameters
+    ----------
+    a : float
+        Semi-major axis (AU)
+    e : float (optional)
+        Eccentricity
+    i : float (optional)
+        Inclination (deg), 90 for an edge-on orbit
+    Omega : float (optional)
+        Longitude of the ascending node (deg)
+    omega : float (optional)
+        Argument of periastron (deg)
+    tp : float (optional)
+        Time of periastron passage (days)
+    P : float (optional)
+        Orbital period (days), from Kepler's third law if not given
+    Mstar : float (optional)
+        Stellar mass (solar masses), used if P is not given
+
+    Note
+    ----
+    Methods take times t (days) as a float or array and return arrays of
+    the same shape, so phase curves and observability windows are
+    evaluated without looping over epochs. Elements may also be arrays
+    that broadcast against t.
+    """
+
+    def __init__(self, a, e=0., i=90., Omega=0., omega=0., tp=0., P=None, Mstar=1.):
+        self.a = a
+        self.e = e
+        self.i = i
+        self.Omega = Omega
+        self.omega = omega
+        self.tp = tp
+        if P is None:
+            P = YEAR*np.sqrt(np.asarray(a, dtype=float)**3/Mstar)
+        self.P = P
+
+    def __str__(self):
+        string = 'Orbit: \n------\n'+\
+            '- Semi-major axis (AU) : '+"%s" % (self.a)+'\n'+\
+            '- Eccentricity : '+"%s" % (self.e)+'\n'+\
+            '- Inclination (deg) : '+"%s" % (self.i)+'\n'+\
+            '- Longitude of ascending node (deg) : '+"%s" % (self.Omega)+'\n'+\
+            '- Argument of periastron (deg) : '+"%s" % (self.omega)+'\n'+\
+            '- Time of periastron (days) : '+"%s" % (self.tp)+'\n'+\
+            '- Period (days) : '+"%s" % (self.P)
+        return string
+
+    def mean_anomaly(self, t):
+        """
+        Mean anomaly (radians) at times t (days)
+        """
+        return 2.*np.pi*(np.asarray(t, dtype=float) - self.tp)/self.P
+
+    def geometry(self, t):
+        """
+        Planet-star distance (AU), phase angle (deg) and sky-projected
+        offsets x, y (AU) at times t (days), see orbit_geometry()
+        """
+        return orbit_geometry(self.mean_anomaly(t), self.a, e=self.e, i=self.i,
+                              Omega=self.Omega, omega=self.omega)
+
+    def phase_angle(self, t):
+        """
+        Phase angle (deg) at times t (days)
+        """
+        return self.geometry(t)[1]
+
+    def Phi(self, t):
+        """
+        Lambertian phase function at times t (days)
+        """
+        return lambertPhaseFunction(self.phase_angle(t))
+
+    def separation(self, t, d=None):
+        """
+        Projected planet-star separation at times t (days), in AU, or in
+        arcsec if the distance to the system d (pc) is given.
+        """
+        r, alpha, x, y = self.geometry(t)
+        sep = np.sqrt(x**2 + y**2)
+        if d is not None:
+            sep = sep / d
+        return sep
+
+    def planet(self, t, planet=None):
+        """
+        Planet at times t (days)
+
+        Parameters
+        ----------
+        t : float or array
+            Times (days)
+        planet : Planet (optional)
+            Planet whose other parameters (distance, radius, zodis, ...) are
+            kept; a default Planet if not given
+
+        Returns
+        -------
+        planet : Planet
+            Copy of planet with array-valued a (the planet-star distance,
+            AU), alpha and Phi, one element per epoch
+        """
+        if planet is None:
+            planet = Planet()
+        r, alpha, x, y = self.geometry(t)
+        planet = copy.copy(planet)
+        planet.a = r
+        planet.alpha = alpha
+        return planet
+
+def phase_curve(orbit, t, telescope, planet, star, spectrum, wantsnr=10.0, **kwargs):
+    """
+    Photon count rates of a planet along its orbit, evaluated for every
+    epoch in one vectorized pass.
+
+    Parameters
+    ----------
+    orbit : Orbit
+        Orbit of the planet
+    t : array
+        Times (days)
+    telescope : Telescope or Instrument
+        Telescope object, or an Instrument to reuse
+    planet : Planet
+        Planet object; its distance, radius and zodis are used, its a and
+        alpha are replaced by the orbit
+    star : Star
+        Star object containing parameters
+    spectrum : Spectrum
+        Spectrum object (or any object with wl, spec and starflux
+        attributes). The stellar flux is taken to be that at the orbit's
+        semi-major axis and is scaled by (a/r)**2 along the orbit; if
+        starflux is None, the blackbody flux of the star at r is used.
+    wantsnr, **kwargs
+        Passed to Instrument() when a Telescope is given
+
+    Returns
+    -------
+    output : Output
+        Output object whose Cratio, count rates and DtSNR have shape
+        t.shape + (Nlam,). Epochs with the planet inside the IWA or outside
+        the OWA have zero planet counts (infinite DtSNR).
+    """
+    if isinstance(telescope, Instrument):
+        inst = telescope
+    else:
+        kwargs.setdefault("SILENT", True)
+        inst = Instrument(telescope, wantsnr=wantsnr, **kwargs)
+
+    # Degrade the spectra once for all epochs
+    A, Fs = inst.degrade(spectrum)
+
+    planet = orbit.planet(t, planet=planet)
+    if Fs is not None:
+        r = np.asarray(planet.a)[..., np.newaxis]
+        Fs = Fs * (np.asarray(orbit.a)[..., np.newaxis] / r)**2
+    return inst.evaluate_degraded(planet, star, A, Fs)
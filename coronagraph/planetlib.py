@@ -0,0 +1,246 @@
+# Import dependent modules
+import numpy as np
+import os
+import json
+import hashlib
+from collections import OrderedDict
+from .utils import LRUCache, get_cache_dir, save_npy
+
+relpath = os.path.join(os.path.dirname(__file__), "planets/")
+
+# Bundled planet spectra: name : (file, Rp [Earth radii], a [AU])
+PLANETZOO = OrderedDict([
+    ("earth",       ("earth_quadrature_radiance_refl.dat", 1.0, 1.0)),
+    ("venus",       ("Venus_geo_albedo.txt", 0.95, 0.72)),
+    ("archean",     ("ArcheanEarth_geo_albedo.txt", 1.0, 1.0)),
+    ("earlymars",   ("EarlyMars_geo_albedo.txt", 0.53, 1.52)),
+    ("hazyarchean", ("Hazy_ArcheanEarth_geo_albedo.txt", 1.0, 1.0)),
+    ("earlyvenus",  ("EarlyVenus_geo_albedo.txt", 0.95, 0.72)),
+    ("jupiter",     ("Jupiter_geo_albedo.txt", 10.86, 5.20)),
+    ("saturn",      ("Saturn_geo_albedo.txt", 9.00, 9.54)),
+    ("uranus",      ("Uranus_geo_albedo.txt", 3.97, 19.19)),
+    ("warmuranus",  ("Uranus_geo_albedo.txt", 3.97, 5.20)),
+    ("warmneptune", ("Neptune_geo_albedo.txt", 3.97, 5.20)),
+    ("neptune",     ("Neptune_geo_albedo.txt", 3.85, 30.07)),
+    ("mars",        ("Mars_geo_albedo.txt", 0.53, 1.52)),
+])
+
+# Name of the library container (spectra) and its index
+LIBNAME = "planetzoo"
+
+class PlanetLibrary(object):
+    """
+    Planet zoo spectra stored in a single indexed binary container.
+
+    On first use the text spectra in planetdir are parsed once and packed
+    into one .npy file of concatenated spectra plus a small JSON index of
+    offsets and planet metadata. Later libraries only read the index;
+    the container is memory-mapped on the first load() and each planet is a
+    slice of it, so loading a planet does not parse any text.
+
+    Parameters
+    ----------
+    planetdir : str (optional)
+        Location of planets/ directory
+    planets : OrderedDict (optional)
+        Planet name : (file, Rp, a) table, defaults to PLANETZOO
+
+    Attributes
+    ----------
+    names : list
+        Planets whose spectra are available in planetdir
+
+    Note
+    ----
+    The container is written next to the text spectra if possible,
+    otherwise in get_cache_dir(), and is rebuilt if any text spectrum is
+    modified. Use PlanetLibrary.cached() to share libraries between calls.
+    """
+
+    # Libraries shared between calls, keyed by planetdir
+    _cache = LRUCache(maxsize=4)
+
+    def __init__(self, planetdir=relpath, planets=None):
+        if planets is None:
+            planets = PLANETZOO
+        self.planetdir = os.path.abspath(planetdir)
+        self.planets = planets
+        self._data = None
+        self._spectra = {}
+        self._index = self._open_index()
+        self.names = [name for name in self.planets
+                      if self.planets[name][0] in self._index["files"]]
+
+    @classmethod
+    def cached(cls, planetdir=relpath):
+        """
+        Return the library for this planetdir, constructing it only if it is
+        not already in the LRU cache.
+        """
+        key = os.path.abspath(planetdir)
+        lib = cls._cache.get(key)
+        if lib is None:
+            lib = cls(planetdir)
+            cls._cache.set(key, lib)
+        return lib
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def info(self, name):
+        """
+        Metadata of a planet
+
+        Parameters
+        ----------
+        name : str
+            Name of the planet
+
+        Returns
+        -------
+        info : dict
+            file, Rp (Earth radii), a (AU), number of hi-res points N, and
+            whether the spectrum has a matching stellar spectrum (solhr)
+        """
+        self._check(name)
+        fn, Rp, a = self.planets[name]
+        entry = self._index["files"][fn]
+        return {"file": fn, "Rp": Rp, "a": a, "N": entry["shape"][1],
+                "solhr": entry["shape"][0] > 2}
+
+    def load(self, name):
+        """
+        Hi-res spectrum of a planet
+
+        Parameters
+        ----------
+        name : str
+            Name of the planet
+
+        Returns
+        -------
+        lamhr : array
+            Wavelength grid (um)
+        Ahr : array
+            Geometric albedo spectrum
+        solhr : array or None
+            Stellar flux spectrum on lamhr, if the model provides one
+
+        Note
+        ----
+        The arrays are read-only views of the memory-mapped container.
+        """
+        self._check(name)
+        fn = self.planets[name][0]
+        spec = self._spectra.get(fn)
+        if spec is None:
+            if self._data is None:
+                self._data = np.load(self._container, mmap_mode="r")
+            entry = self._index["files"][fn]
+            nrow, ncol = entry["shape"]
+            block = self._data[entry["offset"]:entry["offset"] + nrow*ncol]
+            block = block.reshape(nrow, ncol)
+            spec = (block[0], block[1], block[2] if nrow > 2 else None)
+            self._spectra[fn] = spec
+        return spec
+
+    def __getitem__(self, name):
+        return self.load(name)
+
+    def _check(self, name):
+        if name not in self.names:
+            raise KeyError("Planet '%s' is not available in %s. Choose from: %s"
+                           % (name, self.planetdir, ", ".join(self.names)))
+
+    def _sources(self):
+        # Size and modification time of each text spectrum in planetdir
+        sources = {}
+        for name in self.planets:
+            fn = self.planets[name][0]
+            path = os.path.join(self.planetdir, fn)
+            if fn not in sources and os.path.exists(path):
+                st = os.stat(path)
+                sources[fn] = [st.st_size, st.st_mtime]
+        return sources
+
+    def _open_index(self):
+        sources = self._sources()
+
+        # Container next to the text spectra, then in the user cache directory
+        # (where it is prefixed by a hash of planetdir)
+        dirhash = hashlib.sha1(self.planetdir.encode("utf-8")).hexdigest()[:12]
+        candidates = [os.path.join(self.planetdir, LIBNAME),
+                      os.path.join(get_cache_dir(), "planets", dirhash + "_" + LIBNAME)]
+
+        # Use an up-to-date container if one exists
+        for base in candidates:
+            try:
+                with open(base + ".json") as f:
+                    index = json.load(f)
+            except (IOError, OSError, ValueError):
+                continue
+            if index.get("sources") == sources and os.path.exists(base + ".npy"):
+                self._container = base + ".npy"
+                return index
+
+        # Otherwise parse the text spectra and try to write a container
+        data, index = _build(self.planetdir, sources)
+        for base in candidates:
+            if save_npy(base + ".npy", data) and _save_json(base + ".json", index):
+                self._container = base + ".npy"
+                return index
+
+        # Keep the parsed spectra in memory if nothing can be written
+        self._data = data
+        self._container = None
+        return index
+
+def _read_spectrum(path):
+    """
+    Parse a planet zoo text spectrum into rows of lamhr, Ahr (and solhr for
+    SMART radiance models).
+    """
+    if path.endswith(".dat"):
+        # SMART quadrature radiance model
+        model = np.loadtxt(path, skiprows=8)
+        lamhr = model[:,0]
+        radhr = model[:,1]
+        solhr = model[:,2]
+        Ahr   = np.pi*(np.pi*radhr/solhr) # hi-resolution reflectivity
+        return np.array([lamhr, Ahr, solhr])
+    model = np.loadtxt(path)
+    return np.array([model[:,0], model[:,1]])
+
+def _build(planetdir, sources):
+    """
+    Pack the text spectra into one flat array and its index.
+    """
+    blocks = []
+    files = {}
+    offset = 0
+    for fn in sorted(sources):
+        block = _read_spectrum(os.path.join(planetdir, fn))
+        files[fn] = {"offset": offset, "shape": list(block.shape)}
+        offset += block.size
+        blocks.append(block.ravel())
+    data = np.concatenate(blocks) if blocks else np.zeros(0)
+    return data, {"sources": sources, "files": files}
+
+def _save_json(fn, obj):
+    """
+    Atomically write a JSON file. Returns False if it can't be written.
+    """
+    try:
+        tmp = "%s.%d.tmp" % (fn, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(obj, f)
+        os.rename(tmp, fn)
+    except (IOError, OSError):
+        return False
+    return True
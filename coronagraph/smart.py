@@ -0,0 +1,180 @@
+# Import dependent modules
+import numpy as np
+from .degrade_spec import DownbinAccumulator
+
+# Bytes of text parsed per chunk
+CHUNKSIZE = 2**22
+
+def iter_rad(radfile, lammin=None, lammax=None, chunksize=CHUNKSIZE):
+    """
+    Read a SMART .rad file in chunks, keeping only the rows between lammin
+    and lammax.
+
+    Parameters
+    ----------
+    radfile : str
+        Path to SMART .rad file
+    lammin : float (optional)
+        Minimum wavelength to keep [microns]
+    lammax : float (optional)
+        Maximum wavelength to keep [microns]
+    chunksize : int (optional)
+        Number of bytes of text parsed at a time
+
+    Yields
+    ------
+    rows : array
+        (N, Ncol) block of rows: wavelength (um), wavenumber (cm^-1), solar
+        flux, TOA flux, followed by the radiance streams
+
+    Note
+    ----
+    Each chunk is parsed with numpy's C text parser. Header lines (anything
+    before the first all-numeric line) are skipped, and reading stops early
+    once a monotonic file has passed out of [lammin, lammax].
+    """
+    if lammin is None:
+        lammin = -np.inf
+    if lammax is None:
+        lammax = np.inf
+
+    with open(radfile, "rb") as f:
+        # Skip header lines and count the columns of the first data line
+        ncol = None
+        while ncol is None:
+            line = f.readline()
+            if not line:
+                return
+            ncol = _count_columns(line)
+        rest = line
+
+        # Direction of the wavelength grid (+1, -1), and whether it has
+        # been monotonic so far
+        direction = 0.
+        monotonic = True
+        last = None
+        while True:
+            buf = f.read(chunksize)
+            if buf:
+                # Parse up to the last complete line
+                cut = buf.rfind(b"\n") + 1
+                if cut == 0:
+                    rest += buf
+                    continue
+                text = rest + buf[:cut]
+                rest = buf[cut:]
+            else:
+                text = rest
+                rest = b""
+            if text.strip():
+                rows = _parse(text, ncol)
+                lam = rows[:,0]
+                mask = (lam >= lammin) & (lam <= lammax)
+                if mask.any():
+                    yield rows[mask]
+
+                # Stop once a monotonic file has moved past the range
+                if monotonic and len(lam) > 0:
+                    steps = np.diff(lam if last is None else np.hstack([last, lam]))
+                    if direction == 0 and np.any(steps != 0):
+                        direction = np.sign(steps[steps != 0][0])
+                    monotonic = bool(np.all(steps * direction >= 0))
+                    last = lam[-1]
+                    if monotonic and ((direction > 0 and last > lammax) or
+                                      (direction < 0 and last < lammin)):
+                        return
+            if not buf:
+                return
+
+def read_rad(radfile, lammin=None, lammax=None, chunksize=CHUNKSIZE):
+    """
+    Read a SMART .rad file, keeping only wavelengths between lammin and lammax.
+
+    Drop-in replacement for readsmart.rad(radfile, getdata=True) that never
+    holds more than one chunk of the file's text in memory.
+
+    Parameters
+    ----------
+    radfile : str
+        Path to SMART .rad file
+    lammin : float (optional)
+        Minimum wavelength to keep [microns]
+    lammax : float (optional)
+        Maximum wavelength to keep [microns]
+    chunksize : int (optional)
+        Number of bytes of text parsed at a time
+
+    Returns
+    -------
+    wl : array
+        Wavelength grid (um)
+    wno : array
+        Wavenumber grid (cm^-1)
+    solar_spec : array
+        Solar flux spectrum
+    TOA_flux : array
+        Top-of-atmosphere flux spectrum
+    rad_streams : array
+        (N, Nstreams) radiance streams
+    """
+    blocks = list(iter_rad(radfile, lammin=lammin, lammax=lammax, chunksize=chunksize))
+    if len(blocks) > 0:
+        data = np.concatenate(blocks)
+    else:
+        data = np.zeros((0, 4))
+    return data[:,0], data[:,1], data[:,2], data[:,3], data[:,4:]
+
+def downbin_rad(radfile, lam, dlam, chunksize=CHUNKSIZE):
+    """
+    Stream a SMART .rad file straight onto a low-res wavelength grid,
+    averaging the hi-res points in each bin as in downbin_spec().
+
+    Parameters
+    ----------
+    radfile : str
+        Path to SMART .rad file
+    lam : array
+        Low-res wavelength grid (um)
+    dlam : array
+        Low-res wavelength bin widths (um)
+    chunksize : int (optional)
+        Number of bytes of text parsed at a time
+
+    Returns
+    -------
+    A : array
+        Reflectivity (TOA flux / solar flux) on lam
+    solar_spec : array
+        Solar flux spectrum on lam
+    """
+    acc = DownbinAccumulator(lam, dlam, Nspec=2)
+    for rows in iter_rad(radfile, lammin=acc.lammin, lammax=acc.lammax,
+                         chunksize=chunksize):
+        acc.add(rows[:,0], np.array([rows[:,3] / rows[:,2], rows[:,2]]))
+    A, solar_spec = acc.result()
+    return A, solar_spec
+
+def _count_columns(line):
+    """
+    Number of numeric columns on a line, or None if it is not all numeric.
+    """
+    fields = line.split()
+    if len(fields) == 0:
+        return None
+    try:
+        [float(x.replace(b"D", b"E").replace(b"d", b"e")) for x in fields]
+    except ValueError:
+        return None
+    return len(fields)
+
+def _parse(text, ncol):
+    """
+    Parse whitespace-delimited numeric text into an (N, ncol) array.
+    """
+    if b"D" in text or b"d" in text:
+        # Fortran double precision exponents
+        text = text.replace(b"D", b"E").replace(b"d", b"e")
+    values = np.fromstring(text, dtype=float, sep=" ")
+    if values.size % ncol != 0:
+        raise ValueError("Malformed .rad file: expected %i columns per row" % ncol)
+    return values.reshape(-1, ncol)
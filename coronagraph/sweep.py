@@ -0,0 +1,209 @@
+# Import dependent modules
+import numpy as np
+import itertools
+import multiprocessing
+from .instrument import Instrument
+
+def sweep(telescopes, planets, stars, spectra, wantsnr=10.0, FIX_OWA=False,
+          NIR=True, THERMAL=False, GROUND=False, SILENT=True,
+          convolution_method="downbin", max_workers=None, chunksize=None):
+    """
+    Compute count rates over the cartesian product of telescopes, planets and
+    stars, sharding the grid across a pool of worker processes.
+
+    Parameters
+    ----------
+    telescopes : iterable of Telescope
+        Telescope objects
+    planets : iterable of Planet
+        Planet objects
+    stars : iterable of Star
+        Star objects
+    spectra : Spectrum or iterable of Spectrum
+        Hi-res spectra (any object with wl, spec and starflux attributes).
+        Either a single Spectrum used for every planet, or one per planet.
+    wantsnr, FIX_OWA, NIR, THERMAL, GROUND, SILENT, convolution_method :
+        Passed to Instrument
+    max_workers : int (optional)
+        Number of worker processes (default: number of CPUs). Uses
+        concurrent.futures where available and a multiprocessing.Pool on
+        Python 2. With max_workers=1 the grid is run serially in this
+        process, as it is (with a warning) if no worker processes can be
+        started.
+    chunksize : int (optional)
+        Number of grid points submitted per task (default: enough for ~4
+        tasks per worker)
+
+    Returns
+    -------
+    outputs : list of Output
+        One Output per grid point, ordered as
+        itertools.product(telescopes, planets, stars)
+
+    Note
+    ----
+    Each worker builds one Instrument per telescope and reuses it for every
+    planet and star. The hi-res spectra are placed in shared memory (Python
+    3.8+) so they are copied to the workers once, not pickled per task.
+    """
+    telescopes, planets, stars = list(telescopes), list(planets), list(stars)
+    if hasattr(spectra, "wl"):
+        spectra = [spectra] * len(planets)
+    else:
+        spectra = list(spectra)
+    if len(spectra) != len(planets):
+        raise ValueError("Provide a single Spectrum or one Spectrum per planet.")
+
+    grid = list(itertools.product(range(len(telescopes)), range(len(planets)),
+                                  range(len(stars))))
+    kwargs = dict(wantsnr=wantsnr, FIX_OWA=FIX_OWA, SILENT=SILENT, NIR=NIR,
+                  THERMAL=THERMAL, GROUND=GROUND,
+                  convolution_method=convolution_method)
+
+    # Imported here to keep them out of `import coronagraph`
+    try:
+        from concurrent.futures import ProcessPoolExecutor
+    except ImportError:
+        ProcessPoolExecutor = None
+    try:
+        from multiprocessing import shared_memory
+    except ImportError:
+        shared_memory = None
+
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+    if (max_workers == 1) or (len(grid) <= 1):
+        return _run_serial(grid, telescopes, planets, stars, spectra, kwargs)
+
+    if chunksize is None:
+        chunksize = max(1, int(np.ceil(len(grid) / (4. * max_workers))))
+    chunks = [grid[i:i+chunksize] for i in range(0, len(grid), chunksize)]
+
+    if ProcessPoolExecutor is None:
+        # Python 2: a multiprocessing pool, sending the packed spectra to
+        # each worker once through its initializer
+        try:
+            pool = multiprocessing.Pool(processes=max_workers,
+                                        initializer=_init_worker,
+                                        initargs=(telescopes, planets, stars,
+                                                  _pack_spectra(spectra), kwargs))
+        except (OSError, ImportError, ValueError) as e:
+            print("WARNING: could not start worker processes (%s), running sweep serially" % e)
+            return _run_serial(grid, telescopes, planets, stars, spectra, kwargs)
+        try:
+            results = pool.map(_run_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+        return [output for chunk in results for output in chunk]
+
+    # Put all spectra in a single shared block, if available
+    shm = None
+    packed = _pack_spectra(spectra)
+    if shared_memory is not None:
+        flat, layout = packed
+        shm = shared_memory.SharedMemory(create=True, size=max(flat.nbytes, 1))
+        np.ndarray(flat.shape, dtype=flat.dtype, buffer=shm.buf)[:] = flat
+        packed = ((shm.name, flat.shape), layout)
+        del flat
+
+    try:
+        pool = ProcessPoolExecutor(max_workers=max_workers,
+                                   initializer=_init_worker,
+                                   initargs=(telescopes, planets, stars,
+                                             packed, kwargs))
+        with pool:
+            futures = [pool.submit(_run_chunk, chunk) for chunk in chunks]
+            outputs = []
+            for future in futures:
+                outputs.extend(future.result())
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+
+    return outputs
+
+def _run_serial(grid, telescopes, planets, stars, spectra, kwargs):
+    """
+    Evaluate the whole grid in this process.
+    """
+    _init_worker(telescopes, planets, stars, _pack_spectra(spectra), kwargs)
+    try:
+        return _run_chunk(grid)
+    finally:
+        _worker.clear()
+
+def _pack_spectra(spectra):
+    """
+    Concatenate the wl, spec and starflux arrays of the distinct Spectrum
+    objects into one flat float64 array, returning it with, for each entry
+    in spectra, the (offset, length) of its three arrays (None for a
+    missing starflux).
+    """
+    chunks = []
+    layout = []
+    seen = {}
+    offset = 0
+    for s in spectra:
+        if id(s) not in seen:
+            entry = []
+            for arr in (s.wl, s.spec, s.starflux):
+                if arr is None:
+                    entry.append(None)
+                    continue
+                arr = np.asarray(arr, dtype=np.float64).ravel()
+                chunks.append(arr)
+                entry.append((offset, len(arr)))
+                offset += len(arr)
+            seen[id(s)] = tuple(entry)
+        layout.append(seen[id(s)])
+    flat = np.concatenate(chunks) if chunks else np.zeros(0)
+    return flat, layout
+
+class _SharedSpectrum(object):
+    """
+    Read-only view of a spectrum in the worker's shared block.
+    """
+    def __init__(self, wl, spec, starflux):
+        self.wl = wl
+        self.spec = spec
+        self.starflux = starflux
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+def _init_worker(telescopes, planets, stars, packed, kwargs):
+    """
+    Attach to the shared spectra and store the grid axes for _run_chunk.
+    """
+    flat, layout = packed
+    if not isinstance(flat, np.ndarray):
+        # (name, shape) of a shared memory block
+        from multiprocessing import shared_memory
+        name, shape = flat
+        shm = shared_memory.SharedMemory(name=name)
+        flat = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        _worker["shm"] = shm
+    flat.flags.writeable = False
+    spectra = []
+    for entry in layout:
+        wl, spec, starflux = [None if e is None else flat[e[0]:e[0]+e[1]]
+                              for e in entry]
+        spectra.append(_SharedSpectrum(wl, spec, starflux))
+    _worker.update(telescopes=telescopes, planets=planets, stars=stars,
+                   spectra=spectra, kwargs=kwargs, instruments={})
+
+def _run_chunk(chunk):
+    """
+    Evaluate a list of (telescope, planet, star) index triples.
+    """
+    instruments = _worker["instruments"]
+    outputs = []
+    for it, ip, js in chunk:
+        if it not in instruments:
+            instruments[it] = Instrument(_worker["telescopes"][it], **_worker["kwargs"])
+        outputs.append(instruments[it].evaluate(_worker["planets"][ip],
+                                                _worker["stars"][js],
+                                                _worker["spectra"][ip]))
+    return outputs
@@ -1,6 +1,16 @@
 import imp, sys
 from types import ModuleType, FunctionType, StringType
+from collections import OrderedDict
+import hashlib
 import os
+import time
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
 
 inpath = "inputs/"
 relpath = os.path.join(os.path.dirname(__file__), inpath)
@@ -75,3 +85,184 @@ class Loadin(object):
         self.__dict__.update(inp_dict)                                        # Make all parameters accessible as self.param
 
         del self._input
+
+class LRUCache(object):
+    """
+    Small least-recently-used cache mapping hashable keys to values.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries held before the least recently used
+        entry is discarded
+    """
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        # Re-insert to mark as most recently used
+        self._data[key] = value
+        return value
+
+    def set(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+def import_pyplot():
+    """
+    Import matplotlib for plotting on first use (so that importing
+    coronagraph does not), applying the package's plot settings once.
+
+    Returns
+    -------
+    mpl, plt, gridspec : modules
+        matplotlib, matplotlib.pyplot and matplotlib.gridspec
+    """
+    import matplotlib as mpl
+    import matplotlib.pyplot as plt
+    from matplotlib import gridspec
+    if not _pyplot_configured:
+        mpl.rc('font', **{'family': 'serif', 'serif': ['Computer Modern']})
+        mpl.rcParams['font.size'] = 20.0
+        _pyplot_configured.append(True)
+    return mpl, plt, gridspec
+
+_pyplot_configured = []
+
+@contextmanager
+def profile_stage(profile, name):
+    """
+    Context manager recording the wall time (s) and peak memory allocated
+    (bytes, via tracemalloc; None on Python 2) by the code in its block as
+    profile[name] = {"time": ..., "alloc": ...}. Times and allocations of a
+    repeated stage name are summed. Does nothing if profile is None.
+
+    Note that tracing allocations slows down pure-Python code, so stage
+    times are somewhat inflated while profiling.
+    """
+    if profile is None:
+        yield
+        return
+    started = False
+    if tracemalloc is not None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            started = True
+        elif hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        mem0 = tracemalloc.get_traced_memory()[0]
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        dt = time.time() - t0
+        alloc = None
+        if tracemalloc is not None:
+            alloc = max(tracemalloc.get_traced_memory()[1] - mem0, 0)
+            if started:
+                tracemalloc.stop()
+        entry = profile.setdefault(name, {"time": 0., "alloc": None})
+        entry["time"] += dt
+        if alloc is not None:
+            entry["alloc"] = (entry["alloc"] or 0) + alloc
+
+def hash_arrays(*arrays):
+    """
+    Stable hex digest of the contents (dtype, shape, and values) of a sequence
+    of arrays. None entries are allowed and hash distinctly from any array.
+    """
+    h = hashlib.sha1()
+    for a in arrays:
+        if a is None:
+            h.update(b"None;")
+            continue
+        a = np.ascontiguousarray(a)
+        h.update(("%s%s;" % (a.dtype.str, a.shape)).encode("ascii"))
+        h.update(a.tobytes())
+    return h.hexdigest()
+
+def get_cache_dir():
+    """
+    Directory for coronagraph's on-disk caches. Set the CORONAGRAPH_CACHE
+    environment variable to override the default of ~/.cache/coronagraph.
+    """
+    default = os.path.join(os.path.expanduser("~"), ".cache", "coronagraph")
+    return os.environ.get("CORONAGRAPH_CACHE", default)
+
+def load_table(path, skip_header=0):
+    """
+    Read a whitespace-delimited text table, converting it once into a binary
+    .npy sidecar file that is memory-mapped on every later call.
+
+    The sidecar is written next to the text file if possible, otherwise in
+    get_cache_dir(), and is rebuilt whenever the text file is modified after
+    the sidecar was written.
+
+    Parameters
+    ----------
+    path : str
+        Path to text table
+    skip_header : int (optional)
+        Number of header lines to skip, as in np.genfromtxt()
+
+    Returns
+    -------
+    data : ndarray
+        Read-only (memory-mapped) array of the table
+    """
+    path = os.path.abspath(path)
+    mtime = os.path.getmtime(path)
+    name = "%s.skip%d.npy" % (os.path.basename(path), skip_header)
+
+    # Sidecar next to the source file, then in the user cache directory
+    # (where it is prefixed by a hash of the source directory)
+    dirhash = hashlib.sha1(os.path.dirname(path).encode("utf-8")).hexdigest()[:12]
+    candidates = [os.path.join(os.path.dirname(path), name),
+                  os.path.join(get_cache_dir(), "tables", dirhash + "_" + name)]
+
+    # Use an up-to-date sidecar if one exists
+    for fn in candidates:
+        if os.path.exists(fn) and os.path.getmtime(fn) >= mtime:
+            try:
+                return np.load(fn, mmap_mode="r")
+            except (IOError, OSError, ValueError):
+                pass
+
+    # Otherwise parse the text and try to write a sidecar
+    data = np.genfromtxt(path, skip_header=skip_header)
+    for fn in candidates:
+        if save_npy(fn, data):
+            return np.load(fn, mmap_mode="r")
+    return data
+
+def save_npy(fn, data):
+    """
+    Atomically write an array to a .npy file, creating its directory if
+    needed. Returns False (instead of raising) if the file can't be written.
+    """
+    try:
+        if not os.path.isdir(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        tmp = "%s.%d.tmp" % (fn, os.getpid())
+        with open(tmp, "wb") as f:
+            np.save(f, data)
+        os.rename(tmp, fn)
+    except (IOError, OSError):
+        return False
+    return True
@@ -0,0 +1,104 @@
+# Import dependent modules
+import numpy as np
+from .noise_routines import construct_lam
+from .utils import hash_arrays
+
+class WavelengthGrid(object):
+    """
+    Low-res wavelength grid with its bin centers, widths and edges.
+
+    Parameters
+    ----------
+    lam : array
+        Bin centers (um)
+    dlam : array
+        Bin widths (um)
+
+    Attributes
+    ----------
+    lam, dlam : array
+        Read-only bin centers and widths (um)
+    edges : array
+        Read-only bin edges (um), lam - dlam/2 followed by lam[-1] + dlam[-1]/2,
+        as used by downbin_spec()
+    hash : str
+        Stable hex digest of the grid, identical across processes and
+        sessions, for use as a key in downstream caches
+    """
+
+    def __init__(self, lam, dlam):
+        self.lam = _readonly(lam)
+        self.dlam = _readonly(dlam)
+        self.edges = _readonly(np.hstack([self.lam - 0.5*self.dlam,
+                                          self.lam[-1] + 0.5*self.dlam[-1]]))
+        self.hash = hash_arrays(self.lam, self.dlam)
+
+    @classmethod
+    def from_resolution(cls, lammin, lammax, Res):
+        """
+        Grid of constant resolving power, see construct_lam()
+
+        Parameters
+        ----------
+        lammin : float
+            Minimum wavelength [microns]
+        lammax : float
+            Maximum wavelength [microns]
+        Res : float
+            Resolving power (lambda / delta-lambda)
+        """
+        lam, dlam = construct_lam(lammin, lammax, Res)
+        return cls(lam, dlam)
+
+    @classmethod
+    def from_filters(cls, filter_wheel):
+        """
+        Grid of filter band centers and FWHMs, sorted by band center
+
+        Parameters
+        ----------
+        filter_wheel : Wheel
+            Filter wheel of an Imaging mode telescope
+        """
+        tdict = sorted(filter_wheel.__dict__.items(), key=lambda x: x[1].bandcenter)
+        lam = np.array([x[1].bandcenter for x in tdict])
+        dlam = np.array([x[1].FWHM for x in tdict])
+        return cls(lam, dlam)
+
+    @property
+    def centers(self):
+        return self.lam
+
+    @property
+    def widths(self):
+        return self.dlam
+
+    def __len__(self):
+        return len(self.lam)
+
+    def __iter__(self):
+        # Unpack like construct_lam: lam, dlam = grid
+        return iter((self.lam, self.dlam))
+
+    def __eq__(self, other):
+        return isinstance(other, WavelengthGrid) and (self.hash == other.hash)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return int(self.hash[:15], 16)
+
+    def __str__(self):
+        return 'WavelengthGrid: %i bins from %.4g to %.4g um (hash %s)' \
+            % (len(self), self.lam[0], self.lam[-1], self.hash[:12])
+
+def _readonly(x):
+    """
+    Read-only float array of x (not copied if it already is one).
+    """
+    x = np.asarray(x, dtype=float)
+    if x.flags.writeable:
+        x = x.copy()
+        x.flags.writeable = False
+    return x